@@ -0,0 +1,58 @@
+import logging
+from argparse import ArgumentParser
+from functools import partial
+import sys
+
+from es_text_analytics.sigterms_job import SigTermsJob
+from es_text_analytics.term_weight_store import WeightStoreProvider
+
+"""
+Adds the top significant terms of each document in an index as a document field.
+
+Uses the term vector term statistics for weighting by default, or IDF weights from a weight store
+(see build_weight_store.py and export_es_weight_store.py) with --weight-store. Pass --checkpoint to be able to
+resume an interrupted run. The default weighting only works with Elasticsearch 2.x and a single slice.
+"""
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-e', '--elasticsearch-server', default='localhost:9200')
+    parser.add_argument('-i', '--index')
+    parser.add_argument('-t', '--doc-type')
+    parser.add_argument('-f', '--field')
+    parser.add_argument('-o', '--target-field', default='sig_terms')
+    parser.add_argument('-n', '--num-terms', type=int, default=10)
+    parser.add_argument('-w', '--workers', type=int, default=4)
+    parser.add_argument('-s', '--slices', type=int,
+                        help='Number of scroll slices processed in parallel by the workers. More than one slice '
+                             'needs Elasticsearch 5.0+ and --weight-store.')
+    parser.add_argument('-c', '--checkpoint')
+    parser.add_argument('--weight-store')
+    parser.add_argument('--skip-annotated', action='store_true')
+    opts = parser.parse_args()
+
+    if not opts.index or not opts.field:
+        logging.error('--index and --field arguments required ...')
+        parser.print_usage()
+        sys.exit(1)
+
+    provider_factory = None
+
+    if opts.weight_store:
+        provider_factory = partial(WeightStoreProvider, opts.weight_store, inverse=True, sublinear=True,
+                                   missing='ignore')
+
+    job = SigTermsJob([opts.elasticsearch_server], opts.index, opts.doc_type, opts.field,
+                      target_field=opts.target_field, n=opts.num_terms, provider_factory=provider_factory,
+                      n_workers=opts.workers, n_slices=opts.slices, checkpoint_fn=opts.checkpoint,
+                      skip_annotated=opts.skip_annotated)
+    stats = job.run()
+
+    logging.info('Annotated %d documents in %.1f seconds (%.0f docs/s), %d failed, %d not found ...' %
+                 (stats['docs'], stats['seconds'], stats['docs_per_sec'], stats['failed'], stats['not_found']))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,40 @@
+import logging
+from argparse import ArgumentParser
+from StringIO import StringIO
+import timeit
+
+from es_text_analytics.data.aviskorpus import section_1_parser, section_2_parser
+from es_text_analytics.data.aviskorpus_reference import reference_section_1_parser, \
+    reference_section_2_parser, synthetic_section_1, synthetic_section_2
+
+"""
+Benchmarks the Aviskorpus section 1 and 2 parsers against the original reference parsers on synthetic data.
+"""
+
+
+def bench(parser, data, repeat):
+    return min(timeit.repeat(lambda: list(parser(StringIO(data))), number=1, repeat=repeat))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--num-docs', type=int, default=5000)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-l', '--long', action='store_true', help='Use long section 2 articles.')
+    opts = parser.parse_args()
+
+    cases = [('section 1', synthetic_section_1(opts.num_docs), reference_section_1_parser, section_1_parser),
+             ('section 2', synthetic_section_2(opts.num_docs, max_lines=2000 if opts.long else 50),
+              reference_section_2_parser, section_2_parser)]
+
+    for name, data, reference, current in cases:
+        t_ref = bench(reference, data, opts.repeat)
+        t_cur = bench(current, data, opts.repeat)
+
+        print '%s: %.1f MB, reference %.3fs (%.1f MB/s), current %.3fs (%.1f MB/s), speedup %.2fx' % \
+              (name, len(data) / 1e6, t_ref, len(data) / 1e6 / t_ref, t_cur, len(data) / 1e6 / t_cur, t_ref / t_cur)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
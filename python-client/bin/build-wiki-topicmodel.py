@@ -11,6 +11,7 @@ from gensim.models.word2vec import Word2Vec
 from gensim.models.hdpmodel import HdpModel
 from gensim.models.tfidfmodel import TfidfModel
 
+from es_text_analytics.data.cached_dataset import CachedDataset
 from es_text_analytics.data.wikipedia import WikipediaDataset
 from es_text_analytics.data.elasticsearch_dataset import ElasticsearchDataset
 from nltk.corpus import stopwords
@@ -78,6 +79,10 @@ class IterableDataset(object):
         self.vocabulary = vocabulary
 
     def __len__(self):
+        # cached datasets store the count
+        if hasattr(self.dataset, '__len__'):
+            return len(self.dataset)
+
         return sum(1 for _ in self.dataset)
 
     def __iter__(self):
@@ -105,8 +110,17 @@ def main():
     parser.add_argument('-q', '--query', default=None, help='Elasticsearch: Query to use to fetch documents')
     parser.add_argument('--index', help='Elasticsearch: index to read from.')
     parser.add_argument('--doc_type', default='doc', help='Elasticsearch: data type in index.')
+    parser.add_argument('--hosts', default='localhost:9200', help='Elasticsearch: comma separated hosts.')
+    parser.add_argument('--slices', type=int, default=1,
+                        help='Elasticsearch: number of parallel scroll slices. More than one slice needs '
+                             'Elasticsearch 5.0+.')
+    parser.add_argument('--scroll-size', type=int, default=1000, help='Elasticsearch: documents per scroll request.')
     parser.add_argument('--data-dir', help='Directory to save the generated models and vocabularies into.')
     parser.add_argument('--vocab',  help='Prebuilt Vocabulary file. Use this to avoid having to generate one.')
+    parser.add_argument('--cache-dir', help='Cache the normalized documents in this directory on the first pass '
+                                            'and read them from the cache on later passes and runs. The cache is '
+                                            'rebuilt when the dataset options change, changes to the dump file or '
+                                            'index contents are not detected.')
 
     opts = parser.parse_args()
 
@@ -157,14 +171,22 @@ def main():
 
     if data_type == 'es':
         logging.info("Using data type %s with index %s, doc_type %s query %s" % (data_type, index, doc_type, query))
+        # only the article field is used, see normalize_es
         dataset = ElasticsearchDataset(read_index=index, read_doc_type=doc_type, query=query,
-                                       normalize_func=normalize_es)
+                                       normalize_func=normalize_es, hosts=opts.hosts.split(','),
+                                       n_slices=opts.slices, scroll_size=opts.scroll_size,
+                                       source_fields=['article'])
     elif data_type == 'wiki':
         logging.info("Using data type %s with dump_file %s and limit %s" % (data_type, dump_fn, limit))
         dataset = WikipediaDataset(dump_fn=dump_fn, num_articles=limit, normalize_func=normalize_wiki)
     elif data_type == 'file':
         logging.info("Using data type %s with dump_file %s and limit %s" % (data_type, dump_fn, limit))
         dataset = FileDataset(dump_fn=dump_fn, num_articles=limit, normalize_func=normalize_file)
+    if opts.cache_dir:
+        # the options selecting the documents are the cache key, so changing them rebuilds the cache
+        dataset = CachedDataset(dataset, opts.cache_dir,
+                                key='%s %s %s %s %s %s %s' % (data_type, dump_fn, limit, index, doc_type, opts.hosts,
+                                                              query))
     vocab_file = opts.vocab
     vocab = Dictionary()
     sw = set(stopwords.words('norwegian'))
@@ -0,0 +1,24 @@
+import logging
+from argparse import ArgumentParser
+
+from es_text_analytics.data.aviskorpus import build_offset_index
+
+"""
+Script for building the Aviskorpus offset index used for reading shards of the corpus and resuming reading,
+see AviskorpusDataset.
+"""
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-d', '--dataset-fn', required=True, help='Aviskorpus archive file.')
+    parser.add_argument('-o', '--output', required=True, help='Offset index file.')
+    opts = parser.parse_args()
+
+    build_offset_index(opts.dataset_fn, opts.output)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    main()
@@ -20,6 +20,7 @@ from es_text_analytics.tagger import train_hunpos_model, FEATURES_MAP
 #   if omitted.
 # -d, --dataset-file Where to find the NDT dataset. Uses default location if omitted.
 # -l, --language Which language training set to use: nob (bokmål), nno (nynorsk) or both.
+# -c, --cache-dir Read the dataset from a columnar cache in this dedicated directory, built on the first run.
 
 FIELDS = ['form', 'postag', 'feats']
 
@@ -30,6 +31,7 @@ def main():
     parser.add_argument('-m', '--model-file')
     parser.add_argument('-d', '--dataset-file')
     parser.add_argument('-l', '--language', default='nob')
+    parser.add_argument('-c', '--cache-dir')
 
     args = parser.parse_args()
 
@@ -59,9 +61,10 @@ def main():
         lang = None
 
     if dataset_fn:
-        dataset = NDTDataset(dataset_fn=dataset_fn, normalize_func=None, fields=FIELDS, lang=lang)
+        dataset = NDTDataset(dataset_fn=dataset_fn, normalize_func=None, fields=FIELDS, lang=lang,
+                             cache_dir=args.cache_dir)
     else:
-        dataset = NDTDataset(normalize_func=None, fields=FIELDS, lang=lang)
+        dataset = NDTDataset(normalize_func=None, fields=FIELDS, lang=lang, cache_dir=args.cache_dir)
         dataset.install()
 
     pos_norm_func = FEATURES_MAP[features]
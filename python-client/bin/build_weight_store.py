@@ -0,0 +1,30 @@
+import logging
+from argparse import ArgumentParser
+import sys
+
+from es_text_analytics.term_weight_store import weight_store_from_gensim_text
+
+"""
+Compiles a Gensim Dictionary text file (f.ex. from wordcounts_from_dataset.py) into a memory mapped term weight
+store for use with WeightStoreProvider.
+"""
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-i', '--input')
+    parser.add_argument('-o', '--output')
+    parser.add_argument('-m', '--min-count', type=int, default=1)
+    opts = parser.parse_args()
+
+    if not opts.input or not opts.output:
+        logging.error('--input and --output arguments required ...')
+        parser.print_usage()
+        sys.exit(1)
+
+    weight_store_from_gensim_text(opts.input, opts.output, min_count=opts.min_count)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,40 @@
+import logging
+from argparse import ArgumentParser
+import sys
+
+from elasticsearch.client import Elasticsearch
+
+from es_text_analytics.term_weight_store import weight_store_from_es
+
+"""
+Exports the document frequencies of the terms in an Elasticsearch index field to a memory mapped term weight store,
+so the term statistics can be used with WeightStoreProvider without a running Elasticsearch cluster.
+"""
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-e', '--elasticsearch-server', default='localhost:9200')
+    parser.add_argument('-i', '--index')
+    parser.add_argument('-t', '--doc-type')
+    parser.add_argument('-f', '--field')
+    parser.add_argument('-o', '--output')
+    parser.add_argument('-m', '--method', default='partition', choices=['partition', 'composite'])
+    parser.add_argument('-p', '--partition-size', type=int, default=10000)
+    parser.add_argument('-n', '--num-partitions', type=int)
+    opts = parser.parse_args()
+
+    if not opts.index or not opts.field or not opts.output:
+        logging.error('--index, --field and --output arguments required ...')
+        parser.print_usage()
+        sys.exit(1)
+
+    es = Elasticsearch(hosts=[opts.elasticsearch_server], timeout=120)
+
+    weight_store_from_es(es, opts.index, opts.doc_type, opts.field, opts.output, method=opts.method,
+                         partition_size=opts.partition_size, num_partitions=opts.num_partitions)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -23,6 +23,8 @@ def main():
     parser.add_argument('-e', '--elasticsearch-server', default='localhost:9200')
     parser.add_argument('-d', '--dataset')
     parser.add_argument('-s', '--sections')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='Number of concurrent bulk requests.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of parsing processes (aviskorpus).')
     opts = parser.parse_args()
 
     es_hosts = [opts.elasticsearch_server]
@@ -46,7 +48,7 @@ def main():
                 logging.error('Malformed section specification "%s" ...' % dataset_sections)
                 sys.exit(1)
 
-        dataset = AviskorpusDataset(sections=sections, sources=sources)
+        dataset = AviskorpusDataset(sections=sections, sources=sources, n_jobs=opts.jobs)
     elif dataset_name == 'ndt':
         sections = None
         lang = None
@@ -65,7 +67,7 @@ def main():
         logging.error('Unknown dataset %s ...' % dataset_name)
         sys.exit(1)
 
-    dataset.install(es)
+    dataset.install(es, n_threads=opts.threads)
 
 
 if __name__ == '__main__':
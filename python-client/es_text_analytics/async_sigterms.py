@@ -0,0 +1,176 @@
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+"""
+Non-blocking variants of SingleDocSigTerms and the term weight providers for serving many concurrent requests.
+
+Calls return immediately with a result handle (multiprocessing.pool.AsyncResult compatible, call get() for the
+result) and optionally invoke a callback with the result. Requests are run on thread pools sharing the synchronous
+Elasticsearch client, which is thread safe. Create the client with a connection pool at least as large as the number
+of threads, f.ex. Elasticsearch(hosts, maxsize=100), or the requests queue for connections.
+"""
+
+
+class ChainedResult(object):
+    """
+    Result handle for a two stage request where the first stage returns the result handle of the second stage.
+    """
+
+    def __init__(self, first):
+        self._first = first
+
+    def ready(self):
+        if not self._first.ready():
+            return False
+
+        if not self._first.successful():
+            return True
+
+        return self._first.get().ready()
+
+    def get(self, timeout=None):
+        """
+        Waits for and returns the result, raising the exception if the request failed.
+
+        :param timeout: Seconds to wait for each stage.
+        :type timeout: float|None
+        """
+        return self._first.get(timeout).get(timeout)
+
+
+class AsyncTermWeightProvider(object):
+    """
+    Runs the weight lookups of a term weight provider on a thread pool.
+
+    Mostly useful for providers backed by remote services such as ESTermAggregationWeightProvider and
+    ESTermIndexWeightingProvider, where each lookup waits on Elasticsearch requests.
+    """
+
+    def __init__(self, provider, n_threads=32):
+        """
+        :param provider:
+        :type provider: es_text_analytics.term_weight_provider.TermWeightingProvider
+        :param n_threads: Maximum number of concurrent lookups.
+        :type n_threads: int|long
+        """
+        self.provider = provider
+        self.n_threads = n_threads
+
+        self._pool = ThreadPool(n_threads)
+
+    def weight_array_async(self, terms, callback=None):
+        """
+        Non-blocking TermWeightingProvider.weight_array.
+
+        :param terms:
+        :type terms: list|tuple
+        :param callback: Function called with the weight array when the lookup completes.
+        :type callback: function|None
+        :rtype : multiprocessing.pool.AsyncResult
+        """
+        return self._pool.apply_async(self.provider.weight_array, (terms,), callback=callback)
+
+    def getitem_async(self, terms, callback=None):
+        """
+        Non-blocking TermWeightingProvider.__getitem__.
+
+        :param terms: single or list of terms
+        :type terms: str|unicode|list|tuple
+        :param callback: Function called with the weights when the lookup completes.
+        :type callback: function|None
+        :rtype : multiprocessing.pool.AsyncResult
+        """
+        return self._pool.apply_async(self.provider.__getitem__, (terms,), callback=callback)
+
+    def close(self):
+        """
+        Waits for the pending lookups and stops the threads.
+        """
+        self._pool.close()
+        self._pool.join()
+
+
+class AsyncSingleDocSigTerms(object):
+    """
+    Non-blocking significant terms for single documents.
+
+    Term vector requests and weight lookups run on separate thread pools, so the term vectors of subsequent
+    requests are fetched while the weights for earlier ones are looked up, and a thread waiting on a weight
+    lookup does not hold up term vector requests.
+    """
+
+    def __init__(self, sigterms, n_threads=100, n_weight_threads=None):
+        """
+        :param sigterms:
+        :type sigterms: es_text_analytics.single_doc_sigterms.SingleDocSigTerms
+        :param n_threads: Maximum number of concurrent term vector requests.
+        :type n_threads: int|long
+        :param n_weight_threads: Maximum number of concurrent weight lookups. Defaults to n_threads.
+        :type n_weight_threads: int|long|None
+        """
+        self.sigterms = sigterms
+        self.n_threads = n_threads
+        self.n_weight_threads = n_weight_threads or n_threads
+
+        self._pool = ThreadPool(self.n_threads)
+        self._weight_pool = ThreadPool(self.n_weight_threads)
+
+    def _fetch_and_submit(self, doc_id, n, callback):
+        term_freqs = self.sigterms.tf_for_doc_id(doc_id)
+
+        return self._weight_pool.apply_async(self.sigterms.top_terms, (term_freqs, n), callback=callback)
+
+    def by_doc_id_async(self, doc_id, n=5, callback=None):
+        """
+        Non-blocking SingleDocSigTerms.by_doc_id.
+
+        :param callback: Function called with the top terms when the request completes.
+        :type callback: function|None
+        :rtype : ChainedResult
+        """
+        return ChainedResult(self._pool.apply_async(self._fetch_and_submit, (doc_id, n, callback)))
+
+    def by_doc_id_idf_async(self, doc_id, n=5, callback=None):
+        """
+        Non-blocking SingleDocSigTerms.by_doc_id_idf. The weights are computed from the term vector term statistics
+        in the same request.
+
+        :param callback: Function called with the top terms when the request completes.
+        :type callback: function|None
+        :rtype : multiprocessing.pool.AsyncResult
+        """
+        return self._pool.apply_async(self.sigterms.by_doc_id_idf, (doc_id, n), callback=callback)
+
+    def imap_by_doc_id(self, doc_ids, n=5, window=None, idf=False):
+        """
+        Retrieves the top terms for a stream of documents with at most window requests in flight.
+
+        :param doc_ids: Iterable with document ids.
+        :param window: Maximum number of pending requests. Defaults to twice the number of threads.
+        :type window: int|long|None
+        :param idf: Use by_doc_id_idf instead of by_doc_id.
+        :type idf: bool
+        :rtype : generator
+        :return: Generator with the top terms for each document in the order of doc_ids.
+        """
+        window = window or 2 * self.n_threads
+        submit = self.by_doc_id_idf_async if idf else self.by_doc_id_async
+        pending = deque()
+
+        for doc_id in doc_ids:
+            pending.append(submit(doc_id, n))
+
+            if len(pending) >= window:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+    def close(self):
+        """
+        Waits for the pending requests and stops the threads.
+        """
+        self._pool.close()
+        self._pool.join()
+        self._weight_pool.close()
+        self._weight_pool.join()
@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from elasticsearch.client import IndicesClient
+from elasticsearch.exceptions import TransportError
+from elasticsearch.serializer import JSONSerializer
+
+"""
+Concurrent bulk loading of documents into Elasticsearch.
+"""
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
+SERIALIZER = JSONSerializer()
+
+
+def serialize(obj):
+    """
+    Serializes a bulk action or document to a UTF-8 encoded JSON line.
+
+    :param obj:
+    :type obj: dict
+    :rtype : str
+    """
+    line = SERIALIZER.dumps(obj)
+
+    if isinstance(line, unicode):
+        line = line.encode('utf-8')
+
+    return line
+
+
+class BulkIndexer(object):
+    """
+    Sends bulk requests to Elasticsearch from a thread pool with a bounded number of requests in flight.
+
+    Requests are limited both by the number of documents and the size of the request body. Documents rejected
+    with 429 (bulk queue full) are retried with exponential backoff. Index refresh and replicas can be turned off
+    while loading and are restored afterwards.
+
+    Usage::
+
+        indexer = BulkIndexer(es, 'my_index', n_threads=4)
+        stats = indexer.index(({'index': {'_index': 'my_index', '_type': 'doc'}}, doc) for doc in docs)
+    """
+
+    def __init__(self, es, index, chunk_size=DEFAULT_CHUNK_SIZE, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                 n_threads=4, max_retries=8, initial_backoff=1., max_backoff=60., optimize_settings=True,
+                 log_interval=10.):
+        """
+        :param es: Elasticsearch client instance.
+        :type es: elasticsearch.Elasticsearch
+        :param index: Index the documents are added to.
+        :type index: str|unicode
+        :param chunk_size: Maximum number of documents in each bulk request.
+        :type chunk_size: int|long
+        :param max_chunk_bytes: Maximum size in bytes of each bulk request body.
+        :type max_chunk_bytes: int|long
+        :param n_threads: Number of concurrent bulk requests.
+        :type n_threads: int|long
+        :param max_retries: Maximum number of retries for documents rejected with 429.
+        :type max_retries: int|long
+        :param initial_backoff: Seconds to wait before the first retry, doubled for each subsequent retry.
+        :type initial_backoff: float
+        :param max_backoff: Maximum number of seconds to wait between retries.
+        :type max_backoff: float
+        :param optimize_settings: Turn off index refresh and replicas while loading.
+        :type optimize_settings: bool
+        :param log_interval: Minimum number of seconds between progress log messages.
+        :type log_interval: float
+        """
+        self.es = es
+        self.index_name = index
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.n_threads = n_threads
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.optimize_settings = optimize_settings
+        self.log_interval = log_interval
+
+        self._lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.stats = {'docs': 0, 'failed': 0, 'retries': 0, 'bytes': 0, 'requests': 0,
+                      'seconds': .0, 'docs_per_sec': .0}
+        self._start = time.time()
+        self._last_log = self._start
+
+    def _chunks(self, actions):
+        """
+        Serializes and groups the actions into chunks respecting the document and byte limits.
+
+        :rtype : generator
+        """
+        chunk = []
+        size = 0
+
+        for action, source in actions:
+            item = (serialize(action), serialize(source))
+            item_size = len(item[0]) + len(item[1]) + 2
+
+            if chunk and (len(chunk) >= self.chunk_size or size + item_size > self.max_chunk_bytes):
+                yield chunk
+                chunk = []
+                size = 0
+
+            chunk.append(item)
+            size += item_size
+
+        if chunk:
+            yield chunk
+
+    def _backoff(self, attempt):
+        return min(self.initial_backoff * 2 ** attempt, self.max_backoff)
+
+    def _send_chunk(self, chunk):
+        """
+        Sends a chunk, retrying rejected documents.
+
+        :rtype : dict
+        :return: dict with the number of indexed, failed and retried documents and bytes sent.
+        """
+        result = {'docs': 0, 'failed': 0, 'retries': 0, 'bytes': 0, 'requests': 0}
+        attempt = 0
+
+        while chunk:
+            body = ''.join('%s\n%s\n' % item for item in chunk)
+            result['bytes'] += len(body)
+            result['requests'] += 1
+            rejected = []
+
+            try:
+                resp = self.es.bulk(body=body, index=self.index_name)
+
+                for item, resp_item in zip(chunk, resp['items']):
+                    status = resp_item.values()[0].get('status', 200)
+
+                    if status == 429:
+                        rejected.append(item)
+                    elif status >= 300:
+                        logging.error('Failed to index document: %s ...' % resp_item.values()[0].get('error'))
+                        result['failed'] += 1
+                    else:
+                        result['docs'] += 1
+            except TransportError as e:
+                if e.status_code != 429:
+                    logging.error('Bulk request failed: %s ...' % e)
+                    result['failed'] += len(chunk)
+                    break
+
+                rejected = chunk
+            except Exception as e:
+                logging.error('Bulk request failed: %s ...' % e)
+                result['failed'] += len(chunk)
+                break
+
+            if rejected and attempt >= self.max_retries:
+                logging.error('Giving up on %d rejected documents ...' % len(rejected))
+                result['failed'] += len(rejected)
+                break
+
+            if rejected:
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                result['retries'] += len(rejected)
+
+            chunk = rejected
+
+        return result
+
+    def _record(self, result):
+        with self._lock:
+            for key, val in result.items():
+                self.stats[key] += val
+
+            now = time.time()
+            self.stats['seconds'] = now - self._start
+            self.stats['docs_per_sec'] = self.stats['docs'] / self.stats['seconds'] if self.stats['seconds'] else .0
+
+            if now - self._last_log >= self.log_interval:
+                self._last_log = now
+                logging.info('Added %d documents (%.0f docs/s) ...' % (self.stats['docs'], self.stats['docs_per_sec']))
+
+    def _disable_refresh(self):
+        """
+        Turns off refresh and replicas on the index, creating it if needed.
+
+        :rtype : dict
+        :return: The index settings to restore.
+        """
+        ic = IndicesClient(self.es)
+
+        if not ic.exists(self.index_name):
+            ic.create(index=self.index_name, ignore=400)
+
+        settings = ic.get_settings(index=self.index_name, flat_settings=True)
+        settings = settings.get(self.index_name, {}).get('settings', {})
+        restore = {'refresh_interval': settings.get('index.refresh_interval', '1s'),
+                   'number_of_replicas': settings.get('index.number_of_replicas', 1)}
+
+        ic.put_settings(index=self.index_name, body={'index': {'refresh_interval': '-1', 'number_of_replicas': 0}})
+
+        return restore
+
+    def _restore_refresh(self, restore):
+        ic = IndicesClient(self.es)
+
+        ic.put_settings(index=self.index_name, body={'index': restore})
+        ic.refresh(index=self.index_name)
+
+    def index(self, actions):
+        """
+        Adds the documents to the index.
+
+        :param actions: Iterator with (action, document) pairs where the action is the bulk action metadata,
+            f.ex. {'index': {'_index': 'my_index', '_type': 'doc', '_id': 1}}.
+        :rtype : dict
+        :return: dict with the number of indexed and failed documents, retries, requests, bytes sent, elapsed
+            seconds and docs_per_sec.
+        """
+        self._reset_stats()
+        restore = self._disable_refresh() if self.optimize_settings else None
+
+        pool = ThreadPool(self.n_threads)
+        # bounds the number of chunks queued or in flight
+        slots = threading.BoundedSemaphore(2 * self.n_threads)
+
+        def done(result):
+            self._record(result)
+            slots.release()
+
+        try:
+            for chunk in self._chunks(actions):
+                slots.acquire()
+                pool.apply_async(self._send_chunk, (chunk,), callback=done)
+        finally:
+            pool.close()
+            pool.join()
+
+            if restore:
+                self._restore_refresh(restore)
+
+        logging.info('Added %d documents in %.1f seconds (%.0f docs/s), %d failed ...' %
+                     (self.stats['docs'], self.stats['seconds'], self.stats['docs_per_sec'], self.stats['failed']))
+
+        return self.stats
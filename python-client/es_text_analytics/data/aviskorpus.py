@@ -2,10 +2,12 @@
 import logging
 import os
 import re
+import tarfile
 import unicodedata
-from StringIO import StringIO
+import zlib
 from gzip import GzipFile
-from tarfile import TarFile
+from multiprocessing import cpu_count, Process, Queue
+from Queue import Empty
 from zipfile import ZipFile
 
 from bs4 import BeautifulSoup
@@ -52,6 +54,138 @@ CORPUS_SECTIONS = {
                       'sh', 'so', 'sp', 'vb', 'vt']}}
 
 
+# size of the compressed blocks read from the archive when streaming
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# first line in offset index files
+OFFSET_INDEX_HEADER = 'aviskorpus-offset-index\t1'
+
+# seconds between checks that the parsing processes are alive while waiting for documents
+WORKER_POLL_INTERVAL = 1.
+
+
+class GzipStreamReader(object):
+    """
+    Line oriented reader decompressing a gzip stream from a non-seekable file like object, f.ex. a ZipFile entry.
+
+    GzipFile needs a seekable file so members in the corpus archive would have to be read into memory first.
+    Only a block of compressed data and the current decompressed block are kept in memory. Concatenated gzip
+    members are supported.
+    """
+
+    def __init__(self, fileobj, block_size=STREAM_BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.block_size = block_size
+
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # lines are read from an offset into the buffer, the consumed part is dropped when the next block is added
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """
+        Decompresses the next block of at most block_size bytes into the buffer.
+
+        :rtype : bool
+        :return: False when the stream is exhausted.
+        """
+        while not self._eof:
+            # unused_data is checked first as the unconsumed tail of a finished member holds the same data
+            data = self._decompressor.unused_data
+
+            if data:
+                # start of the next gzip member
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                # compressed input left over from the previous block when the output limit was reached
+                data = self._decompressor.unconsumed_tail or self.fileobj.read(self.block_size)
+
+            if not data:
+                self._eof = True
+                out = self._decompressor.flush()
+            else:
+                out = self._decompressor.decompress(data, self.block_size)
+
+            if out:
+                self._buffer = self._buffer[self._pos:] + out
+                self._pos = 0
+                return True
+
+        return False
+
+    def _take(self, size):
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+
+        return data
+
+    def readline(self):
+        while True:
+            idx = self._buffer.find('\n', self._pos)
+
+            if idx >= 0:
+                return self._take(idx + 1 - self._pos)
+
+            if not self._fill():
+                return self._take(len(self._buffer) - self._pos)
+
+    def read(self, size=-1):
+        chunks = [self._take(len(self._buffer) - self._pos)]
+        n = len(chunks[0])
+
+        # collect the blocks and join once to avoid copying the buffer for each block
+        while (size < 0 or n < size) and self._fill():
+            chunks.append(self._take(len(self._buffer)))
+            n += len(chunks[-1])
+
+        data = ''.join(chunks)
+
+        if 0 <= size < n:
+            data, self._buffer, self._pos = data[:size], data[size:], 0
+
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def iter_tar_members(zf, fn):
+    """
+    Streams the files in a tar.gz archive stored in a ZipFile. The members must be read in archive order.
+
+    :param zf: The archive with the tar.gz file.
+    :type zf: zipfile.ZipFile
+    :param fn: Name of the tar.gz file in the archive.
+    :type fn: str|unicode
+    :rtype : generator
+    :return: Generator with the TarInfo and a file like object for each regular file in the archive.
+    """
+    zef = zf.open(fn)
+
+    try:
+        # stream mode reads the archive sequentially without seeking
+        with tarfile.open(fileobj=zef, mode='r|gz', bufsize=STREAM_BLOCK_SIZE) as tf:
+            for member in tf:
+                if member.isfile():
+                    tif = tf.extractfile(member)
+
+                    yield member, tif
+
+                    tif.close()
+    finally:
+        zef.close()
+
+
 def match_or_none(pattern, string, flags=0):
     """
     Small wrapper for reqexes with one match group which may or may not match.
@@ -75,6 +209,33 @@ def match_or_none(pattern, string, flags=0):
         return m.groups()
 
 
+# precompiled patterns for the section 1 and 2 line parsers
+SECTION_1_HEADER = re.compile('<U #(http://.*)>')
+SECTION_1_SOURCE = re.compile('^<B (\w\w)>$')
+SECTION_1_YEAR = re.compile('^<A (\d\d)>$')
+SECTION_1_MONTH = re.compile('^<M (\d\d)>$')
+SECTION_1_DAY = re.compile('^<D (\d\d)>$')
+
+SECTION_2_HEADER = re.compile('##U #(http://.*)>')
+SECTION_2_SOURCE = re.compile('^##B (\w\w)>$')
+SECTION_2_YEAR = re.compile('^##A (\d\d)>$')
+SECTION_2_MONTH = re.compile('^##M (\d\d)>$')
+SECTION_2_DAY = re.compile('^##D (\d\d)>$')
+
+
+def _group_or_none(pattern, string):
+    m = pattern.search(string)
+
+    if m:
+        return m.group(1)
+
+
+def _int_group_or_none(pattern, string):
+    val = _group_or_none(pattern, string)
+
+    return int(val) if val else None
+
+
 def section_1_header_line(line):
     """
     Detects and extracts url from section 1 header line.
@@ -84,62 +245,75 @@ def section_1_header_line(line):
     :rtype : None|unicode|str
     :return: Return the url in the header or None if the passed string is not a section 1 header line.
     """
-    m = re.search('<U #(http://.*)>', line)
+    # cheap substring check before the regex, almost all lines are tokens
+    if '<U #' in line:
+        return _group_or_none(SECTION_1_HEADER, line)
 
-    if m:
-        return m.group(1)
 
+def _section_1_doc(doc, tokens):
+    # one normalization for the whole document, tokens never contain newlines
+    doc['tokens'] = unicodedata.normalize('NFC', u'\n'.join(tokens)).split(u'\n')
+    doc['corpus_section'] = 1
 
-def section_1_parser(fileobj):
+    return doc
+
+
+def _section_1_docs(fileobj, pos=0):
     """
-    Parser for section 1 data files.
-    Returns a generator with dict instances with the article data.
+    Section 1 parser yielding the byte offset of the header line with each document.
 
-    :param fileobj: A file like instance with section 1 formatted text.
+    :param pos: Offset of the current position in fileobj.
+    :type pos: int|long
     :rtype : generator
     """
-    line = fileobj.readline()
+    readline = fileobj.readline
+    raw = readline()
     tokens = []
     doc = None
-
-    while line:
-        line = line.decode('latin1')
-        line = line.strip()
-
-        if line == '':
-            pass
-        elif section_1_header_line(line):
-            # skip empty documents
-            if tokens:
-                doc['tokens'] = [unicodedata.normalize('NFC', unicode(token)) for token in tokens]
-                doc['corpus_section'] = 1
-
-                yield doc
-                tokens = []
-
-            url = section_1_header_line(line)
-            fileobj.readline()
-            source_code = match_or_none('^<B (\w\w)>$', fileobj.readline().strip())
-            year = match_or_none('^<A (\d\d)>$', fileobj.readline().strip())
-            pub_year = int(year) if year else None
-            month = match_or_none('^<M (\d\d)>$', fileobj.readline().strip())
-            pub_month = int(month) if month else None
-            day = match_or_none('^<D (\d\d)>$', fileobj.readline().strip())
-            pub_day = int(day) if day else None
-
-            doc = {'url': url, 'source': source_code,
-                   'pub_year': pub_year, 'pub_month': pub_month, 'pub_day': pub_day}
-        else:
-            # article content consists of tokens, one on each line
-            tokens.append(line)
-
-        line = fileobj.readline()
+    doc_pos = None
+
+    while raw:
+        line = raw.decode('latin1').strip()
+
+        if line:
+            # inlined cheap check, almost all lines are tokens
+            url = '<U #' in line and _group_or_none(SECTION_1_HEADER, line)
+
+            if url:
+                # skip empty documents
+                if tokens:
+                    yield doc_pos, _section_1_doc(doc, tokens)
+                    tokens = []
+
+                doc_pos = pos
+                header = [readline() for _ in xrange(5)]
+                pos += sum(len(l) for l in header)
+                doc = {'url': url,
+                       'source': _group_or_none(SECTION_1_SOURCE, header[1].strip()),
+                       'pub_year': _int_group_or_none(SECTION_1_YEAR, header[2].strip()),
+                       'pub_month': _int_group_or_none(SECTION_1_MONTH, header[3].strip()),
+                       'pub_day': _int_group_or_none(SECTION_1_DAY, header[4].strip())}
+            else:
+                # article content consists of tokens, one on each line
+                tokens.append(line)
+
+        pos += len(raw)
+        raw = readline()
 
     # catch the last document
     if doc and tokens:
-        doc['tokens'] = [unicodedata.normalize('NFC', unicode(token)) for token in tokens]
-        doc['corpus_section'] = 1
+        yield doc_pos, _section_1_doc(doc, tokens)
+
+
+def section_1_parser(fileobj):
+    """
+    Parser for section 1 data files.
+    Returns a generator with dict instances with the article data.
 
+    :param fileobj: A file like instance with section 1 formatted text.
+    :rtype : generator
+    """
+    for _, doc in _section_1_docs(fileobj):
         yield doc
 
 
@@ -152,65 +326,77 @@ def section_2_header_line(line):
     :rtype : None|unicode|str
     :return: Return the url in the header or None if the passed string is not a section 1 header line.
     """
-    m = re.search('##U #(http://.*)>', line)
+    if '##U #' in line:
+        return _group_or_none(SECTION_2_HEADER, line)
 
-    if m:
-        return m.group(1)
 
+def _section_2_doc(doc, lines):
+    # content consists of text lines with header sections delimited by | characters and
+    # sentences delimited by paragraph characters
+    text = unicodedata.normalize('NFC', u''.join(lines)).replace(u'¶', u'|')
+    sents = (sent.strip() for sent in text.split(u'|'))
+    doc['sentences'] = [sent for sent in sents if sent != '']
+    doc['corpus_section'] = 2
 
-def section_2_parser(fileobj):
+    return doc
+
+
+def _section_2_docs(fileobj, pos=0):
     """
-    Parser for section 2 data files.
-    Returns a generator with dict instances with the article data.
+    Section 2 parser yielding the byte offset of the header line with each document.
 
-    :param fileobj: A file like instance with section 2 formatted text.
+    :param pos: Offset of the current position in fileobj.
+    :type pos: int|long
     :rtype : generator
     """
-    line = fileobj.readline()
-    text = ''
+    readline = fileobj.readline
+    raw = readline()
+    lines = []
     doc = None
+    doc_pos = None
 
-    while line:
-        line = line.decode('latin1')
-        line = line.strip()
+    while raw:
+        line = raw.decode('latin1').strip()
 
         if line == '' or line == '|':
             pass
-        elif section_2_header_line(line):
-            # skip articles with no content
-            if text and doc:
-                # content consists of text lines with header sections delimited by | characters and
-                # sentences delimited by paragraph characters
-                text = text.replace(u'¶', u'|')
-                doc['sentences'] = [unicodedata.normalize('NFC', unicode(sent.strip()))
-                                    for sent in text.split(u'|') if sent.strip() != '']
-                doc['corpus_section'] = 2
-
-                yield doc
-                text = ''
-
-            url = section_2_header_line(line)
-            source_code = match_or_none('^##B (\w\w)>$', fileobj.readline().strip())
-            year = match_or_none('^##A (\d\d)>$', fileobj.readline().strip())
-            pub_year = int(year) if year else None
-            month = match_or_none('^##M (\d\d)>$', fileobj.readline().strip())
-            pub_month = int(month) if month else None
-            day = match_or_none('^##D (\d\d)>$', fileobj.readline().strip())
-            pub_day = int(day) if day else None
-
-            doc = {'url': url, 'source': source_code,
-                   'pub_year': pub_year, 'pub_month': pub_month, 'pub_day': pub_day}
         else:
-            text += line
-
-        line = fileobj.readline()
+            url = '##U #' in line and _group_or_none(SECTION_2_HEADER, line)
+
+            if url:
+                # skip articles with no content
+                if lines and doc:
+                    yield doc_pos, _section_2_doc(doc, lines)
+                    lines = []
+
+                doc_pos = pos
+                header = [readline() for _ in xrange(4)]
+                pos += sum(len(l) for l in header)
+                doc = {'url': url,
+                       'source': _group_or_none(SECTION_2_SOURCE, header[0].strip()),
+                       'pub_year': _int_group_or_none(SECTION_2_YEAR, header[1].strip()),
+                       'pub_month': _int_group_or_none(SECTION_2_MONTH, header[2].strip()),
+                       'pub_day': _int_group_or_none(SECTION_2_DAY, header[3].strip())}
+            else:
+                lines.append(line)
+
+        pos += len(raw)
+        raw = readline()
 
     # yield the last document in the file
-    if doc and text:
-        text = text.replace(u'¶', u'|')
-        doc['sentences'] = [unicodedata.normalize('NFC', unicode(sent.strip()))
-                            for sent in text.split(u'|') if sent.strip() != '']
-        doc['corpus_section'] = 2
+    if doc and lines:
+        yield doc_pos, _section_2_doc(doc, lines)
+
+
+def section_2_parser(fileobj):
+    """
+    Parser for section 2 data files.
+    Returns a generator with dict instances with the article data.
+
+    :param fileobj: A file like instance with section 2 formatted text.
+    :rtype : generator
+    """
+    for _, doc in _section_2_docs(fileobj):
         yield doc
 
 
@@ -240,6 +426,219 @@ def section_3_parser(fileobj):
     return doc
 
 
+def corpus_paths(sections=None, sources=None):
+    """
+    Lists the files in the corpus archive for the selected sections and sources in corpus order.
+
+    :param sections: Sections to include. The default None includes all sections.
+    :type sections: list[int|long]|None
+    :param sources: Newspaper sources to include. The default None includes all sources.
+    :type sources: list[str|unicode]|None
+    :rtype : list
+    :return: List of section number and file name pairs.
+    """
+    paths = []
+
+    for section in (1, 2, 3):
+        if sections and section not in sections:
+            continue
+
+        for fn in CORPUS_SECTIONS[str(section)]['paths']:
+            # section 1 files have all the sources and are filtered by document
+            if section != 1 and sources and not os.path.basename(fn).split('.')[0] in sources:
+                continue
+
+            paths.append((section, fn))
+
+    return paths
+
+
+def doc_key(fn, member, offset):
+    """
+    Creates the key identifying a document in the corpus archive. The key is the file name, the tar member name for
+    section 2 and 3 files and the offset of the document header in the decompressed file or member, f.ex.
+    1/19981013-20010307.gz@10245 or 2/aa.tar.gz/aa/1.txt@0.
+
+    :param fn: File name in the archive.
+    :type fn: str|unicode
+    :param member: Tar member name or '' for section 1 files.
+    :type member: str|unicode
+    :param offset: Offset of the document in the file or member.
+    :type offset: int|long
+    :rtype : str|unicode
+    """
+    if member:
+        fn = '%s/%s' % (fn, member)
+
+    return '%s@%d' % (fn, offset)
+
+
+def parse_doc_key(key):
+    """
+    Splits a document key from doc_key into its parts.
+
+    :param key:
+    :type key: str|unicode
+    :rtype : (str|unicode, str|unicode, int)
+    :return: The file name, tar member name and offset.
+    :raise ValueError: If the key is malformed.
+    """
+    name, sep, offset = key.rpartition('@')
+    parts = name.split('/', 2)
+
+    if not sep or len(parts) < 2 or not offset.isdigit():
+        raise ValueError('Malformed document key %s ...' % key)
+
+    return '/'.join(parts[:2]), parts[2] if len(parts) > 2 else '', int(offset)
+
+
+def _skip(fileobj, size):
+    """
+    Skips size bytes in a sequentially read file.
+    """
+    while size > 0:
+        data = fileobj.read(min(size, STREAM_BLOCK_SIZE))
+
+        if not data:
+            break
+
+        size -= len(data)
+
+
+def _iter_file_entries(zf, section, fn, sources=None, start=None, stop=None):
+    """
+    Generator that yields the member name, offset and document for the documents in a single file in the corpus
+    archive, optionally limited to the documents between a start and stop position.
+
+    Compressed data can't be seeked, so the data before the start position is decompressed and skipped without
+    parsing, and skipped section 2 and 3 members are not decompressed beyond the tar stream.
+
+    :param start: Member name and offset of the first document. None starts at the beginning of the file.
+    :type start: (str|unicode, int|long)|None
+    :param stop: Member name and offset of the last document. None reads to the end of the file.
+    :type stop: (str|unicode, int|long)|None
+    :rtype : generator
+    """
+    logging.info('Reading %s ...' % fn)
+
+    # corpus content files are compressed and archived in various ways inside the corpus zip archive.
+    if section == 1:
+        pos = start[1] if start else 0
+
+        with GzipStreamReader(zf.open(fn)) as iz:
+            try:
+                _skip(iz, pos)
+
+                for offset, doc in _section_1_docs(iz, pos=pos):
+                    if stop and offset > stop[1]:
+                        break
+
+                    if sources is None or doc['source'] in sources:
+                        yield '', offset, doc
+            except Exception:
+                logging.error("Parse failure while reading %s ..." % fn)
+
+        return
+
+    started = start is None
+
+    for member, tif in iter_tar_members(zf, fn):
+        pos = 0
+
+        if not started:
+            if member.name != start[0]:
+                continue
+
+            started = True
+            pos = start[1]
+
+        last = stop[1] if stop and member.name == stop[0] else None
+
+        if section == 2:
+            try:
+                _skip(tif, pos)
+
+                for offset, doc in _section_2_docs(tif, pos=pos):
+                    if last is not None and offset > last:
+                        break
+
+                    yield member.name, offset, doc
+            except Exception:
+                logging.error("Parse failure while reading %s ..." % fn)
+        elif section == 3 and os.path.splitext(member.name)[1] == '.xml':
+            try:
+                doc = section_3_parser(tif)
+            except Exception:
+                logging.error("Unable to parse file %s ..." % member.name)
+            else:
+                yield member.name, 0, doc
+
+        if last is not None:
+            return
+
+    if not started:
+        logging.warning('Start member %s not found in %s ...' % (start[0], fn))
+
+
+def iter_corpus_file(zf, section, fn, sources=None):
+    """
+    Generator that yields the documents in a single file in the corpus archive.
+
+    :param zf: The corpus archive.
+    :type zf: zipfile.ZipFile
+    :param section: Corpus section of the file.
+    :type section: int|long
+    :param fn: File name in the archive.
+    :type fn: str|unicode
+    :param sources: Newspaper sources to include in section 1 files. The default None yields all sources.
+    :type sources: list[str|unicode]|None
+    :rtype : generator
+    """
+    for _, _, doc in _iter_file_entries(zf, section, fn, sources=sources):
+        yield doc
+
+
+def keyed_iterator(dataset_fn, sections=None, sources=None, start=None, stop=None):
+    """
+    Generator that yields the key (see doc_key) and document for the documents in the korpus, optionally only the
+    documents between two keys in corpus order. Use the keys to resume reading or to read a part of the corpus,
+    see also offset_index_range.
+
+    :param dataset_fn: Dataset archive file.
+    :type dataset_fn: str|unicode
+    :param sections: Sections to include. The default None yields all sections.
+    :type sections: list[int|long]|None
+    :param sources: Newspaper sources to include. The default None yields all sources.
+    :type sources: list[str|unicode]|None
+    :param start: Key of the first document. None starts at the beginning of the corpus.
+    :type start: str|unicode|None
+    :param stop: Key of the last document. None reads to the end of the corpus.
+    :type stop: str|unicode|None
+    :rtype : generator
+    :raise ValueError: If a key is malformed or not in a corpus file.
+    """
+    order = dict((fn, i) for i, (_, fn) in enumerate(corpus_paths()))
+    start = parse_doc_key(start) if start else None
+    stop = parse_doc_key(stop) if stop else None
+
+    for key in (start, stop):
+        if key and key[0] not in order:
+            raise ValueError('Unknown corpus file %s in document key ...' % key[0])
+
+    with ZipFile(dataset_fn) as zf:
+        for section, fn in corpus_paths(sections=sections, sources=sources):
+            if start and order[fn] < order[start[0]]:
+                continue
+
+            if stop and order[fn] > order[stop[0]]:
+                break
+
+            for member, offset, doc in _iter_file_entries(zf, section, fn, sources=sources,
+                                                          start=start[1:] if start and fn == start[0] else None,
+                                                          stop=stop[1:] if stop and fn == stop[0] else None):
+                yield doc_key(fn, member, offset), doc
+
+
 def iterator(dataset_fn, sections=None, sources=None):
     """
     Generator that yields all the documents in the korpus.
@@ -256,82 +655,323 @@ def iterator(dataset_fn, sections=None, sources=None):
     """
     count = 0
 
-    with ZipFile(dataset_fn) as zf:
-        # corpus content files are compressed and archived in various ways inside the corpus zip archive.
-        if not sections or 1 in sections:
-            for fn in CORPUS_SECTIONS['1']['paths']:
-                logging.info('Reading %s ...' % fn)
+    for _, doc in keyed_iterator(dataset_fn, sections=sections, sources=sources):
+        yield doc
+        count += 1
+
+        if count % 1000 == 0:
+            logging.info("Read %d files ..." % count)
+
+
+def build_offset_index(dataset_fn, index_fn):
+    """
+    Writes the offset index for the corpus, a gzip compressed file with the key (see doc_key) of each document in
+    corpus order. The section 1 files have all the sources, so the source of these documents is stored as well.
+
+    The index is used to split the corpus into shards with equal numbers of documents and to resume reading after
+    a document, see offset_index_range.
+
+    :param dataset_fn: Dataset archive file.
+    :type dataset_fn: str|unicode
+    :param index_fn: Index file name.
+    :type index_fn: str|unicode
+    :rtype : int
+    :return: Number of documents in the index.
+    """
+    count = 0
+    tmp_fn = index_fn + '.tmp'
+
+    with GzipFile(tmp_fn, 'wb') as f:
+        f.write(OFFSET_INDEX_HEADER + '\n')
+
+        for key, doc in keyed_iterator(dataset_fn):
+            source = (doc.get('source') or '') if doc['corpus_section'] == 1 else ''
+            f.write('%s\t%s\n' % (key, source.encode('utf-8')))
+            count += 1
+
+            if count % 100000 == 0:
+                logging.info('Indexed %d documents ...' % count)
+
+    os.rename(tmp_fn, index_fn)
+    logging.info('Wrote offsets for %d documents to %s ...' % (count, index_fn))
+
+    return count
+
+
+def iter_offset_index(index_fn, sections=None, sources=None):
+    """
+    Generator that yields the keys in an offset index for the documents in the selected sections and sources.
+
+    :param index_fn: Index file name.
+    :type index_fn: str|unicode
+    :rtype : generator
+    :raise ValueError: If the file is not an offset index.
+    """
+    paths = set(fn for _, fn in corpus_paths(sections=sections, sources=sources))
+
+    with GzipFile(index_fn) as f:
+        if f.readline().rstrip('\n') != OFFSET_INDEX_HEADER:
+            raise ValueError('%s is not an Aviskorpus offset index ...' % index_fn)
+
+        for line in f:
+            key, source = line.rstrip('\n').split('\t')
+            fn = parse_doc_key(key)[0]
+
+            if fn not in paths:
+                continue
 
-                with GzipFile(fileobj=StringIO(zf.read(fn))) as iz:
-                    try:
-                        for doc in section_1_parser(iz):
-                            if sources is None or doc['source'] in sources:
-                                yield doc
-                                count += 1
+            # same source filter as iter_corpus_file for section 1
+            if sources is not None and fn.startswith('1/') and source not in sources:
+                continue
 
-                                if count != 0 and count % 1000 == 0:
-                                    logging.info("Read %d files ..." % count)
-                    except Exception:
-                        logging.error("Parse failure while reading %s ..." % fn)
+            yield key
 
-        if not sections or 2 in sections:
-            for fn in CORPUS_SECTIONS['2']['paths']:
-                if sources and not os.path.basename(fn).split('.')[0] in sources:
-                    continue
 
-                logging.info('Reading %s ...' % fn)
+def offset_index_range(index_fn, sections=None, sources=None, shard=None, start_after=None):
+    """
+    Finds the keys of the first and last documents in a shard of the corpus with an offset index. Shards are
+    contiguous parts of the corpus with equal numbers of documents, so n processes or machines reading a shard
+    each read disjoint parts of the corpus.
+
+    :param index_fn: Offset index file name, see build_offset_index.
+    :type index_fn: str|unicode
+    :param shard: Tuple (i, n) for shard i of n shards, counting from 0. None for the whole corpus.
+    :type shard: (int, int)|None
+    :param start_after: Key of the last document read, f.ex. when resuming an interrupted job. The range starts
+        with the next document in the shard.
+    :type start_after: str|unicode|None
+    :rtype : (str|unicode, str|unicode)|None
+    :return: The first and last keys (inclusive) for keyed_iterator. None if there are no documents to read.
+    :raise ValueError: If the shard is invalid or start_after is not in the index.
+    """
+    i, n = shard or (0, 1)
+
+    if not 0 <= i < n:
+        raise ValueError('Invalid shard %d of %d ...' % (i, n))
+
+    count = 0
+    after_pos = None
+
+    for pos, key in enumerate(iter_offset_index(index_fn, sections=sections, sources=sources)):
+        if key == start_after:
+            after_pos = pos
+
+        count += 1
+
+    if start_after and after_pos is None:
+        raise ValueError('Document key %s not in offset index %s ...' % (start_after, index_fn))
+
+    first = i * count // n
+    last = (i + 1) * count // n - 1
+
+    if after_pos is not None:
+        first = max(first, after_pos + 1)
+
+    if first > last:
+        return None
+
+    keys = {}
+
+    for pos, key in enumerate(iter_offset_index(index_fn, sections=sections, sources=sources)):
+        if pos in (first, last):
+            keys[pos] = key
+
+        if pos >= last:
+            break
+
+    return keys[first], keys[last]
+
 
-                # TarFile with compression doesn't work inside a ZipFile
-                # Uncompress to a StringIO object and hand that to TarFile
-                with GzipFile(fileobj=StringIO(zf.read(fn))) as iz:
-                    with TarFile(fileobj=iz) as tf:
-                        for member in tf.getmembers():
+def offset_index_tasks(index_fn, sections=None, sources=None, task_size=10000):
+    """
+    Splits the corpus into ranges of at most task_size consecutive documents in the same file with an offset index,
+    the units of work for parallel_iterator.
+
+    :param index_fn: Offset index file name, see build_offset_index.
+    :type index_fn: str|unicode
+    :param task_size: Maximum number of documents in a range.
+    :type task_size: int|long
+    :rtype : list
+    :return: List of section, file name, first and last (member name, offset) tuples in corpus order.
+    """
+    sections_by_fn = dict((fn, section) for section, fn in corpus_paths(sections=sections, sources=sources))
+    tasks = []
+    first = last = None
+    count = 0
+
+    for key in iter_offset_index(index_fn, sections=sections, sources=sources):
+        key = parse_doc_key(key)
+
+        if first and (count >= task_size or key[0] != first[0]):
+            tasks.append((sections_by_fn[first[0]], first[0], first[1:], last[1:]))
+            first = None
+
+        if not first:
+            first, count = key, 0
+
+        last = key
+        count += 1
+
+    if first:
+        tasks.append((sections_by_fn[first[0]], first[0], first[1:], last[1:]))
 
-                            if member.isfile():
-                                tif = tf.extractfile(member)
+    return tasks
 
-                                try:
-                                    for doc in section_2_parser(tif):
-                                        yield doc
-                                        count += 1
 
-                                        if count != 0 and count % 1000 == 0:
-                                            logging.info("Read %d files ..." % count)
-                                except Exception:
-                                    logging.error("Parse failure while reading %s ..." % fn)
+def _parse_worker(dataset_fn, tasks, out_queue, sources, batch_size):
+    """
+    Worker process parsing corpus files. Puts ('docs', task, batch), ('done', task, None) and
+    ('error', task, message) messages on the output queue.
+
+    :param tasks: Queue or list with (task number, section, file name, start, stop) tuples, see
+        _iter_file_entries for start and stop. A None task ends a queue.
+    """
+    try:
+        zf = ZipFile(dataset_fn)
+    except Exception as e:
+        out_queue.put(('error', None, '%s: %s' % (dataset_fn, e)))
+        return
+
+    with zf:
+        for task in iter(tasks.get, None) if hasattr(tasks, 'get') else tasks:
+            task_id, section, fn, start, stop = task
 
-                                tif.close()
+            try:
+                batch = []
 
-        if not sections or 3 in sections:
-            for fn in CORPUS_SECTIONS['3']['paths']:
-                if sources and not os.path.basename(fn).split('.')[0] in sources:
-                    continue
+                for _, _, doc in _iter_file_entries(zf, section, fn, sources=sources, start=start, stop=stop):
+                    batch.append(doc)
 
-                logging.info('Reading %s ...' % fn)
+                    if len(batch) >= batch_size:
+                        out_queue.put(('docs', task_id, batch))
+                        batch = []
 
-                # Same tar.gz inside zip problem as with section 2
-                with GzipFile(fileobj=StringIO(zf.read(fn))) as iz:
-                    with TarFile(fileobj=iz) as tf:
-                        for member in tf.getmembers():
-                            if member.isfile():
-                                tif = tf.extractfile(member)
+                if batch:
+                    out_queue.put(('docs', task_id, batch))
 
-                                if os.path.splitext(member.name)[1] != '.xml':
-                                    continue
+                out_queue.put(('done', task_id, None))
+            except Exception as e:
+                out_queue.put(('error', task_id, '%s: %s' % (fn, e)))
 
-                                try:
-                                    doc = section_3_parser(tif)
 
-                                    yield doc
-                                    count += 1
+def _get_message(queue, workers):
+    """
+    Gets the next message from the workers, checking that they are alive while waiting.
+
+    :raise RuntimeError: If a worker died or all the workers exited without putting a message on the queue.
+    """
+    while True:
+        try:
+            return queue.get(timeout=WORKER_POLL_INTERVAL)
+        except Empty:
+            failed = [worker for worker in workers if worker.exitcode not in (None, 0)]
 
-                                except Exception:
-                                    logging.error("Unable to parse file %s ..." % member.name)
+            if failed:
+                raise RuntimeError('Parsing process exited with code %d ...' % failed[0].exitcode)
 
-                                if count != 0 and count % 1000 == 0:
-                                    logging.info("Read %d files ..." % count)
+            if not any(worker.is_alive() for worker in workers):
+                # messages from exited workers are already in the queue
+                try:
+                    return queue.get(timeout=WORKER_POLL_INTERVAL)
+                except Empty:
+                    raise RuntimeError('Parsing processes exited before the corpus was read ...')
 
-                                tif.close()
+
+def parallel_iterator(dataset_fn, sections=None, sources=None, n_jobs=None, ordered=False, queue_size=16,
+                      batch_size=100, offset_index_fn=None, task_size=10000):
+    """
+    Generator that yields the documents in the korpus, parsing the corpus in parallel worker processes.
+
+    Without an offset index each file in the archive (see corpus_paths) is parsed by one worker, and the few large
+    files of section 1 limit the parallelism. With an offset index the corpus is split into ranges of task_size
+    documents (see offset_index_tasks) which are parsed independently. Compressed files can only be read in
+    sequence, so a worker decompresses and skips the part of the file before its range without parsing it.
+    Documents are passed from the workers in batches through bounded queues, so the workers block when the
+    consumer falls behind.
+
+    :param dataset_fn: Dataset archive file.
+    :type dataset_fn: str|unicode
+    :param sections: Sections to include. The default None yields all sections.
+    :type sections: list[int|long]|None
+    :param sources: Newspaper sources to include. The default None yields all sources.
+    :type sources: list[str|unicode]|None
+    :param n_jobs: Number of worker processes. Defaults to the number of CPUs.
+    :type n_jobs: int|long|None
+    :param ordered: Yield the documents in the same order as iterator. Tasks are then assigned to the workers
+        round robin instead of on demand, and each worker has its own queue.
+    :type ordered: bool
+    :param queue_size: Maximum number of document batches queued for each worker.
+    :type queue_size: int|long
+    :param batch_size: Number of documents in each batch.
+    :type batch_size: int|long
+    :param offset_index_fn: Offset index file, see build_offset_index. Splits the files into document ranges.
+    :type offset_index_fn: str|unicode|None
+    :param task_size: Number of documents in each range with an offset index.
+    :type task_size: int|long
+    :rtype : generator
+    :raise RuntimeError: If a worker fails reading a file or dies.
+    """
+    if offset_index_fn:
+        tasks = offset_index_tasks(offset_index_fn, sections=sections, sources=sources, task_size=task_size)
+    else:
+        tasks = [(section, fn, None, None) for section, fn in corpus_paths(sections=sections, sources=sources)]
+
+    tasks = [(i,) + task for i, task in enumerate(tasks)]
+    n_jobs = max(1, min(n_jobs or cpu_count(), len(tasks)))
+
+    if not tasks:
+        return
+
+    if ordered:
+        queues = [Queue(queue_size) for _ in xrange(n_jobs)]
+        workers = [Process(target=_parse_worker, args=(dataset_fn, tasks[i::n_jobs], queues[i], sources, batch_size))
+                   for i in xrange(n_jobs)]
+    else:
+        task_queue = Queue()
+
+        for task in tasks:
+            task_queue.put(task)
+
+        for _ in xrange(n_jobs):
+            task_queue.put(None)
+
+        queues = [Queue(queue_size * n_jobs)]
+        workers = [Process(target=_parse_worker, args=(dataset_fn, task_queue, queues[0], sources, batch_size))
+                   for _ in xrange(n_jobs)]
+
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    count = 0
+    remaining = len(tasks)
+
+    try:
+        while remaining:
+            if ordered:
+                # the next task's documents are read from the queue of the worker it's assigned to
+                i = tasks[len(tasks) - remaining][0] % n_jobs
+                msg, task_id, data = _get_message(queues[i], workers[i:i + 1])
+            else:
+                msg, task_id, data = _get_message(queues[0], workers)
+
+            if msg == 'error':
+                raise RuntimeError('Failed reading corpus file %s ...' % data)
+            elif msg == 'done':
+                remaining -= 1
+            else:
+                for doc in data:
+                    yield doc
+                    count += 1
+
+                    if count % 1000 == 0:
+                        logging.info("Read %d files ..." % count)
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+            worker.join()
 
 
 def normalize(doc):
@@ -369,15 +1009,80 @@ class AviskorpusDataset(Dataset):
     See http://www.nb.no/sprakbanken/show?serial=sbr-4&lang=nb for details.
     """
     def __init__(self, index='aviskorpus', doc_type='article', dataset_path=None,
-                 sections=None, sources=None, dataset_fn=None):
+                 sections=None, sources=None, dataset_fn=None, n_jobs=1, ordered=True, queue_size=16,
+                 offset_index_fn=None, shard=None, start_after=None, doc_keys=False):
+        """
+        :param n_jobs: Number of processes parsing the corpus files, see parallel_iterator. None uses all CPUs.
+        :type n_jobs: int|long|None
+        :param ordered: Yield the documents in corpus order when parsing in parallel.
+        :type ordered: bool
+        :param queue_size: Maximum number of document batches queued for each parsing process.
+        :type queue_size: int|long
+        :param offset_index_fn: Offset index file, see build_offset_index. Needed for sharding, and splits the
+            corpus files into smaller units of work when parsing in parallel.
+        :type offset_index_fn: str|unicode|None
+        :param shard: Tuple (i, n) to only read shard i of n disjoint shards with equal numbers of documents.
+        :type shard: (int, int)|None
+        :param start_after: Only read the documents after the document with this key, f.ex. to resume an
+            interrupted job. Faster with an offset index.
+        :type start_after: str|unicode|None
+        :param doc_keys: Add the document key (see doc_key) to each document as doc_key.
+        :type doc_keys: bool
+        :raise ValueError: If sharding without an offset index, or with shard, start_after or doc_keys and n_jobs
+            other than 1.
+        """
         super(AviskorpusDataset, self).__init__(index=index, doc_type=doc_type, dataset_path=dataset_path,
                                                 dataset_fn=dataset_fn)
 
+        if shard and not offset_index_fn:
+            raise ValueError('Sharding needs an offset index, see build_offset_index ...')
+
+        if (shard or start_after or doc_keys) and n_jobs != 1:
+            raise ValueError('Sharding, resuming and document keys are not supported with parallel parsing ...')
+
         self.archive_fn = AVISKORPUS_ARCHIVE_URL
         
         self.sections = sections
         self.sources = sources
         self.normalize_func = normalize
+        self.n_jobs = n_jobs
+        self.ordered = ordered
+        self.queue_size = queue_size
+        self.offset_index_fn = offset_index_fn
+        self.shard = shard
+        self.start_after = start_after
+        self.doc_keys = doc_keys
+
+    def _keyed_iterator(self):
+        start, stop = self.start_after, None
+
+        if self.offset_index_fn and (self.shard or self.start_after):
+            doc_range = offset_index_range(self.offset_index_fn, sections=self.sections, sources=self.sources,
+                                           shard=self.shard, start_after=self.start_after)
+
+            if not doc_range:
+                return
+
+            start, stop = doc_range
+
+        for key, doc in keyed_iterator(self.dataset_fn, sections=self.sections, sources=self.sources, start=start,
+                                       stop=stop):
+            # without an index reading starts with the start_after document
+            if key == self.start_after:
+                continue
+
+            if self.doc_keys:
+                doc['doc_key'] = key
+
+            yield doc
 
     def _iterator(self):
+        if self.shard or self.start_after or self.doc_keys:
+            return self._keyed_iterator()
+
+        if self.n_jobs != 1:
+            return parallel_iterator(self.dataset_fn, sections=self.sections, sources=self.sources, n_jobs=self.n_jobs,
+                                     ordered=self.ordered, queue_size=self.queue_size,
+                                     offset_index_fn=self.offset_index_fn)
+
         return iterator(self.dataset_fn, sections=self.sections, sources=self.sources)
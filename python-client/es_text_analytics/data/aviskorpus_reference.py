@@ -0,0 +1,199 @@
+# coding=utf-8
+import random
+import re
+import unicodedata
+
+from es_text_analytics.data.aviskorpus import match_or_none
+
+"""
+The original line by line section 1 and 2 parsers and synthetic corpus data, kept as a reference for output equality
+tests and the benchmark script of the parsers in es_text_analytics.data.aviskorpus.
+"""
+
+
+def reference_section_1_header_line(line):
+    """
+    Detects and extracts url from section 1 header line.
+
+    :param line: Line from section 1 data file.
+    :type line: str|unicode
+    :rtype : None|unicode|str
+    :return: Return the url in the header or None if the passed string is not a section 1 header line.
+    """
+    m = re.search('<U #(http://.*)>', line)
+
+    if m:
+        return m.group(1)
+
+
+def reference_section_1_parser(fileobj):
+    """
+    Parser for section 1 data files.
+    Returns a generator with dict instances with the article data.
+
+    :param fileobj: A file like instance with section 1 formatted text.
+    :rtype : generator
+    """
+    line = fileobj.readline()
+    tokens = []
+    doc = None
+
+    while line:
+        line = line.decode('latin1')
+        line = line.strip()
+
+        if line == '':
+            pass
+        elif reference_section_1_header_line(line):
+            # skip empty documents
+            if tokens:
+                doc['tokens'] = [unicodedata.normalize('NFC', unicode(token)) for token in tokens]
+                doc['corpus_section'] = 1
+
+                yield doc
+                tokens = []
+
+            url = reference_section_1_header_line(line)
+            fileobj.readline()
+            source_code = match_or_none('^<B (\w\w)>$', fileobj.readline().strip())
+            year = match_or_none('^<A (\d\d)>$', fileobj.readline().strip())
+            pub_year = int(year) if year else None
+            month = match_or_none('^<M (\d\d)>$', fileobj.readline().strip())
+            pub_month = int(month) if month else None
+            day = match_or_none('^<D (\d\d)>$', fileobj.readline().strip())
+            pub_day = int(day) if day else None
+
+            doc = {'url': url, 'source': source_code,
+                   'pub_year': pub_year, 'pub_month': pub_month, 'pub_day': pub_day}
+        else:
+            # article content consists of tokens, one on each line
+            tokens.append(line)
+
+        line = fileobj.readline()
+
+    # catch the last document
+    if doc and tokens:
+        doc['tokens'] = [unicodedata.normalize('NFC', unicode(token)) for token in tokens]
+        doc['corpus_section'] = 1
+
+        yield doc
+
+
+def reference_section_2_header_line(line):
+    """
+    Detects and extracts url from section 2 header line.
+
+    :param line: Line from section 2 data file.
+    :type line: str|unicode
+    :rtype : None|unicode|str
+    :return: Return the url in the header or None if the passed string is not a section 1 header line.
+    """
+    m = re.search('##U #(http://.*)>', line)
+
+    if m:
+        return m.group(1)
+
+
+def reference_section_2_parser(fileobj):
+    """
+    Parser for section 2 data files.
+    Returns a generator with dict instances with the article data.
+
+    :param fileobj: A file like instance with section 2 formatted text.
+    :rtype : generator
+    """
+    line = fileobj.readline()
+    text = ''
+    doc = None
+
+    while line:
+        line = line.decode('latin1')
+        line = line.strip()
+
+        if line == '' or line == '|':
+            pass
+        elif reference_section_2_header_line(line):
+            # skip articles with no content
+            if text and doc:
+                # content consists of text lines with header sections delimited by | characters and
+                # sentences delimited by paragraph characters
+                text = text.replace(u'¶', u'|')
+                doc['sentences'] = [unicodedata.normalize('NFC', unicode(sent.strip()))
+                                    for sent in text.split(u'|') if sent.strip() != '']
+                doc['corpus_section'] = 2
+
+                yield doc
+                text = ''
+
+            url = reference_section_2_header_line(line)
+            source_code = match_or_none('^##B (\w\w)>$', fileobj.readline().strip())
+            year = match_or_none('^##A (\d\d)>$', fileobj.readline().strip())
+            pub_year = int(year) if year else None
+            month = match_or_none('^##M (\d\d)>$', fileobj.readline().strip())
+            pub_month = int(month) if month else None
+            day = match_or_none('^##D (\d\d)>$', fileobj.readline().strip())
+            pub_day = int(day) if day else None
+
+            doc = {'url': url, 'source': source_code,
+                   'pub_year': pub_year, 'pub_month': pub_month, 'pub_day': pub_day}
+        else:
+            text += line
+
+        line = fileobj.readline()
+
+    # yield the last document in the file
+    if doc and text:
+        text = text.replace(u'¶', u'|')
+        doc['sentences'] = [unicodedata.normalize('NFC', unicode(sent.strip()))
+                            for sent in text.split(u'|') if sent.strip() != '']
+        doc['corpus_section'] = 2
+        yield doc
+
+
+SYNTHETIC_WORDS = ['avis', 'Oslo', 'p\xe5', 'n\xe6r', 'st\xf8rre', '.', ',', '"', 'Nr', '12', '\xa0sak', 'sak\xa0',
+                   '\xb6', '|', 'a|b', 'x \xb6 y']
+
+
+def synthetic_section_1(n_docs, max_tokens=200, seed=0):
+    """
+    Generates latin1 encoded section 1 data with the header variations seen in the corpus.
+
+    :rtype : str
+    """
+    rnd = random.Random(seed)
+    lines = ['']
+
+    for i in xrange(n_docs):
+        lines.append('<U #http://www.example.no/artikkel%d.html>' % i)
+        lines.append('|')
+        lines.append('<B %s>' % rnd.choice(['AA', 'VG', '']))
+        lines.append('<A %s>' % rnd.choice(['98', '01', '']))
+        lines.append('<M %s>' % rnd.choice(['10', '']))
+        lines.append('<D %s>' % rnd.choice(['13', '02']))
+
+        for _ in xrange(rnd.randint(0, max_tokens)):
+            lines.append(rnd.choice(SYNTHETIC_WORDS + ['']))
+
+    return '\n'.join(lines) + '\n'
+
+
+def synthetic_section_2(n_docs, max_lines=50, seed=0):
+    """
+    Generates latin1 encoded section 2 data with the header variations seen in the corpus.
+
+    :rtype : str
+    """
+    rnd = random.Random(seed)
+    lines = ['preamble \xb6']
+
+    for i in xrange(n_docs):
+        lines.append('##U #http://www.example.no/article%d.ece>' % i)
+        lines.append('##B %s>' % rnd.choice(['AA', 'VG', '']))
+        lines.append('##A %s>' % rnd.choice(['08', '']))
+        lines.append('##M %s>' % rnd.choice(['01', '1']))
+        lines.append('##D %s>' % rnd.choice(['22', '']))
+
+        for _ in xrange(rnd.randint(0, max_lines)):
+            lines.append(' '.join(rnd.choice(SYNTHETIC_WORDS) for _ in xrange(rnd.randint(0, 12))) + ' ')
+
+    return '\n'.join(lines) + '\n'
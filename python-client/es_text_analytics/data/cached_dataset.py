@@ -0,0 +1,290 @@
+import cPickle
+import json
+import logging
+import os
+import re
+import shutil
+import struct
+import tempfile
+import zlib
+
+from es_text_analytics.data.dataset import Dataset
+
+"""
+Materialized dataset cache for consumers making several passes over a dataset, f.ex. building a vocabulary and
+then a model corpus.
+
+The normalized documents are written to the cache on the first iteration and read from the cache on later
+iterations, skipping the decompression and parsing of the original dataset.
+
+Cache layout:
+
+- shard-NNNNN.bin: shards with up to shard_size documents each. A shard is a sequence of zlib compressed blocks,
+  each with a header with the compressed size and number of documents (uint32, little endian). A decompressed
+  block is a sequence of pickled documents, each prefixed with its size (uint32).
+- manifest.json: format version, cache key, document count and the shards with their document counts.
+
+The cache is written to a temporary directory that is renamed to the cache directory when the first iteration
+completes, so an abandoned iteration leaves no partial cache.
+"""
+
+DATASET_CACHE_FORMAT_VERSION = 1
+
+BLOCK_HEADER = struct.Struct('<II')
+
+RECORD_HEADER = struct.Struct('<I')
+
+CACHE_SHARD_FN = re.compile('^shard-\d{5,}\.bin$')
+
+
+class _ShardWriter(object):
+    """
+    Writes documents to shard files in a directory.
+    """
+
+    def __init__(self, cache_dir, shard_size, block_size, compress_level):
+        self.cache_dir = cache_dir
+        self.shard_size = shard_size
+        self.block_size = block_size
+        self.compress_level = compress_level
+
+        self.shards = []
+        self.shard_counts = []
+        self.count = 0
+
+        self._f = None
+        self._block = []
+        self._block_bytes = 0
+
+    def _flush_block(self):
+        if not self._block:
+            return
+
+        data = zlib.compress(''.join(self._block), self.compress_level)
+        self._f.write(BLOCK_HEADER.pack(len(data), len(self._block) // 2))
+        self._f.write(data)
+
+        self._block = []
+        self._block_bytes = 0
+
+    def _close_shard(self):
+        if self._f:
+            self._flush_block()
+            self._f.close()
+            self._f = None
+
+    def add(self, doc):
+        if not self._f or self.shard_counts[-1] >= self.shard_size:
+            self._close_shard()
+
+            fn = 'shard-%05d.bin' % len(self.shards)
+            self._f = open(os.path.join(self.cache_dir, fn), 'wb')
+            self.shards.append(fn)
+            self.shard_counts.append(0)
+
+        data = cPickle.dumps(doc, cPickle.HIGHEST_PROTOCOL)
+        self._block.append(RECORD_HEADER.pack(len(data)))
+        self._block.append(data)
+        self._block_bytes += len(data)
+        self.shard_counts[-1] += 1
+        self.count += 1
+
+        if self._block_bytes >= self.block_size:
+            self._flush_block()
+
+    def close(self):
+        self._close_shard()
+
+
+def iter_shard(fn):
+    """
+    Reads the documents in a cache shard.
+
+    :param fn: Shard file name.
+    :type fn: str|unicode
+    :rtype : generator
+    :raise IOError: If the shard is truncated.
+    """
+    with open(fn, 'rb') as f:
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+
+            if not header:
+                break
+
+            if len(header) < BLOCK_HEADER.size:
+                raise IOError('Truncated cache shard %s ...' % fn)
+
+            size, n = BLOCK_HEADER.unpack(header)
+            data = f.read(size)
+
+            if len(data) < size:
+                raise IOError('Truncated cache shard %s ...' % fn)
+
+            data = zlib.decompress(data)
+            pos = 0
+
+            for _ in xrange(n):
+                length, = RECORD_HEADER.unpack_from(data, pos)
+                pos += RECORD_HEADER.size
+
+                yield cPickle.loads(data[pos:pos + length])
+
+                pos += length
+
+
+class CachedDataset(Dataset):
+    """
+    Wraps a dataset or other iterable, materializing the documents in a cache directory on the first iteration.
+    Later iterations and len() read the cache.
+
+    The wrapped dataset normalizes the documents, so the cache holds the normalized documents. Documents must be
+    picklable.
+
+    Usage::
+
+        dataset = CachedDataset(WikipediaDataset(dump_fn=dump_fn, normalize_func=normalize), 'cache/nowiki')
+        vocab.add_documents(tokenize(doc) for doc in dataset)  # reads the dump and writes the cache
+        n_docs = len(dataset)  # reads the count from the cache
+    """
+
+    def __init__(self, dataset, cache_dir, key=None, shard_size=10000, block_size=1024 * 1024, compress_level=1):
+        """
+        :param dataset: Dataset or other iterable of documents.
+        :param cache_dir: Cache directory, replaced when the cache is rebuilt. Must not exist, be empty or hold a
+            cache, other directories are never deleted.
+        :type cache_dir: str|unicode
+        :param key: Identifies the dataset contents, f.ex. the dataset parameters or a file checksum. A cache made
+            with another key is rebuilt.
+        :type key: str|unicode|None
+        :param shard_size: Maximum number of documents in each shard.
+        :type shard_size: int|long
+        :param block_size: Uncompressed size in bytes of the compressed blocks.
+        :type block_size: int|long
+        :param compress_level: zlib compression level.
+        :type compress_level: int
+        """
+        super(CachedDataset, self).__init__(index=getattr(dataset, 'es_index', None),
+                                            doc_type=getattr(dataset, 'es_doc_type', None),
+                                            dataset_path=getattr(dataset, 'dataset_path', None))
+
+        self.dataset = dataset
+        self.cache_dir = cache_dir
+        self.key = key
+        self.shard_size = shard_size
+        self.block_size = block_size
+        self.compress_level = compress_level
+
+    def _manifest(self):
+        fn = os.path.join(self.cache_dir, 'manifest.json')
+
+        if not os.path.exists(fn):
+            return None
+
+        with open(fn) as f:
+            manifest = json.load(f)
+
+        if manifest.get('version') != DATASET_CACHE_FORMAT_VERSION or manifest.get('key') != self.key:
+            logging.info('Cache %s is outdated ...' % self.cache_dir)
+            return None
+
+        return manifest
+
+    def is_cached(self):
+        """
+        :rtype : bool
+        :return: True if the cache is complete and has the current key.
+        """
+        return self._manifest() is not None
+
+    def _check_cache_dir(self):
+        """
+        Checks that the cache directory can be replaced, ie. it doesn't exist, is empty or only holds a cache.
+
+        :raise ValueError: If the directory has other contents.
+        """
+        if not os.path.exists(self.cache_dir):
+            return
+
+        if not os.path.isdir(self.cache_dir):
+            raise ValueError('Cache location %s is not a directory ...' % self.cache_dir)
+
+        files = os.listdir(self.cache_dir)
+
+        if not files:
+            return
+
+        if 'manifest.json' in files and all(fn == 'manifest.json' or CACHE_SHARD_FN.match(fn) for fn in files):
+            return
+
+        raise ValueError('%s is not a dataset cache directory, refusing to replace it ...' % self.cache_dir)
+
+    def clear(self):
+        """
+        Deletes the cache.
+
+        :raise ValueError: If the cache directory has other files than a cache.
+        """
+        self._check_cache_dir()
+
+        if os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+
+    def _iter_cache(self, manifest):
+        logging.info('Reading %d cached documents from %s ...' % (manifest['count'], self.cache_dir))
+
+        for fn in manifest['shards']:
+            for doc in iter_shard(os.path.join(self.cache_dir, fn)):
+                yield doc
+
+    def _iter_and_cache(self):
+        # fail before the pass rather than after it
+        self._check_cache_dir()
+
+        parent_dir = os.path.dirname(os.path.abspath(self.cache_dir))
+
+        if not os.path.exists(parent_dir):
+            os.makedirs(parent_dir)
+
+        tmp_dir = tempfile.mkdtemp(prefix='.%s-' % os.path.basename(os.path.abspath(self.cache_dir)), dir=parent_dir)
+
+        try:
+            writer = _ShardWriter(tmp_dir, self.shard_size, self.block_size, self.compress_level)
+
+            for doc in self.dataset:
+                writer.add(doc)
+
+                yield doc
+
+            writer.close()
+
+            with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+                json.dump({'version': DATASET_CACHE_FORMAT_VERSION, 'key': self.key, 'count': writer.count,
+                           'shards': writer.shards, 'shard_counts': writer.shard_counts}, f)
+
+            self.clear()
+            os.rename(tmp_dir, self.cache_dir)
+            logging.info('Cached %d documents in %s ...' % (writer.count, self.cache_dir))
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir)
+
+    def _iterator(self):
+        manifest = self._manifest()
+
+        if manifest:
+            return self._iter_cache(manifest)
+
+        return self._iter_and_cache()
+
+    def __len__(self):
+        manifest = self._manifest()
+
+        if not manifest:
+            # counting takes a full pass anyway, so build the cache
+            for _ in self._iter_and_cache():
+                pass
+
+            manifest = self._manifest()
+
+        return manifest['count']
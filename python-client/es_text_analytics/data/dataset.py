@@ -2,11 +2,14 @@ import logging
 import os
 from abc import ABCMeta
 from abc import abstractmethod
+from hashlib import md5
 from urlparse import urlparse
 
 import requests
 from elasticsearch.client import IndicesClient
 
+from es_text_analytics.bulk_indexer import BulkIndexer
+
 BULK_REQUEST_SIZE = 100
 
 CONLL_U_FIELDS = ['index', 'form', 'lemma', 'cpostag', 'postag', 'feats',
@@ -59,6 +62,24 @@ def download_file(url, dest_path):
     return full_fn
 
 
+def file_checksum(fn, block_size=1024 * 1024):
+    """
+    Computes the MD5 checksum of a file, f.ex. to check whether a cache made from a dataset archive is current.
+
+    :param fn: File name.
+    :type fn: str|unicode
+    :rtype : str
+    :return: Hex digest.
+    """
+    h = md5()
+
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), ''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
 def project_path():
     """
     Returns the path to the root project directory.
@@ -174,33 +195,33 @@ class Dataset:
 
             yield doc
 
-    def index(self, es):
+    def _bulk_actions(self):
+        """
+        Bulk index actions for the documents in the dataset.
+
+        :rtype : generator
+        """
+        for doc in self:
+            if '_id' in doc:
+                yield {'index': dict(_index=self.es_index, _type=self.es_doc_type, _id=doc['_id'])}, doc
+            else:
+                yield {'index': {'_index': self.es_index, '_type': self.es_doc_type}}, doc
+
+    def index(self, es, **kwargs):
         """
         Index the dataset in the given index with archive in the dataset location.
 
+        Documents are sent with concurrent bulk requests, see BulkIndexer for the options.
+
         :param es: Elasticsearch client instance
         :type es: elasticsearch.client.Elasticsearch
-        :rtype : elasticsearch.client.Elasticsearch
+        :param kwargs: Options passed to BulkIndexer.
+        :rtype : Dataset
         :return: :raise ValueError:
         """
-        docs = []
-        count = 0
-
-        for doc in self:
-            if '_id' in  doc:
-                docs += [{'index': dict(_index=self.es_index, _type=self.es_doc_type, _id=doc['_id'])}, doc]
-            else:
-                docs += [{'index': {'_index': self.es_index, '_type': self.es_doc_type }}, doc]
-            count += 1
-
-            if len(docs) % (2 * BULK_REQUEST_SIZE) == 0:
-                es.bulk(index=self.es_index, doc_type=self.es_doc_type, body=docs)
-                logging.info('Added %d documents ...' % count)
-                docs = []
+        kwargs.setdefault('chunk_size', BULK_REQUEST_SIZE)
 
-        if docs:
-            es.bulk(index=self.es_index, doc_type=self.es_doc_type, body=docs)
-            logging.info('Added %d documents ...' % count)
+        BulkIndexer(es, self.es_index, **kwargs).index(self._bulk_actions())
 
         return self
 
@@ -217,13 +238,14 @@ class Dataset:
 
         return self
 
-    def install(self, es=None):
+    def install(self, es=None, **kwargs):
         """
         Install and optionally index the dataset.
         WARNING: Deletes the index before installing.
 
         :param es: Pass an Elasticsearch client instance to index the dataset.
         :type es: None|elasticsearch.client.Elasticsearch
+        :param kwargs: Options passed to BulkIndexer when indexing.
         :rtype : Dataset
         """
         if not self.archive_fn:
@@ -238,6 +260,6 @@ class Dataset:
         if es:
             logging.info("Creating Elasticsearch index %s ..." % self.index)
             self.delete_index(es)
-            self.index(es)
+            self.index(es, **kwargs)
 
         return self
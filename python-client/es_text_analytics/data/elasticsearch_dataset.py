@@ -1,6 +1,10 @@
+import json
+from multiprocessing import Process, Queue as ProcessQueue, Event as ProcessEvent
+from Queue import Queue, Empty, Full
 import re
 import string
 import tarfile
+from threading import Thread, Event
 
 from es_text_analytics.data.dataset import Dataset
 from elasticsearch.client import Elasticsearch
@@ -9,22 +13,236 @@ from elasticsearch.helpers import scan
 """
 Elasticsearch as data source
 
+The index can be read with a sliced scroll (Elasticsearch 5.0+), with each slice scrolled by a separate thread or
+process so the read is spread over the shards and nodes of the cluster.
 """
 
+# number of hits passed from a slice reader to the consumer at a time
+HIT_BATCH_SIZE = 100
+
+# seconds between checks that the slice readers are alive while waiting for hits
+READER_POLL_INTERVAL = 1.
+
+
+def _put(queue, item, stop):
+    """
+    Puts an item on a bounded queue, giving up when the consumer sets the stop event.
+
+    :rtype : bool
+    :return: False if stopped.
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=.1)
+            return True
+        except Full:
+            pass
+
+    return False
+
+
+def _get(queue, workers):
+    """
+    Gets the next message from the slice readers, checking that they are alive while waiting.
+
+    :raise RuntimeError: If a reader process died or all the readers exited without putting a message on the queue.
+    """
+    while True:
+        try:
+            return queue.get(timeout=READER_POLL_INTERVAL)
+        except Empty:
+            # only processes have an exit code
+            failed = [worker for worker in workers if getattr(worker, 'exitcode', None) not in (None, 0)]
+
+            if failed:
+                raise RuntimeError('Slice reader exited with code %d ...' % failed[0].exitcode)
+
+            if not any(worker.is_alive() for worker in workers):
+                # messages from exited readers are already in the queue
+                try:
+                    return queue.get(timeout=READER_POLL_INTERVAL)
+                except Empty:
+                    raise RuntimeError('Slice readers exited before all slices were read ...')
+
+
+def _scan_worker(es, es_factory, search_kwargs, queries, out_queue, stop):
+    """
+    Slice reader thread or process. Puts ('hits', slice, batch), ('done', slice, None) and ('error', slice, message)
+    messages on the output queue.
+
+    :param es: Client shared by reader threads, or None to create a client with es_factory.
+    :param queries: Queue with (slice id, query) tuples. A None item ends the queue.
+    """
+    try:
+        es = es or es_factory()
+    except Exception as e:
+        out_queue.put(('error', None, str(e)))
+        return
+
+    for slice_id, query in iter(queries.get, None):
+        try:
+            batch = []
+
+            for hit in scan(es, query=query, **search_kwargs):
+                batch.append(hit)
+
+                if len(batch) >= HIT_BATCH_SIZE:
+                    if not _put(out_queue, ('hits', slice_id, batch), stop):
+                        return
+
+                    batch = []
+
+            if batch and not _put(out_queue, ('hits', slice_id, batch), stop):
+                return
+
+            _put(out_queue, ('done', slice_id, None), stop)
+        except Exception as e:
+            _put(out_queue, ('error', slice_id, '%s: %s' % (type(e).__name__, e)), stop)
+            return
+
 
 class ElasticsearchDataset(Dataset):
     """
     Class encapsulating using Elasticsearch as datasource. Uses scan/scroll API via the es-py helpers scan.
+
+    With n_slices > 1 the index is read with a sliced scroll where each slice is scrolled concurrently by one of
+    n_workers threads, or processes with processes=True. Documents are then yielded in no particular order. Sliced
+    scroll needs Elasticsearch 5.0+, use the default single slice with older versions.
     """
 
-    def __init__(self, read_index, read_doc_type, index='new_index', doc_type='doc', query=None, dataset_path=None, normalize_func=None):
+    def __init__(self, read_index, read_doc_type, index='new_index', doc_type='doc', query=None, dataset_path=None, normalize_func=None,
+                 hosts=None, es=None, es_factory=None, n_slices=1, n_workers=None, processes=False, source_fields=None,
+                 scroll_size=1000, scroll='10m', timeout=60, queue_size=16):
+        """
+        :param query: Query body as a dict or JSON string. None reads all the documents.
+        :type query: dict|str|unicode|None
+        :param hosts: Elasticsearch hosts. Default is localhost.
+        :type hosts: list|None
+        :param es: Client to use, shared by the reader threads. Created once from hosts and reused by default.
+            Reader processes always create their own client.
+        :type es: elasticsearch.Elasticsearch|None
+        :param es_factory: Function returning a client for each reader process. Default creates a client for hosts.
+        :type es_factory: function|None
+        :param n_slices: Number of scroll slices. Typically a multiple of the number of shards in the index. More
+            than one slice needs Elasticsearch 5.0+, earlier versions reject the slice clause and the iteration
+            fails with a RuntimeError from the first reader.
+        :type n_slices: int|long
+        :param n_workers: Number of concurrent slice readers. Defaults to n_slices.
+        :type n_workers: int|long|None
+        :param processes: Read slices in processes instead of threads, when the consumer or the hit decoding
+            is CPU bound. Reader processes that don't stop within a second when the iteration ends are terminated,
+            their scroll contexts stay open until the scroll keep alive expires.
+        :type processes: bool
+        :param source_fields: Only retrieve these source fields. None retrieves the whole source.
+        :type source_fields: list[str|unicode]|None
+        :param scroll_size: Number of documents retrieved with each scroll request.
+        :type scroll_size: int|long
+        :param scroll: Scroll context keep alive.
+        :type scroll: str|unicode
+        :param timeout: Request timeout in seconds for created clients.
+        :type timeout: int|long|float
+        :param queue_size: Maximum number of hit batches queued for each reader.
+        :type queue_size: int|long
+        """
         super(ElasticsearchDataset, self).__init__(index=index, doc_type=doc_type, dataset_path=dataset_path, normalize_func=normalize_func)
         self.dataset_fn = 'elastics'
         self.read_index = read_index
         self.read_doc_type = read_doc_type
-        self.query = query
+        self.query = json.loads(query) if isinstance(query, basestring) else query
+        self.hosts = hosts
+        self.es = es
+        self.es_factory = es_factory
+        self.n_slices = n_slices
+        self.n_workers = min(n_workers or n_slices, n_slices)
+        self.processes = processes
+        self.source_fields = source_fields
+        self.scroll_size = scroll_size
+        self.scroll = scroll
+        self.timeout = timeout
+        self.queue_size = queue_size
+
+    def _client(self):
+        if not self.es:
+            # one pooled connection for each reader thread
+            self.es = Elasticsearch(hosts=self.hosts, timeout=self.timeout, maxsize=max(10, self.n_workers))
+
+        return self.es
+
+    def _new_client(self):
+        return Elasticsearch(hosts=self.hosts, timeout=self.timeout)
+
+    def _slice_query(self, slice_id):
+        query = dict(self.query or {})
+
+        if self.n_slices > 1:
+            query['slice'] = {'id': slice_id, 'max': self.n_slices}
+
+        if self.source_fields is not None:
+            query['_source'] = self.source_fields
+
+        return query or None
+
+    def _search_kwargs(self):
+        return {'index': self.read_index, 'doc_type': self.read_doc_type, 'scroll': self.scroll,
+                'size': self.scroll_size}
+
+    def _parallel_iterator(self):
+        if self.processes:
+            queue_cls, event_cls = ProcessQueue, ProcessEvent
+            # clients and their connections can't be shared with forked processes
+            es, es_factory = None, self.es_factory or self._new_client
+        else:
+            queue_cls, event_cls = Queue, Event
+            es, es_factory = self._client(), None
+
+        queries = queue_cls()
+
+        for slice_id in xrange(self.n_slices):
+            queries.put((slice_id, self._slice_query(slice_id)))
+
+        for _ in xrange(self.n_workers):
+            queries.put(None)
+
+        out_queue = queue_cls(self.queue_size * self.n_workers)
+        stop = event_cls()
+        worker_cls = Process if self.processes else Thread
+        workers = [worker_cls(target=_scan_worker, args=(es, es_factory, self._search_kwargs(), queries, out_queue,
+                                                         stop))
+                   for _ in xrange(self.n_workers)]
+
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        remaining = self.n_slices
+
+        try:
+            while remaining:
+                msg, slice_id, data = _get(out_queue, workers)
+
+                if msg == 'error':
+                    raise RuntimeError('Failed reading slice %s of %s: %s ...' % (slice_id, self.read_index, data))
+                elif msg == 'done':
+                    remaining -= 1
+                else:
+                    for hit in data:
+                        yield hit
+        finally:
+            # readers blocked on a full queue return when stopped, which clears their scroll contexts
+            stop.set()
+
+            for worker in workers:
+                if self.processes:
+                    worker.join(READER_POLL_INTERVAL)
+
+                    # terminated processes leave their scroll contexts open until the scroll keep alive expires
+                    if worker.is_alive():
+                        worker.terminate()
+
+                worker.join()
 
     def _iterator(self):
-        es = Elasticsearch(timeout=60)
-        return scan(es, scroll=u'10m', query=self.query,
-                    index=self.read_index, doc_type=self.read_doc_type)
+        if self.n_slices > 1:
+            return self._parallel_iterator()
+
+        return scan(self._client(), query=self._slice_query(0), **self._search_kwargs())
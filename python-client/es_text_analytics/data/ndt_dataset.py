@@ -1,13 +1,24 @@
 # coding=utf-8
+from array import array
+import json
 import logging
 from operator import itemgetter
 import os
+import shutil
 from tarfile import TarFile
+import tempfile
+
+import numpy
 
 from es_text_analytics.data.dataset import Dataset, parse_conll, CONLL_U_FIELDS
 
 NDT_ARCHIVE_URL='http://www.nb.no/sbfil/tekst/20140328_NDT_1-01.tar.gz'
 
+NDT_CACHE_FORMAT_VERSION = 1
+
+# number of sentences decoded from the cache at a time
+NDT_CACHE_BLOCK_SIZE = 1000
+
 
 def filelist(lang=None, sections=None):
     """
@@ -67,6 +78,208 @@ def iterator(dataset_fn, sections=None, lang=None, field_indices=None):
                 m_f.close()
 
 
+def _write_cached_file(sentences, file_dir):
+    """
+    Writes parsed sentences in the columnar cache format.
+
+    Each string column has its own vocabulary with the distinct values in order of appearance, and the token rows
+    are stored as an int32 array with the token index in the first column and vocabulary ids in the others.
+
+    :rtype : int
+    :return: Number of sentences.
+    """
+    n_fields = len(CONLL_U_FIELDS)
+    vocabs = [[] for _ in xrange(n_fields)]
+    vocab_ids = [{} for _ in xrange(n_fields)]
+    columns = array('i')
+    offsets = array('i', [0])
+
+    for sentence in sentences:
+        for row in sentence:
+            if len(row) != n_fields:
+                raise ValueError('Expected %d CONLL columns, got %d ...' % (n_fields, len(row)))
+
+            columns.append(row[0])
+
+            for i in xrange(1, n_fields):
+                ids = vocab_ids[i]
+                val = row[i]
+                val_id = ids.get(val)
+
+                if val_id is None:
+                    val_id = ids[val] = len(vocabs[i])
+                    vocabs[i].append(val)
+
+                columns.append(val_id)
+
+        offsets.append(len(columns) // n_fields)
+
+    os.makedirs(file_dir)
+    numpy.save(os.path.join(file_dir, 'columns.npy'),
+               numpy.array(columns, dtype=numpy.int32).reshape(-1, n_fields))
+    numpy.save(os.path.join(file_dir, 'offsets.npy'), numpy.array(offsets, dtype=numpy.int32))
+
+    with open(os.path.join(file_dir, 'vocab.json'), 'w') as f:
+        # the index column is stored as is
+        json.dump([None] + vocabs[1:], f)
+
+    return len(offsets) - 1
+
+
+def _dataset_stat(dataset_fn):
+    st = os.stat(dataset_fn)
+
+    return [st.st_size, int(st.st_mtime)]
+
+
+def _check_cache_dir(cache_dir):
+    """
+    Checks that a cache directory can be replaced, ie. it doesn't exist, is empty or has an NDT cache manifest.
+
+    :raise ValueError: If the directory has other contents.
+    """
+    if not os.path.exists(cache_dir) or (os.path.isdir(cache_dir) and not os.listdir(cache_dir)):
+        return
+
+    try:
+        manifest = _load_manifest(cache_dir)
+    except (IOError, ValueError):
+        manifest = None
+
+    if not isinstance(manifest, dict) or 'files' not in manifest:
+        raise ValueError('%s is not an NDT cache directory, refusing to replace it ...' % cache_dir)
+
+
+def build_cache(dataset_fn, cache_dir):
+    """
+    Converts all the CONLL files in the NDT archive to a columnar cache that can be iterated much faster than
+    parsing the archive, see cached_iterator.
+
+    The cache has a directory for each file with the token columns and sentence offsets as memory mappable int32
+    numpy arrays and the column vocabularies, and a manifest. The cache is built in a temporary directory that is
+    renamed to cache_dir when complete, so an interrupted conversion is not used.
+
+    :param dataset_fn: Path to NDT dataset archive file.
+    :type dataset_fn: unicode|str
+    :param cache_dir: Cache directory. Replaced if it holds a cache, it must otherwise not exist or be empty.
+    :type cache_dir: unicode|str
+    :raise ValueError: If a file has rows without the 10 CONLL columns, or cache_dir has other contents.
+    """
+    _check_cache_dir(cache_dir)
+
+    parent_dir = os.path.dirname(os.path.abspath(cache_dir))
+
+    if not os.path.exists(parent_dir):
+        os.makedirs(parent_dir)
+
+    tmp_dir = tempfile.mkdtemp(prefix='.%s-' % os.path.basename(os.path.abspath(cache_dir)), dir=parent_dir)
+    files = []
+
+    try:
+        with TarFile.open(dataset_fn, 'r:gz') as f:
+            for member in f:
+                if member.isfile() and member.name.endswith('.conll'):
+                    logging.info('Caching %s ...' % member.name)
+                    fn = os.path.basename(member.name)
+                    # numbered directories keep the archive order and allow repeated file names
+                    dir_name = '%03d-%s' % (len(files), fn)
+                    m_f = f.extractfile(member)
+
+                    n = _write_cached_file(parse_conll(m_f), os.path.join(tmp_dir, dir_name))
+                    files.append([fn, dir_name])
+
+                    m_f.close()
+                    logging.info('Cached %d sentences ...' % n)
+
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+            json.dump({'version': NDT_CACHE_FORMAT_VERSION, 'dataset': _dataset_stat(dataset_fn), 'files': files},
+                      f)
+
+        # checked again in case the directory changed during the conversion
+        _check_cache_dir(cache_dir)
+
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+
+        os.rename(tmp_dir, cache_dir)
+    finally:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+
+def _load_manifest(cache_dir):
+    fn = os.path.join(cache_dir, 'manifest.json')
+
+    if not os.path.exists(fn):
+        return None
+
+    with open(fn) as f:
+        return json.load(f)
+
+
+def cache_is_current(cache_dir, dataset_fn):
+    """
+    Checks that the cache is complete and was built from the dataset archive in its current state.
+
+    :rtype : bool
+    """
+    manifest = _load_manifest(cache_dir)
+
+    return bool(manifest and manifest['version'] == NDT_CACHE_FORMAT_VERSION and
+                manifest['dataset'] == _dataset_stat(dataset_fn))
+
+
+def _iter_cached_file(file_dir, field_indices=None):
+    columns = numpy.load(os.path.join(file_dir, 'columns.npy'), mmap_mode='r')
+    offsets = numpy.load(os.path.join(file_dir, 'offsets.npy')).tolist()
+
+    with open(os.path.join(file_dir, 'vocab.json')) as f:
+        vocabs = [numpy.array(v, dtype=object) if v is not None else None for v in json.load(f)]
+
+    fields = field_indices or range(len(vocabs))
+    n_sentences = len(offsets) - 1
+
+    for first in xrange(0, n_sentences, NDT_CACHE_BLOCK_SIZE):
+        last = min(first + NDT_CACHE_BLOCK_SIZE, n_sentences)
+        start = offsets[first]
+        block = columns[start:offsets[last]]
+        # decode a block of sentences column by column and assemble the rows in one go
+        cols = [vocabs[i][block[:, i]].tolist() if vocabs[i] is not None else block[:, i].tolist() for i in fields]
+        rows = map(list, zip(*cols))
+
+        for j in xrange(first, last):
+            yield rows[offsets[j] - start:offsets[j + 1] - start]
+
+
+def cached_iterator(cache_dir, sections=None, lang=None, field_indices=None):
+    """
+    Provides an iterator of CONLL formatted sentences from a cache made with build_cache. Yields the same sentences
+    as iterator.
+
+    :param cache_dir: Cache directory.
+    :type cache_dir: unicode|str
+    :param sections:
+    :type sections: list[str|unicode]|None
+    :param lang:
+    :type lang: list[str|unicode]|None
+    :rtype : generator
+    :raise ValueError: If there is no complete cache in cache_dir.
+    """
+    manifest = _load_manifest(cache_dir)
+
+    if not manifest or manifest['version'] != NDT_CACHE_FORMAT_VERSION:
+        raise ValueError('No NDT cache in %s ...' % cache_dir)
+
+    files = filelist(lang=lang, sections=sections)
+
+    for fn, dir_name in manifest['files']:
+        if fn in files:
+            logging.info('reading cached %s ...' % fn)
+
+            for sentence in _iter_cached_file(os.path.join(cache_dir, dir_name), field_indices=field_indices):
+                yield sentence
+
+
 def normalize(doc):
     """
     Normalize a treebank sentence to a string with the token forms.
@@ -88,7 +301,7 @@ class NDTDataset(Dataset):
 
     def __init__(self, index='ndt', doc_type='sentence', dataset_path=None,
                  dataset_fn=None, lang=None, sections=None, fields=None,
-                 normalize_func=normalize):
+                 normalize_func=normalize, cache_dir=None):
         """
         Default includes all sections, languages and fields.
 
@@ -98,6 +311,10 @@ class NDTDataset(Dataset):
         :type lang: list[str|unicode]|None
         :param fields: Columns to include (index, form, lemma, cpostag, postag, feats, head, deprel, deps, misc).
         :type fields: list[str|unicode]|None
+        :param cache_dir: Read the sentences from a columnar cache in this directory, see build_cache. The cache is
+          built on the first iteration and rebuilt when the dataset archive changes. Use a dedicated directory,
+          directories with other contents are never replaced.
+        :type cache_dir: str|unicode|None
         """
         super(NDTDataset, self).__init__(index=index, doc_type=doc_type, dataset_path=dataset_path,
                                          dataset_fn=dataset_fn, normalize_func=normalize_func)
@@ -112,7 +329,15 @@ class NDTDataset(Dataset):
 
         self.sections = sections
         self.lang = lang
+        self.cache_dir = cache_dir
 
     def _iterator(self):
+        if self.cache_dir:
+            if not cache_is_current(self.cache_dir, self.dataset_fn):
+                build_cache(self.dataset_fn, self.cache_dir)
+
+            return cached_iterator(self.cache_dir, sections=self.sections, lang=self.lang,
+                                   field_indices=self.field_indices)
+
         return iterator(self.dataset_fn, sections=self.sections,
                         lang=self.lang, field_indices=self.field_indices)
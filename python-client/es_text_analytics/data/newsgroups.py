@@ -1,9 +1,15 @@
+import json
+import logging
 import os
+import tempfile
+from gzip import GzipFile
+
+import numpy
 
 from sklearn import datasets
 from sklearn.datasets import twenty_newsgroups
 
-from es_text_analytics.data.dataset import Dataset
+from es_text_analytics.data.dataset import Dataset, file_checksum
 
 """
 The 20 Newsgroups dataset is a standardized dataset with Newsgroup messages.
@@ -13,17 +19,24 @@ http://qwone.com/~jason/20Newsgroups/
 
 NEWSGROUPS_ARCHIVE_URL = 'http://qwone.com/~jason/20Newsgroups/20news-18828.tar.gz'
 
+NEWSGROUPS_CACHE_FN = 'newsgroups-cache.jsonl.gz'
 
-def iterator(dataset_fn):
-    """
-    Provides an iterator of parsed documents from the 20 Newsgroups dataset.
+NEWSGROUPS_CACHE_FORMAT_VERSION = 1
 
-    :param dataset_fn: Path to Newsgroups dataset archive file.
-    :type dataset_fn: unicode|str
-    :rtype : generator
+
+def _doc(doc_id, article, group, target, filename):
+    """
+    Builds a document with the same field types whether the fields are parsed or read from the cache.
     """
-    ng = datasets.fetch_20newsgroups()
+    return {'doc_id': _str(doc_id), 'article': article, 'group': _str(group), 'target': numpy.int64(target),
+            'filename': _str(filename)}
+
 
+def _str(s):
+    return s.encode('utf-8') if isinstance(s, unicode) else str(s)
+
+
+def _fetched_docs(ng):
     for article, group, target, filename in zip(ng['data'], [ng['target_names'][x] for x in ng['target']],
                                                 ng['target'], ng['filenames']):
         article = twenty_newsgroups.strip_newsgroup_header(article)
@@ -31,7 +44,103 @@ def iterator(dataset_fn):
         article = twenty_newsgroups.strip_newsgroup_quoting(article)
         doc_id = os.path.basename(filename)
 
-        yield {'doc_id': doc_id, 'article': article, 'group': group, 'target': target, 'filename': filename}
+        yield _doc(doc_id, article, group, target, filename)
+
+
+def archive_path(data_home=None):
+    """
+    Returns the location of the archive fetch_20newsgroups reads the dataset from.
+
+    :param data_home: Scikit-learn data directory. Default uses the Scikit-learn default location.
+    :type data_home: str|unicode|None
+    :rtype : str|unicode
+    """
+    return os.path.join(datasets.get_data_home(data_home=data_home), twenty_newsgroups.CACHE_NAME)
+
+
+def _read_cache_header(cache_fn):
+    if not os.path.exists(cache_fn):
+        return None
+
+    try:
+        with GzipFile(cache_fn) as f:
+            return json.loads(f.readline())
+    except (IOError, ValueError):
+        logging.warning('Unreadable cache %s ...' % cache_fn)
+        return None
+
+
+def _iter_cache(cache_fn):
+    with GzipFile(cache_fn) as f:
+        f.readline()
+
+        for line in f:
+            doc = json.loads(line)
+            yield _doc(doc['doc_id'], doc['article'], doc['group'], doc['target'], doc['filename'])
+
+
+def _write_cache(cache_fn, checksum, docs):
+    """
+    Writes the documents to the cache while passing them on. The cache is only put in place when all the documents
+    are written. Each iteration writes its own temporary file, so concurrent iterations don't interfere.
+    """
+    fd, tmp_fn = tempfile.mkstemp(prefix='.%s-' % os.path.basename(cache_fn),
+                                  dir=os.path.dirname(os.path.abspath(cache_fn)))
+    os.close(fd)
+
+    try:
+        with GzipFile(tmp_fn, 'wb') as f:
+            f.write(json.dumps({'version': NEWSGROUPS_CACHE_FORMAT_VERSION, 'checksum': checksum}) + '\n')
+
+            for doc in docs:
+                f.write(json.dumps(dict(doc, target=int(doc['target']))) + '\n')
+                yield doc
+
+        os.rename(tmp_fn, cache_fn)
+        logging.info('Wrote preprocessed documents to %s ...' % cache_fn)
+    finally:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+
+
+def iterator(dataset_fn, cache_fn=None, data_home=None):
+    """
+    Provides an iterator of parsed documents from the 20 Newsgroups dataset.
+
+    With a cache file the stripped documents are written to the cache on the first iteration and streamed from the
+    cache on later iterations, until the dataset archive checksum changes.
+
+    :param dataset_fn: Path to Newsgroups dataset archive file.
+    :type dataset_fn: unicode|str
+    :param cache_fn: Cache file. None disables the cache.
+    :type cache_fn: unicode|str|None
+    :param data_home: Scikit-learn data directory with the dataset archive. Default uses the Scikit-learn default
+        location.
+    :type data_home: unicode|str|None
+    :rtype : generator
+    """
+    if cache_fn:
+        archive_fn = archive_path(data_home=data_home)
+        header = _read_cache_header(cache_fn)
+
+        # checking the header first avoids a checksum when there is no cache
+        if (header and header.get('version') == NEWSGROUPS_CACHE_FORMAT_VERSION and os.path.exists(archive_fn) and
+                header.get('checksum') == file_checksum(archive_fn)):
+            logging.info('Reading preprocessed documents from %s ...' % cache_fn)
+
+            for doc in _iter_cache(cache_fn):
+                yield doc
+
+            return
+
+    ng = datasets.fetch_20newsgroups(data_home=data_home)
+    docs = _fetched_docs(ng)
+
+    if cache_fn:
+        docs = _write_cache(cache_fn, file_checksum(archive_path(data_home=data_home)), docs)
+
+    for doc in docs:
+        yield doc
 
 
 class NewsgroupsDataset(Dataset):
@@ -41,9 +150,26 @@ class NewsgroupsDataset(Dataset):
     Currently only downloads and index the dataset in Elasticsearch.
     """
 
-    def __init__(self, index='newsgroups', doc_type='message', dataset_path=None):
+    def __init__(self, index='newsgroups', doc_type='message', dataset_path=None, cache=True, cache_fn=None,
+                 data_home=None):
+        """
+        :param cache: Cache the preprocessed documents, see iterator.
+        :type cache: bool
+        :param cache_fn: Cache file. Default is newsgroups-cache.jsonl.gz in the dataset path.
+        :type cache_fn: str|unicode|None
+        :param data_home: Scikit-learn data directory with the dataset archive.
+        :type data_home: str|unicode|None
+        """
         super(NewsgroupsDataset, self).__init__(index=index, doc_type=doc_type, dataset_path=dataset_path)
 
+        self.cache_fn = None
+        self.data_home = data_home
+
+        if cache:
+            self.cache_fn = cache_fn or os.path.join(self.dataset_path, NEWSGROUPS_CACHE_FN)
 
     def _iterator(self):
-        return iterator(self.dataset_fn)
+        if self.cache_fn and not os.path.exists(os.path.dirname(os.path.abspath(self.cache_fn))):
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_fn)))
+
+        return iterator(self.dataset_fn, cache_fn=self.cache_fn, data_home=self.data_home)
@@ -1,9 +1,20 @@
 # coding=iso-8859-1
+import os
+import shutil
+import tarfile
+import tempfile
 from StringIO import StringIO
+from gzip import GzipFile
+from multiprocessing import Process, Queue
 from unittest import TestCase
+from zipfile import ZipFile
 
 from es_text_analytics.data.aviskorpus import section_1_header_line, section_1_parser, section_2_header_line, \
-    section_2_parser, section_3_parser
+    section_2_parser, section_3_parser, GzipStreamReader, iterator, CORPUS_SECTIONS, \
+    parallel_iterator, AviskorpusDataset, build_offset_index, keyed_iterator, iter_offset_index, parse_doc_key, \
+    offset_index_range, offset_index_tasks, _get_message
+from es_text_analytics.data.aviskorpus_reference import reference_section_1_parser, \
+    reference_section_2_parser, synthetic_section_1, synthetic_section_2
 
 SECTION_1_SAMPLE_1 = """
 <U #http://odin.dep.no/fd/prm/1998/k4/981013.html>
@@ -193,6 +204,20 @@ class TestAviskorpusHelpers(TestCase):
                           'Gigantutslipp fra StatoilHydro:', u'Svrt skuffet miljvernminister'],
                          result[1]['sentences'])
 
+    def test_parsers_match_reference(self):
+        for seed in range(3):
+            data = synthetic_section_1(200, seed=seed)
+            self.assertEqual(list(reference_section_1_parser(StringIO(data))), list(section_1_parser(StringIO(data))))
+
+            data = synthetic_section_2(200, seed=seed)
+            self.assertEqual(list(reference_section_2_parser(StringIO(data))), list(section_2_parser(StringIO(data))))
+
+        for data in (SECTION_1_SAMPLE_1, SECTION_1_SAMPLE_2):
+            self.assertEqual(list(reference_section_1_parser(StringIO(data))), list(section_1_parser(StringIO(data))))
+
+        self.assertEqual(list(reference_section_2_parser(StringIO(SECTION_2_SAMPLE))),
+                         list(section_2_parser(StringIO(SECTION_2_SAMPLE))))
+
     def test_section_3_parser(self):
         result = section_3_parser(StringIO(SECTION_3_SAMPLE_1))
 
@@ -236,3 +261,170 @@ class TestAviskorpusHelpers(TestCase):
         self.assertEqual('', result['caption'])
         self.assertEqual(3, result['corpus_section'])
         self.assertEqual([], result['text'])
+
+
+def gzip_bytes(data):
+    f = StringIO()
+
+    with GzipFile(fileobj=f, mode='wb') as gz:
+        gz.write(data)
+
+    return f.getvalue()
+
+
+def tar_gz_bytes(files):
+    f = StringIO()
+
+    with tarfile.open(fileobj=f, mode='w:gz') as tf:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, StringIO(data))
+
+    return f.getvalue()
+
+
+def write_corpus_archive(fn):
+    """
+    Writes a miniature corpus archive with the sample data in the corpus layout.
+    """
+    with ZipFile(fn, 'w') as zf:
+        # the first file has two concatenated gzip members
+        zf.writestr(CORPUS_SECTIONS['1']['paths'][0], gzip_bytes(SECTION_1_SAMPLE_1) + gzip_bytes(SECTION_1_SAMPLE_2))
+        zf.writestr(CORPUS_SECTIONS['1']['paths'][1], gzip_bytes(''))
+        zf.writestr(CORPUS_SECTIONS['1']['paths'][2], gzip_bytes(SECTION_1_SAMPLE_2))
+        zf.writestr('2/aa.tar.gz', tar_gz_bytes([('aa/1.txt', SECTION_2_SAMPLE), ('aa/2.txt', SECTION_2_SAMPLE)]))
+        zf.writestr('3/kk.tar.gz', tar_gz_bytes([('kk/1.xml', SECTION_3_SAMPLE_1), ('kk/readme.txt', 'foo'),
+                                                 ('kk/2.xml', SECTION_3_SAMPLE_2)]))
+
+        for fn in CORPUS_SECTIONS['2']['paths'] + CORPUS_SECTIONS['3']['paths']:
+            if fn not in zf.namelist():
+                zf.writestr(fn, tar_gz_bytes([]))
+
+
+class TestAviskorpusIterator(TestCase):
+    def setUp(self):
+        super(TestAviskorpusIterator, self).setUp()
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp_dir, 'aviskorpus.zip')
+        write_corpus_archive(self.fn)
+
+    def tearDown(self):
+        super(TestAviskorpusIterator, self).tearDown()
+
+        shutil.rmtree(self.tmp_dir)
+
+    def test_gzip_stream_reader(self):
+        data = SECTION_1_SAMPLE_1 * 50
+        reader = GzipStreamReader(StringIO(gzip_bytes(data) + gzip_bytes(SECTION_1_SAMPLE_2)), block_size=16)
+
+        self.assertEqual(data.splitlines(True) + SECTION_1_SAMPLE_2.splitlines(True), list(reader))
+
+        reader = GzipStreamReader(StringIO(gzip_bytes(data)), block_size=16)
+        self.assertEqual(data[:100], reader.read(100))
+        self.assertEqual(data[100:], reader.read())
+        self.assertEqual('', reader.readline())
+
+        # highly compressible data is decompressed a block at a time
+        data = ('x' * 1000 + '\n') * 100
+        reader = GzipStreamReader(StringIO(gzip_bytes(data)), block_size=64)
+
+        for line in reader:
+            self.assertEqual(data[:1001], line)
+            self.assertLessEqual(len(reader._buffer), 1001 + 64)
+
+    def test_iterator(self):
+        docs = list(iterator(self.fn, sections=[1]))
+        expected = (list(section_1_parser(StringIO(SECTION_1_SAMPLE_1))) +
+                    list(section_1_parser(StringIO(SECTION_1_SAMPLE_2))) * 2)
+        self.assertEqual(expected, docs)
+
+        docs = list(iterator(self.fn, sections=[2, 3], sources=['aa', 'kk']))
+        expected = (list(section_2_parser(StringIO(SECTION_2_SAMPLE))) * 2 +
+                    [section_3_parser(StringIO(SECTION_3_SAMPLE_1)), section_3_parser(StringIO(SECTION_3_SAMPLE_2))])
+        self.assertEqual(expected, docs)
+
+    def test_parallel_iterator(self):
+        expected = list(iterator(self.fn))
+        self.assertEqual(10, len(expected))
+
+        self.assertEqual(expected, list(parallel_iterator(self.fn, n_jobs=2, ordered=True, queue_size=1,
+                                                          batch_size=1)))
+        self.assertEqual(sorted(expected), sorted(parallel_iterator(self.fn, n_jobs=3, batch_size=2)))
+        self.assertEqual(list(iterator(self.fn, sections=[2, 3], sources=['aa', 'kk'])),
+                         list(parallel_iterator(self.fn, sections=[2, 3], sources=['aa', 'kk'], ordered=True)))
+
+        docs = parallel_iterator(self.fn, n_jobs=2, ordered=True, queue_size=1, batch_size=1)
+        self.assertEqual(expected[0], next(docs))
+        docs.close()
+
+        dataset = AviskorpusDataset(dataset_fn=self.fn, n_jobs=2)
+        self.assertEqual([doc['text'] for doc in AviskorpusDataset(dataset_fn=self.fn)],
+                         [doc['text'] for doc in dataset])
+
+    def test_parallel_iterator_ranges(self):
+        index_fn = os.path.join(self.tmp_dir, 'offsets.gz')
+        build_offset_index(self.fn, index_fn)
+        expected = list(iterator(self.fn))
+
+        tasks = offset_index_tasks(index_fn, task_size=2)
+        self.assertEqual(6, len(tasks))
+        self.assertEqual((1, '1/19981013-20010307.gz', ('', 1), ('', 131)), tasks[0])
+
+        for task_size in (1, 2, 3):
+            self.assertEqual(expected, list(parallel_iterator(self.fn, n_jobs=3, ordered=True, batch_size=1,
+                                                              offset_index_fn=index_fn, task_size=task_size)))
+
+        self.assertEqual(sorted(expected), sorted(parallel_iterator(self.fn, n_jobs=2, offset_index_fn=index_fn,
+                                                                    task_size=1)))
+        self.assertEqual(list(iterator(self.fn, sections=[1, 2], sources=['AA', 'aa'])),
+                         list(parallel_iterator(self.fn, sections=[1, 2], sources=['AA', 'aa'], ordered=True,
+                                                offset_index_fn=index_fn, task_size=1)))
+
+    def test_parallel_iterator_errors(self):
+        self.assertRaises(RuntimeError, list, parallel_iterator(os.path.join(self.tmp_dir, 'notfound.zip'), n_jobs=2))
+
+        # a worker dying without putting a message on the queue
+        worker = Process(target=os._exit, args=(3,))
+        worker.start()
+        worker.join()
+        self.assertRaises(RuntimeError, _get_message, Queue(), [worker])
+
+    def test_offset_index(self):
+        index_fn = os.path.join(self.tmp_dir, 'offsets.gz')
+        self.assertEqual(10, build_offset_index(self.fn, index_fn))
+
+        keyed = list(keyed_iterator(self.fn))
+        keys = [key for key, _ in keyed]
+        self.assertEqual(list(iterator(self.fn)), [doc for _, doc in keyed])
+        self.assertEqual(keys, list(iter_offset_index(index_fn)))
+        self.assertEqual(10, len(set(keys)))
+        self.assertEqual('1/19981013-20010307.gz@1', keys[0])
+        self.assertEqual('3/kk.tar.gz/kk/2.xml@0', keys[-1])
+        self.assertEqual(('2/aa.tar.gz', 'aa/2.txt', 219), parse_doc_key(keys[7]))
+        self.assertRaises(ValueError, parse_doc_key, 'aa.tar.gz')
+
+        # reading a range seeks past the earlier documents in the file or member
+        self.assertEqual(keyed[1:8], list(keyed_iterator(self.fn, start=keys[1], stop=keys[7])))
+        self.assertEqual(keys[2:4], list(iter_offset_index(index_fn, sections=[1], sources=['AA'])))
+
+        for n in (1, 3, 4, 20):
+            docs = []
+
+            for i in range(n):
+                docs += [doc['doc_key'] for doc in AviskorpusDataset(dataset_fn=self.fn, offset_index_fn=index_fn,
+                                                                     shard=(i, n), doc_keys=True)]
+
+            self.assertEqual(keys, docs)
+
+        self.assertEqual(keys[6:], [doc['doc_key'] for doc in AviskorpusDataset(dataset_fn=self.fn, doc_keys=True,
+                                                                                 start_after=keys[5])])
+        self.assertEqual(keys[3:5], [doc['doc_key'] for doc in
+                                     AviskorpusDataset(dataset_fn=self.fn, offset_index_fn=index_fn, shard=(0, 2),
+                                                       start_after=keys[2], doc_keys=True)])
+        self.assertEqual([], list(AviskorpusDataset(dataset_fn=self.fn, offset_index_fn=index_fn, shard=(0, 2),
+                                                    start_after=keys[5])))
+        self.assertEqual((keys[2], keys[3]), offset_index_range(index_fn, sources=['AA']))
+        self.assertRaises(ValueError, offset_index_range, index_fn, start_after='1/19981013-20010307.gz@2')
+        self.assertRaises(ValueError, AviskorpusDataset, dataset_fn=self.fn, shard=(0, 2))
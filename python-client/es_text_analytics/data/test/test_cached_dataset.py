@@ -0,0 +1,96 @@
+# coding=utf-8
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from es_text_analytics.data.cached_dataset import CachedDataset, iter_shard
+from es_text_analytics.data.dataset import Dataset
+
+
+class CountingDataset(Dataset):
+    def __init__(self, docs):
+        super(CountingDataset, self).__init__(index='counting', doc_type='doc', normalize_func=lambda doc: doc)
+
+        self.docs = docs
+        self.passes = 0
+
+    def _iterator(self):
+        self.passes += 1
+
+        return iter(self.docs)
+
+
+class TestCachedDataset(TestCase):
+    def setUp(self):
+        super(TestCachedDataset, self).setUp()
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache', 'docs')
+        self.docs = [{'id': i, 'text': u'dokument nummer %d på norsk' % i, 'tokens': ['a'] * (i % 7)}
+                     for i in range(1000)]
+
+    def tearDown(self):
+        super(TestCachedDataset, self).tearDown()
+
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cached_dataset(self):
+        source = CountingDataset(self.docs)
+        dataset = CachedDataset(source, self.cache_dir, shard_size=300, block_size=1000)
+
+        self.assertFalse(dataset.is_cached())
+        self.assertEqual(self.docs, list(dataset))
+        self.assertTrue(dataset.is_cached())
+        self.assertEqual(['manifest.json', 'shard-00000.bin', 'shard-00001.bin', 'shard-00002.bin',
+                          'shard-00003.bin'], sorted(os.listdir(self.cache_dir)))
+        self.assertEqual(self.docs[900:], list(iter_shard(os.path.join(self.cache_dir, 'shard-00003.bin'))))
+
+        self.assertEqual(self.docs, list(dataset))
+        self.assertEqual(1000, len(dataset))
+        self.assertEqual(1, source.passes)
+        self.assertEqual('counting', dataset.es_index)
+
+        # a new key rebuilds the cache
+        dataset = CachedDataset(source, self.cache_dir, key='v2')
+        self.assertEqual(1000, len(dataset))
+        self.assertEqual(2, source.passes)
+        self.assertEqual(self.docs, list(dataset))
+        self.assertEqual(['manifest.json', 'shard-00000.bin'], sorted(os.listdir(self.cache_dir)))
+
+    def test_abandoned_iteration(self):
+        dataset = CachedDataset(CountingDataset(self.docs), self.cache_dir)
+
+        docs = iter(dataset)
+        next(docs)
+        docs.close()
+
+        self.assertFalse(dataset.is_cached())
+        self.assertEqual([], os.listdir(os.path.dirname(self.cache_dir)))
+
+        dataset = CachedDataset(iter([]), self.cache_dir)
+        self.assertEqual(0, len(dataset))
+        self.assertEqual([], list(dataset))
+
+    def test_foreign_cache_dir(self):
+        os.makedirs(self.cache_dir)
+        dump_fn = os.path.join(self.cache_dir, 'nowiki.xml.bz2')
+
+        with open(dump_fn, 'w') as f:
+            f.write('dump')
+
+        source = CountingDataset(self.docs)
+        dataset = CachedDataset(source, self.cache_dir)
+
+        self.assertRaises(ValueError, list, dataset)
+        self.assertRaises(ValueError, len, dataset)
+        self.assertRaises(ValueError, dataset.clear)
+        self.assertEqual(0, source.passes)
+        self.assertEqual(['nowiki.xml.bz2'], os.listdir(self.cache_dir))
+        self.assertEqual([], [fn for fn in os.listdir(os.path.dirname(self.cache_dir)) if fn.startswith('.')])
+
+        # an outdated cache is replaced
+        os.remove(dump_fn)
+        self.assertEqual(1000, len(CachedDataset(source, self.cache_dir, key='v1')))
+        self.assertEqual(self.docs, list(CachedDataset(source, self.cache_dir, key='v2')))
+        self.assertEqual(2, source.passes)
@@ -0,0 +1,67 @@
+import os
+from unittest import TestCase
+
+from es_text_analytics.data.elasticsearch_dataset import ElasticsearchDataset
+from es_text_analytics.test.mock_es import MockElasticsearch
+
+
+def mock_es_factory():
+    es = MockElasticsearch()
+    es.indices['source'] = dict(('doc%d' % i, {'text': 'text %d' % i, 'title': 'title %d' % i})
+                                for i in range(250))
+
+    return es
+
+
+def dying_es_factory():
+    os._exit(3)
+
+
+class TestElasticsearchDataset(TestCase):
+    def setUp(self):
+        super(TestElasticsearchDataset, self).setUp()
+
+        self.es = mock_es_factory()
+
+    def test_scan(self):
+        dataset = ElasticsearchDataset('source', 'doc', es=self.es, scroll_size=100)
+        hits = list(dataset)
+
+        self.assertEqual(250, len(hits))
+        self.assertEqual({'text': 'text 0', 'title': 'title 0'}, hits[0]['_source'])
+        # the client is reused
+        self.assertEqual(250, len(list(dataset)))
+        self.assertIs(self.es, dataset.es)
+
+        dataset = ElasticsearchDataset('source', 'doc', es=self.es, source_fields=['title'], query='{"query": {}}')
+        self.assertEqual([{'title': 'title %d' % i} for i in range(250)],
+                         sorted((hit['_source'] for hit in dataset), key=lambda s: int(s['title'].split()[1])))
+
+    def test_sliced_scan(self):
+        expected = sorted(hit['_id'] for hit in ElasticsearchDataset('source', 'doc', es=self.es))
+
+        dataset = ElasticsearchDataset('source', 'doc', es=self.es, n_slices=4, scroll_size=10, queue_size=1)
+        self.assertEqual(expected, sorted(hit['_id'] for hit in dataset))
+        self.assertEqual(4, len([r for r in self.es.requests if r[0] == 'scroll' and r[1] is not None]))
+
+        dataset = ElasticsearchDataset('source', 'doc', es=self.es, n_slices=5, n_workers=2, source_fields=['text'])
+        hits = list(dataset)
+        self.assertEqual(expected, sorted(hit['_id'] for hit in hits))
+        self.assertEqual(set([('text',)]), set(tuple(hit['_source'].keys()) for hit in hits))
+
+        # stopping early stops the readers
+        hits = iter(ElasticsearchDataset('source', 'doc', es=self.es, n_slices=4, scroll_size=10, queue_size=1))
+        next(hits)
+        hits.close()
+        self.assertEqual({}, self.es.scrolls)
+
+        dataset = ElasticsearchDataset('source', 'doc', es_factory=mock_es_factory, n_slices=3, processes=True)
+        self.assertEqual(expected, sorted(hit['_id'] for hit in dataset))
+
+    def test_sliced_scan_errors(self):
+        dataset = ElasticsearchDataset('source', 'doc', es=object(), n_slices=2)
+        self.assertRaises(RuntimeError, list, dataset)
+
+        # a reader process dying without putting a message on the queue
+        dataset = ElasticsearchDataset('source', 'doc', es_factory=dying_es_factory, n_slices=2, processes=True)
+        self.assertRaises(RuntimeError, list, dataset)
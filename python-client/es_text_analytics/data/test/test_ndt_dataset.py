@@ -1,7 +1,33 @@
 # coding=utf-8
+import os
+import shutil
+import tarfile
+import tempfile
+from StringIO import StringIO
 from unittest import TestCase
 
-from es_text_analytics.data.ndt_dataset import filelist, normalize
+from es_text_analytics.data.ndt_dataset import filelist, normalize, iterator, build_cache, cached_iterator, \
+    cache_is_current, NDTDataset
+
+NDT_CONLL_SAMPLE = u"""1	Nokre	nokon	det	det	kvant|fl	2	DET	_	_
+2	refleksjonar	refleksjon	subst	subst	appell|mask|ub|fl	0	FRAG	_	_
+3	|	$|	clb	clb	<strek>	2	IP	_	_
+
+1	Eg	eg	pron	pron	eint|hum|nom|pers|1	2	SUBJ	_	_
+2	var	vere	verb	verb	pret	0	FINV	_	_
+3	på	på	prep	prep	_	2	ADV	_	_
+4	bibeltime	bibeltime	subst	subst	appell|mask|ub|eint	3	PUTFYLL	_	_
+5	.	$.	clb	clb	<punkt>	2	IP	_	_
+
+""".encode('utf-8')
+
+
+def write_ndt_archive(fn, files):
+    with tarfile.open(fn, 'w:gz') as tf:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, StringIO(data))
 
 
 class TestNDTDatasetHelpers(TestCase):
@@ -28,3 +54,66 @@ class TestNDTDatasetHelpers(TestCase):
         self.assertEqual(1, len(result))
         self.assertTrue('content' in result)
         self.assertTrue(u'Eg var på bibeltime .' in result.values())
+
+
+class TestNDTCache(TestCase):
+    def setUp(self):
+        super(TestNDTCache, self).setUp()
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp_dir, 'ndt.tar.gz')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        nob = NDT_CONLL_SAMPLE * 1500
+        write_ndt_archive(self.fn, [('NDT/README', 'foo'), ('NDT/ndt_1-0_nob.conll', nob),
+                                    ('NDT/blog_ndt_1-0_nob.conll', ''),
+                                    ('NDT/ndt_1-0_nno.conll', NDT_CONLL_SAMPLE.replace('Eg', 'Ho'))])
+
+    def tearDown(self):
+        super(TestNDTCache, self).tearDown()
+
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cached_iterator(self):
+        build_cache(self.fn, self.cache_dir)
+        self.assertTrue(cache_is_current(self.cache_dir, self.fn))
+
+        expected = list(iterator(self.fn))
+        self.assertEqual(3002, len(expected))
+        self.assertEqual(expected, list(cached_iterator(self.cache_dir)))
+        self.assertEqual([3, u'på', u'på', 'prep', 'prep', '_', '2', 'ADV', '_', '_'], expected[1][2])
+
+        for kwargs in ({'lang': 'nno'}, {'sections': ['blog']}, {'field_indices': [1, 4, 5]},
+                       {'field_indices': [0, 6, 0], 'lang': 'nob'}):
+            self.assertEqual(list(iterator(self.fn, **kwargs)), list(cached_iterator(self.cache_dir, **kwargs)))
+
+        self.assertRaises(ValueError, list, cached_iterator(os.path.join(self.tmp_dir, 'notfound')))
+
+    def test_dataset_cache(self):
+        dataset = NDTDataset(dataset_fn=self.fn, fields=['form', 'postag', 'feats'], lang='nno', normalize_func=None,
+                             cache_dir=self.cache_dir)
+        expected = list(NDTDataset(dataset_fn=self.fn, fields=['form', 'postag', 'feats'], lang='nno',
+                                   normalize_func=None))
+
+        self.assertFalse(cache_is_current(self.cache_dir, self.fn))
+        self.assertEqual(expected, list(dataset))
+        self.assertTrue(cache_is_current(self.cache_dir, self.fn))
+        self.assertEqual(expected, list(dataset))
+
+        # the cache is rebuilt when the archive changes
+        write_ndt_archive(self.fn, [('NDT/ndt_1-0_nno.conll', NDT_CONLL_SAMPLE)])
+        self.assertFalse(cache_is_current(self.cache_dir, self.fn))
+        self.assertEqual([[u'Eg', u'pron', u'eint|hum|nom|pers|1'], [u'var', u'verb', u'pret']],
+                         list(dataset)[1][:2])
+
+    def test_foreign_cache_dir(self):
+        # the dataset directory itself must never be replaced
+        self.assertRaises(ValueError, build_cache, self.fn, self.tmp_dir)
+        self.assertTrue(os.path.exists(self.fn))
+        self.assertEqual(['ndt.tar.gz'], os.listdir(self.tmp_dir))
+
+        # empty directories and existing caches are replaced
+        os.mkdir(self.cache_dir)
+        build_cache(self.fn, self.cache_dir)
+        build_cache(self.fn, self.cache_dir)
+        self.assertTrue(cache_is_current(self.cache_dir, self.fn))
+        self.assertEqual(['cache', 'ndt.tar.gz'], sorted(os.listdir(self.tmp_dir)))
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+from itertools import izip
+from unittest import TestCase
+
+import numpy
+
+from es_text_analytics.data import newsgroups
+from es_text_analytics.data.newsgroups import iterator, archive_path, NewsgroupsDataset
+
+ARTICLES = [u'From: a@b.c\nSubject: foo\n\nThe message.\n\n-- \nSig\n',
+            u'From: d@e.f\nSubject: Re: foo\n\n> The message.\nAn answer.\n']
+
+
+class FakeDatasets(object):
+    """
+    Stands in for sklearn.datasets, counting the fetches and writing the archive on the first fetch.
+    """
+
+    def __init__(self):
+        self.fetches = 0
+
+    def get_data_home(self, data_home=None):
+        return data_home
+
+    def fetch_20newsgroups(self, data_home=None):
+        self.fetches += 1
+
+        if not os.path.exists(archive_path(data_home)):
+            with open(archive_path(data_home), 'wb') as f:
+                f.write('archive')
+
+        return {'data': ARTICLES, 'target': [1, 0], 'target_names': ['alt.atheism', 'comp.graphics'],
+                'filenames': ['/tmp/20news/comp.graphics/1', '/tmp/20news/alt.atheism/2']}
+
+
+class TestNewsgroupsCache(TestCase):
+    def setUp(self):
+        super(TestNewsgroupsCache, self).setUp()
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_fn = os.path.join(self.tmp_dir, 'cache.jsonl.gz')
+        self.datasets = newsgroups.datasets
+        newsgroups.datasets = self.fake = FakeDatasets()
+
+    def tearDown(self):
+        super(TestNewsgroupsCache, self).tearDown()
+
+        newsgroups.datasets = self.datasets
+        shutil.rmtree(self.tmp_dir)
+
+    def test_iterator_cache(self):
+        expected = list(iterator(None, data_home=self.tmp_dir))
+        self.assertEqual(2, len(expected))
+        self.assertEqual({'doc_id': '1', 'article': u'The message.\n', 'group': 'comp.graphics', 'target': 1,
+                          'filename': '/tmp/20news/comp.graphics/1'}, expected[0])
+        self.assertEqual(u'An answer.\n', expected[1]['article'])
+
+        # abandoned iterations don't leave a partial cache
+        docs = iterator(None, cache_fn=self.cache_fn, data_home=self.tmp_dir)
+        next(docs)
+        docs.close()
+        self.assertFalse(os.path.exists(self.cache_fn))
+
+        self.assertEqual(expected, list(iterator(None, cache_fn=self.cache_fn, data_home=self.tmp_dir)))
+        self.assertTrue(os.path.exists(self.cache_fn))
+        fetches = self.fake.fetches
+
+        self.assertEqual(expected, list(iterator(None, cache_fn=self.cache_fn, data_home=self.tmp_dir)))
+        self.assertEqual(fetches, self.fake.fetches)
+
+        # a changed archive invalidates the cache
+        with open(archive_path(self.tmp_dir), 'wb') as f:
+            f.write('changed archive')
+
+        self.assertEqual(expected, list(iterator(None, cache_fn=self.cache_fn, data_home=self.tmp_dir)))
+        self.assertEqual(fetches + 1, self.fake.fetches)
+
+    def test_concurrent_iterations(self):
+        expected = list(iterator(None, data_home=self.tmp_dir))
+        docs = izip(iterator(None, cache_fn=self.cache_fn, data_home=self.tmp_dir),
+                    iterator(None, cache_fn=self.cache_fn, data_home=self.tmp_dir))
+
+        self.assertEqual(zip(expected, expected), list(docs))
+        self.assertEqual(expected, list(iterator(None, cache_fn=self.cache_fn, data_home=self.tmp_dir)))
+        self.assertEqual(['cache.jsonl.gz'], [fn for fn in os.listdir(self.tmp_dir) if 'cache' in fn])
+
+    def test_cache_types(self):
+        fresh = list(iterator(None, cache_fn=self.cache_fn, data_home=self.tmp_dir))
+        cached = list(iterator(None, cache_fn=self.cache_fn, data_home=self.tmp_dir))
+
+        self.assertEqual(1, self.fake.fetches)
+        self.assertEqual(fresh, cached)
+
+        for fresh_doc, cached_doc in zip(fresh, cached):
+            self.assertEqual(dict((k, type(v)) for k, v in fresh_doc.items()),
+                             dict((k, type(v)) for k, v in cached_doc.items()))
+
+        self.assertIsInstance(cached[0]['target'], numpy.int64)
+
+    def test_dataset_cache(self):
+        dataset = NewsgroupsDataset(dataset_path=os.path.join(self.tmp_dir, 'data'), data_home=self.tmp_dir)
+
+        self.assertEqual(list(NewsgroupsDataset(cache=False, data_home=self.tmp_dir)), list(dataset))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'data', newsgroups.NEWSGROUPS_CACHE_FN)))
+        self.assertEqual(list(NewsgroupsDataset(cache=False, data_home=self.tmp_dir)), list(dataset))
+        # only the first cached iteration fetches the dataset
+        self.assertEqual(3, self.fake.fetches)
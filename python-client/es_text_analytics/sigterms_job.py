@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import time
+from multiprocessing import Pool
+
+from elasticsearch.client import Elasticsearch
+from elasticsearch.helpers import scan
+
+from es_text_analytics.bulk_indexer import BulkIndexer
+from es_text_analytics.single_doc_sigterms import SingleDocSigTerms, TermStatisticsCache, MTERMVECTORS_CHUNK_SIZE
+
+"""
+Batch job adding the significant terms of each document in an index as a document field.
+
+The index is read with a (sliced) scroll, each slice is processed by a worker process with its own Elasticsearch
+client and the top terms are written back with partial update bulk requests. Completed slices are recorded in a
+checkpoint file so an interrupted job can be resumed. Slices with failed updates are recorded separately and rerun.
+"""
+
+
+class SigTermsJob(object):
+    """
+    Annotates all the documents in an index with their top significant terms.
+
+    The top terms are stored in target_field as a list of {"term": ..., "score": ...} objects. Use by_doc_id_idf
+    weighting (idf=True) or pass a provider_factory returning a term weight provider. Each worker process calls the
+    factory once, so it must be picklable, ie. a module level function. WeightStoreProvider is a good fit as the
+    memory mapped store is shared between the workers.
+
+    Elasticsearch versions: the index is split in slices with sliced scroll, which needs Elasticsearch 5.0+, so
+    with the default single slice the job runs on 2.x and the workers are idle. idf weighting with the term
+    statistics from Elasticsearch requests term vectors with distributed frequencies (dfs), which was removed in
+    Elasticsearch 5.0, and can't be combined with several slices. Use a provider_factory or ttf_provider_factory to
+    process several slices in parallel on 5.0+.
+
+    Usage::
+
+        job = SigTermsJob(['localhost:9200'], 'wiki', 'doc', 'article', provider_factory=provider_factory,
+                          n_workers=8, n_slices=32, checkpoint_fn='wiki.ckpt')
+        stats = job.run()
+    """
+
+    def __init__(self, hosts, index, doc_type, field, target_field='sig_terms', n=10, idf=True,
+                 provider_factory=None, n_workers=4, n_slices=None, scroll_size=1000,
+                 chunk_size=MTERMVECTORS_CHUNK_SIZE, bulk_size=500, checkpoint_fn=None, skip_annotated=False,
+                 es_factory=None, max_retries=1, ttf_provider_factory=None, stats_cache_size=None):
+        """
+        :param hosts: Elasticsearch hosts.
+        :type hosts: list
+        :param field: Field the significant terms are computed for.
+        :type field: str|unicode
+        :param target_field: Field the top terms are written to.
+        :type target_field: str|unicode
+        :param n: Number of top terms for each document.
+        :type n: int|long
+        :param idf: Use the term statistics from the term vectors (SingleDocSigTerms.by_doc_id_idf). Ignored when
+            a provider_factory is passed.
+        :type idf: bool
+        :param provider_factory: Function returning the term weight provider used with SingleDocSigTerms.by_doc_id.
+        :type provider_factory: function|None
+        :param n_workers: Number of worker processes. With 1 worker the slices are processed in this process.
+        :type n_workers: int|long
+        :param n_slices: Number of scroll slices, each slice is a unit of work and checkpointing. Defaults to a
+            single slice. More than one slice needs Elasticsearch 5.0+ and can't be used with the term statistics
+            from Elasticsearch (idf without ttf_provider_factory), see the class docs.
+        :type n_slices: int|long|None
+        :param scroll_size: Number of document ids retrieved with each scroll request.
+        :type scroll_size: int|long
+        :param chunk_size: Number of documents in each mtermvectors request.
+        :type chunk_size: int|long
+        :param bulk_size: Number of partial updates in each bulk request.
+        :type bulk_size: int|long
+        :param checkpoint_fn: File recording the completed and failed slices. Completed slices are skipped when the
+            job is run again with the same number of slices, failed slices are rerun.
+        :type checkpoint_fn: str|unicode|None
+        :param skip_annotated: Only process documents without the target field.
+        :type skip_annotated: bool
+        :param es_factory: Function returning the Elasticsearch client for a worker. Defaults to a client for hosts.
+            Must be picklable like provider_factory when n_workers > 1.
+        :type es_factory: function|None
+        :param max_retries: Number of times a slice with failed updates is rerun before the job gives up on it.
+        :type max_retries: int|long
+        :param ttf_provider_factory: Function returning the field frequency ratio provider used with idf weighting
+            instead of the term statistics from Elasticsearch, see SingleDocSigTerms. Must be picklable like
+            provider_factory.
+        :type ttf_provider_factory: function|None
+        :param stats_cache_size: Cache the term statistics used with idf weighting for up to this many terms in each
+            slice, see TermStatisticsCache.
+        :type stats_cache_size: int|long|None
+        :raise ValueError: If several slices are combined with the term statistics from Elasticsearch.
+        """
+        self.hosts = hosts
+        self.index = index
+        self.doc_type = doc_type
+        self.field = field
+        self.target_field = target_field
+        self.n = n
+        self.idf = idf and not provider_factory
+        self.provider_factory = provider_factory
+        self.n_workers = n_workers
+        self.n_slices = n_slices or 1
+        self.scroll_size = scroll_size
+        self.chunk_size = chunk_size
+        self.bulk_size = bulk_size
+        self.checkpoint_fn = checkpoint_fn
+        self.skip_annotated = skip_annotated
+        self.es_factory = es_factory
+        self.max_retries = max_retries
+        self.ttf_provider_factory = ttf_provider_factory
+        self.stats_cache_size = stats_cache_size
+
+        # sliced scroll needs Elasticsearch 5.0+ while dfs term vectors are only supported before 5.0
+        if self.n_slices > 1 and self.idf and not ttf_provider_factory:
+            raise ValueError('Several slices need Elasticsearch 5.0+ which has no dfs term vectors for idf '
+                             'weighting, pass a provider_factory or ttf_provider_factory ...')
+
+    def _es(self):
+        if self.es_factory:
+            return self.es_factory()
+
+        return Elasticsearch(hosts=self.hosts, timeout=120)
+
+    def _query(self, slice_id):
+        query = {'_source': False, 'slice': {'id': slice_id, 'max': self.n_slices}}
+
+        if self.n_slices == 1:
+            del query['slice']
+
+        if self.skip_annotated:
+            query['query'] = {'bool': {'must_not': {'exists': {'field': self.target_field}}}}
+
+        return query
+
+    def _update_actions(self, sigterms, doc_ids, stats):
+        for doc_id, top_terms in sigterms.iter_by_doc_ids(doc_ids, n=self.n, chunk_size=self.chunk_size,
+                                                          idf=self.idf):
+            if top_terms is None:
+                stats['not_found'] += 1
+                continue
+
+            yield ({'update': {'_index': self.index, '_type': self.doc_type, '_id': doc_id}},
+                   {'doc': {self.target_field: [{'term': term, 'score': score} for term, score in top_terms]}})
+
+    def run_slice(self, slice_id):
+        """
+        Annotates the documents in a slice.
+
+        :type slice_id: int|long
+        :rtype : dict
+        :return: dict with the slice id and the number of updated, failed and not found documents.
+        """
+        es = self._es()
+        provider = self.provider_factory() if self.provider_factory else None
+        ttf_provider = self.ttf_provider_factory() if self.ttf_provider_factory else None
+        # the cache has a lock and can't be passed to the workers
+        stats_cache = TermStatisticsCache(max_terms=self.stats_cache_size) if self.stats_cache_size else None
+        sigterms = SingleDocSigTerms(es, self.index, self.doc_type, self.field, provider, ttf_provider=ttf_provider,
+                                     stats_cache=stats_cache)
+        stats = {'slice': slice_id, 'not_found': 0}
+
+        doc_ids = (hit['_id'] for hit in scan(es, query=self._query(slice_id), index=self.index,
+                                              doc_type=self.doc_type, size=self.scroll_size))
+        # the index is being read, so refresh and replica settings are left alone
+        indexer = BulkIndexer(es, self.index, chunk_size=self.bulk_size, n_threads=1, optimize_settings=False)
+        bulk_stats = indexer.index(self._update_actions(sigterms, doc_ids, stats))
+
+        stats['docs'] = bulk_stats['docs']
+        stats['failed'] = bulk_stats['failed']
+
+        logging.info('Slice %d: annotated %d documents (%.0f docs/s) ...' %
+                     (slice_id, stats['docs'], bulk_stats['docs_per_sec']))
+
+        return stats
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_fn or not os.path.exists(self.checkpoint_fn):
+            return {'index': self.index, 'n_slices': self.n_slices, 'completed': {}, 'failed': {}}
+
+        with open(self.checkpoint_fn) as f:
+            checkpoint = json.load(f)
+
+        if checkpoint['n_slices'] != self.n_slices or checkpoint['index'] != self.index:
+            raise ValueError('Checkpoint %s is for %s with %d slices ...' %
+                             (self.checkpoint_fn, checkpoint['index'], checkpoint['n_slices']))
+
+        checkpoint.setdefault('failed', {})
+
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint):
+        if not self.checkpoint_fn:
+            return
+
+        tmp_fn = self.checkpoint_fn + '.tmp'
+
+        with open(tmp_fn, 'w') as f:
+            json.dump(checkpoint, f)
+
+        os.rename(tmp_fn, self.checkpoint_fn)
+
+    def _iter_results(self, slices):
+        if self.n_workers > 1:
+            pool = Pool(self.n_workers)
+
+            try:
+                for result in pool.imap_unordered(_run_slice, [(self, i) for i in slices]):
+                    yield result
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for i in slices:
+                yield self.run_slice(i)
+
+    def run(self):
+        """
+        Runs the job, skipping the slices completed according to the checkpoint.
+
+        A slice is only completed when all its updates succeed. Slices with failed updates are rerun up to
+        max_retries times, and are recorded as failed in the checkpoint and rerun with the next run if they still fail.
+
+        :rtype : dict
+        :return: dict with the number of updated, failed and not found documents, processed slices, slices given up
+            on (failed_slices), elapsed seconds and docs_per_sec.
+        :raise ValueError: If the checkpoint was made with a different index or number of slices.
+        """
+        checkpoint = self._load_checkpoint()
+        slices = [i for i in xrange(self.n_slices) if str(i) not in checkpoint['completed']]
+
+        if len(slices) < self.n_slices:
+            logging.info('Resuming, %d of %d slices remaining ...' % (len(slices), self.n_slices))
+
+        stats = {'docs': 0, 'failed': 0, 'not_found': 0, 'slices': 0, 'failed_slices': 0}
+        start = time.time()
+        n_slices = len(slices)
+        attempt = 0
+
+        while slices:
+            retry = []
+
+            for result in self._iter_results(slices):
+                slice_key = str(result['slice'])
+
+                if result['failed'] == 0:
+                    checkpoint['completed'][slice_key] = result['docs']
+                    checkpoint['failed'].pop(slice_key, None)
+                else:
+                    checkpoint['failed'][slice_key] = result['failed']
+
+                self._save_checkpoint(checkpoint)
+
+                if result['failed'] and attempt < self.max_retries:
+                    logging.warning('Slice %d: %d failed updates, retrying ...' % (result['slice'], result['failed']))
+                    retry.append(result['slice'])
+                    continue
+
+                # documents are only counted for the last attempt at a slice
+                for key in ('docs', 'failed', 'not_found'):
+                    stats[key] += result[key]
+
+                if result['failed']:
+                    logging.error('Slice %d: giving up on %d failed updates ...' % (result['slice'], result['failed']))
+                    stats['failed_slices'] += 1
+
+                stats['slices'] += 1
+                elapsed = time.time() - start
+                logging.info('Completed %d of %d slices, %d documents (%.0f docs/s) ...' %
+                             (stats['slices'], n_slices, stats['docs'], stats['docs'] / elapsed if elapsed else .0))
+
+            slices = retry
+            attempt += 1
+
+        stats['seconds'] = time.time() - start
+        stats['docs_per_sec'] = stats['docs'] / stats['seconds'] if stats['seconds'] else .0
+
+        return stats
+
+
+def _run_slice(args):
+    """
+    Pool entry point, bound methods can't be pickled.
+    """
+    job, slice_id = args
+
+    return job.run_slice(slice_id)
@@ -1,41 +1,565 @@
+from collections import OrderedDict
+from heapq import nlargest
+from itertools import islice
 from operator import itemgetter
+import threading
+import time
+
+import numpy
+from scipy.sparse import csr_matrix
+
+# number of documents in each mtermvectors request
+MTERMVECTORS_CHUNK_SIZE = 100
+
+
+def inverse_collection_frequency_ratios(X):
+    """
+    Computes the inverse ratio of each term's total frequency to the total number of term occurrences in a document
+    term matrix, the term weighting used by SingleDocSigTerms.by_doc_id_idf.
+
+    :param X: Document term count matrix.
+    :type X: scipy.sparse.spmatrix|numpy.ndarray
+    :rtype : numpy.ndarray
+    :return: Weight vector with NaN for terms that don't occur.
+    """
+    ttf = numpy.asarray(X.sum(axis=0), dtype=numpy.float64).ravel()
+    weights = numpy.empty(len(ttf), dtype=numpy.float64)
+    weights.fill(numpy.nan)
+    found = ttf > 0
+    weights[found] = ttf.sum() / ttf[found]
+
+    return weights
+
+
+def top_terms_by_row(X, weights=None, n=5, chunk_size=10000):
+    """
+    Computes the top weighted terms of every document in a document term count matrix in one vectorized pass.
+
+    Each term is scored by its frequency ratio in the document times the term weight. The default weights are the
+    inverse collection frequency ratios of the matrix, which gives the same scores as
+    SingleDocSigTerms.by_doc_id_idf over the same corpus. Weights can also come from any TermWeightingProvider,
+    f.ex. provider.weight_array(vocabulary) with the terms of each column, terms with NaN weights are skipped.
+
+    Rows are processed in chunks, the non-zero entries of each chunk are sorted by row and score so memory use
+    follows the number of non-zero entries and not the longest row.
+
+    :param X: Document term count matrix with a row for each document, f.ex. from a CountVectorizer or
+        gensim.matutils.corpus2csc(corpus).T.
+    :type X: scipy.sparse.spmatrix|numpy.ndarray
+    :param weights: Term weight vector with one value for each column in X.
+    :type weights: numpy.ndarray|None
+    :param n: Number of top terms for each document.
+    :type n: int|long
+    :param chunk_size: Number of rows processed at a time.
+    :type chunk_size: int|long
+    :rtype : (numpy.ndarray, numpy.ndarray)
+    :return: n_rows x n arrays with the term ids (column indices) and scores of the top terms of each row in
+        descending score order. Rows with less than n scored terms are padded with -1 ids and NaN scores.
+    """
+    X = csr_matrix(X)
+
+    if weights is None:
+        weights = inverse_collection_frequency_ratios(X)
+
+    weights = numpy.asarray(weights, dtype=numpy.float64).ravel()
+    n_rows = X.shape[0]
+
+    top_ids = numpy.empty((n_rows, n), dtype=numpy.int64)
+    top_ids.fill(-1)
+    top_scores = numpy.empty((n_rows, n), dtype=numpy.float64)
+    top_scores.fill(numpy.nan)
+
+    for start in xrange(0, n_rows, chunk_size):
+        chunk = X[start:start + chunk_size]
+        nnz = numpy.diff(chunk.indptr)
+
+        if n == 0 or chunk.nnz == 0:
+            continue
+
+        rows = numpy.repeat(numpy.arange(chunk.shape[0]), nnz)
+        lengths = numpy.asarray(chunk.sum(axis=1), dtype=numpy.float64).ravel()
+
+        scores = chunk.data / lengths[rows] * weights[chunk.indices]
+        scores[numpy.isnan(scores)] = -numpy.inf
+
+        # sort the entries by row and descending score, the rows keep their place and length in the sorted order
+        order = numpy.lexsort((-scores, rows))
+        ranks = numpy.arange(chunk.nnz) - chunk.indptr[rows]
+        scores = scores[order]
+        top = (ranks < n) & (scores > -numpy.inf)
+
+        top_ids[start + rows[top], ranks[top]] = chunk.indices[order][top]
+        top_scores[start + rows[top], ranks[top]] = scores[top]
+
+    return top_ids, top_scores
+
+
+class TermStatisticsCache(object):
+    """
+    Caches the field statistics and term total frequencies (ttf) from term vector responses by index and field.
+
+    Entries expire after ttl seconds so the statistics follow changes to the index, and the number of cached terms
+    is bounded with least recently used eviction. Can be shared by several SingleDocSigTerms instances.
+    """
+
+    def __init__(self, max_terms=1000000, ttl=600., clock=time.time):
+        """
+        :param max_terms: Maximum number of cached term ttf values.
+        :type max_terms: int|long
+        :param ttl: Seconds before cached statistics are refreshed.
+        :type ttl: int|long|float
+        :param clock: Function returning the current time in seconds.
+        :type clock: function
+        """
+        self.max_terms = max_terms
+        self.ttl = ttl
+        self.clock = clock
+
+        self._field_stats = {}
+        self._ttfs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def field_statistics(self, index, field):
+        """
+        :rtype : dict|None
+        :return: The cached field statistics or None if not cached or expired.
+        """
+        with self._lock:
+            entry = self._field_stats.get((index, field))
+
+            if entry is None or entry[1] <= self.clock():
+                return None
+
+            return entry[0]
+
+    def ttfs(self, index, field, terms):
+        """
+        :rtype : dict
+        :return: Map of the cached terms to ttf values, expired or uncached terms are not included.
+        """
+        found = {}
+
+        with self._lock:
+            now = self.clock()
+
+            for term in terms:
+                key = (index, field, term)
+                entry = self._ttfs.pop(key, None)
+
+                if entry is not None and entry[1] > now:
+                    self._ttfs[key] = entry
+                    found[term] = entry[0]
+
+        return found
+
+    def update(self, index, field, field_stats, ttfs):
+        """
+        Caches the statistics from a term vector response.
+
+        :param field_stats: Term vector field statistics.
+        :type field_stats: dict
+        :param ttfs: Map of terms to ttf values.
+        :type ttfs: dict
+        """
+        with self._lock:
+            expires = self.clock() + self.ttl
+            self._field_stats[(index, field)] = (field_stats, expires)
+
+            for term, ttf in ttfs.iteritems():
+                key = (index, field, term)
+                self._ttfs.pop(key, None)
+                self._ttfs[key] = (ttf, expires)
+
+            while len(self._ttfs) > self.max_terms:
+                self._ttfs.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._field_stats.clear()
+            self._ttfs.clear()
 
 
 class SingleDocSigTerms:
-    def __init__(self, es, index,  doc_type, field, term_weight_provider):
+    def __init__(self, es, index,  doc_type, field, term_weight_provider, ttf_provider=None, stats_cache=None):
+        """
+        :param term_weight_provider: Provider for the term weights used with by_doc_id.
+        :type term_weight_provider: es_text_analytics.term_weight_provider.TermWeightingProvider|None
+        :param ttf_provider: Provider with field frequency ratios (term ttf / field sum_ttf) used with
+            by_doc_id_idf instead of retrieving the term statistics from Elasticsearch, f.ex. a WeightStoreProvider
+            with the corpus term counts.
+        :type ttf_provider: es_text_analytics.term_weight_provider.TermWeightingProvider|None
+        :param stats_cache: Cache for the term statistics used with by_doc_id_idf.
+        :type stats_cache: TermStatisticsCache|None
+        """
         self.es = es
         self.index = index
         self.doc_type = doc_type
         self.field = field
         self.term_weight_provider = term_weight_provider
+        self.ttf_provider = ttf_provider
+        self.stats_cache = stats_cache
 
     def tf_for_doc_id(self, doc_id):
         resp = self.es.termvectors(index=self.index, doc_type=self.doc_type, id=doc_id, fields=[self.field])
 
         if resp['found']:
-            return [(term, val['term_freq']) for term, val in resp['term_vectors'][self.field]['terms'].items()]
+            # documents without the field have no term vector for it
+            tv = resp.get('term_vectors', {}).get(self.field, {'terms': {}})
+
+            return [(term, val['term_freq']) for term, val in tv['terms'].items()]
+
+    def _term_vectors(self, doc_id, term_statistics=False):
+        """
+        Retrieves the term vector of the field, with global term and field statistics if term_statistics is True.
+
+        :rtype : dict|None
+        """
+        if term_statistics:
+            resp = self.es.termvectors(index=self.index, doc_type=self.doc_type, id=doc_id, fields=[self.field],
+                                       dfs=True, term_statistics=True, positions=False, offsets=False)
+        else:
+            resp = self.es.termvectors(index=self.index, doc_type=self.doc_type, id=doc_id, fields=[self.field],
+                                       field_statistics=False, positions=False, offsets=False)
 
-    def by_doc_id_idf(self, doc_id, n=5):
-        resp = self.es.termvectors(index=self.index, doc_type=self.doc_type, id=doc_id, fields=[self.field], dfs=True,
-                                   term_statistics=True, positions=False, offsets=False)
         if resp['found']:
-            termstats=[]
-            total_doc_term_frequency = sum([val['term_freq'] for term, val in resp['term_vectors'][self.field]['terms'].items()])
-            doc_count = resp['term_vectors'][self.field]['field_statistics']['sum_ttf']
-            for term, val in resp['term_vectors'][self.field]['terms'].items():
-                doc_freq= val['ttf']
-                term_doc_freq= val['term_freq']
-                term_total_ratio = doc_freq / float(doc_count)
-                doc_ration = term_doc_freq / float(total_doc_term_frequency)
-                termstats.append((term,  doc_ration/float(term_total_ratio)))
-            return sorted(termstats, key=itemgetter(1), reverse=True)[0:n]
+            return resp['term_vectors'].get(self.field, {'terms': {}})
+
+    @staticmethod
+    def _idf_top_terms(term_freqs, ttfs, sum_ttf, n):
+        termstats = []
+        total_doc_term_frequency = sum(term_doc_freq for _, term_doc_freq in term_freqs)
+
+        for term, term_doc_freq in term_freqs:
+            term_total_ratio = ttfs[term] / float(sum_ttf)
+            doc_ration = term_doc_freq / float(total_doc_term_frequency)
+            termstats.append((term, doc_ration / float(term_total_ratio)))
+
+        return sorted(termstats, key=itemgetter(1), reverse=True)[0:n]
+
+    def by_doc_id_idf(self, doc_id, n=5):
+        """
+        Top terms by the ratio of the term frequency in the document to the term frequency in the whole field.
+
+        With a ttf_provider the field frequency ratios are looked up in the provider and with a stats_cache they are
+        taken from the cache when available, otherwise each call retrieves the global term statistics with the term
+        vector (dfs=True), which requires an extra distributed request phase. With a stats_cache the statistics are
+        requested with the term vector until the field statistics are cached, after that the term vector is
+        retrieved without statistics and only documents with uncached terms need a second request.
+
+        :type n: int|long
+        :rtype : list|None
+        :return: The top terms or None if the document isn't found.
+        """
+        if self.ttf_provider:
+            return self._by_doc_id_idf_provider(doc_id, n)
+
+        if self.stats_cache:
+            return self._by_doc_id_idf_cached(doc_id, n)
+
+        tv = self._term_vectors(doc_id, term_statistics=True)
+
+        if tv is not None:
+            if not tv['terms']:
+                return []
+
+            term_freqs = [(term, val['term_freq']) for term, val in tv['terms'].items()]
+            ttfs = dict((term, val['ttf']) for term, val in tv['terms'].items())
+
+            return self._idf_top_terms(term_freqs, ttfs, tv['field_statistics']['sum_ttf'], n)
+
+    def _by_doc_id_idf_provider(self, doc_id, n):
+        tv = self._term_vectors(doc_id)
+
+        if tv is None:
+            return None
+
+        term_freqs = [(term, val['term_freq']) for term, val in tv['terms'].items()]
+
+        if not term_freqs:
+            return []
+
+        terms = [term for term, _ in term_freqs]
+        tf = numpy.array([freq for _, freq in term_freqs], dtype=numpy.float64)
+        scores = (tf / tf.sum()) / self.ttf_provider.weight_array(terms)
+
+        # missing terms are NaN with the 'ignore' policy
+        return sorted([(term, score) for term, score in zip(terms, scores.tolist()) if score == score],
+                      key=itemgetter(1), reverse=True)[0:n]
+
+    def _cache_statistics(self, tv):
+        ttfs = dict((term, val['ttf']) for term, val in tv['terms'].items())
+        self.stats_cache.update(self.index, self.field, tv['field_statistics'], ttfs)
+
+        return ttfs
+
+    def _cached_top_terms(self, tv, field_stats, n):
+        """
+        Computes the top terms from a term vector without statistics and the cached statistics.
+
+        :rtype : list|None
+        :return: The top terms or None if some of the terms aren't cached.
+        """
+        term_freqs = [(term, val['term_freq']) for term, val in tv['terms'].items()]
+        ttfs = self.stats_cache.ttfs(self.index, self.field, [term for term, _ in term_freqs])
+
+        if len(ttfs) < len(term_freqs):
+            return None
+
+        return self._idf_top_terms(term_freqs, ttfs, field_stats['sum_ttf'], n)
+
+    def _by_doc_id_idf_cached(self, doc_id, n):
+        field_stats = self.stats_cache.field_statistics(self.index, self.field)
+
+        # the term statistics can't be cached without the field statistics, so request them right away
+        if field_stats is not None:
+            tv = self._term_vectors(doc_id)
+
+            if tv is None:
+                return None
+
+            top_terms = self._cached_top_terms(tv, field_stats, n)
+
+            if top_terms is not None:
+                return top_terms
+
+        tv = self._term_vectors(doc_id, term_statistics=True)
+
+        if tv is None:
+            return None
+
+        if not tv['terms']:
+            return []
+
+        term_freqs = [(term, val['term_freq']) for term, val in tv['terms'].items()]
+        ttfs = self._cache_statistics(tv)
+
+        return self._idf_top_terms(term_freqs, ttfs, tv['field_statistics']['sum_ttf'], n)
 
     def by_doc_id(self, doc_id, n=5):
-        term_freqs = self.tf_for_doc_id(doc_id)
+        return self.top_terms(self.tf_for_doc_id(doc_id), n=n)
 
-        if self.term_weight_provider:
-            weights = self.term_weight_provider[(term for term, _ in term_freqs)]
+    def top_terms(self, term_freqs, n=5):
+        """
+        Weights the term frequencies of a document with the term weight provider and returns the n top terms.
 
-            term_freqs = [(term, freq*weights[term]) for term, freq in term_freqs]
+        :param term_freqs: List of term and frequency pairs as returned by tf_for_doc_id.
+        :type term_freqs: list
+        :type n: int|long
+        :rtype : list
+        """
+        if self.term_weight_provider and term_freqs:
+            terms = [term for term, _ in term_freqs]
+            scores = numpy.array([freq for _, freq in term_freqs], dtype=numpy.float64)
+            scores *= self.term_weight_provider.weight_array(terms)
+
+            # missing terms are NaN with the 'ignore' policy
+            term_freqs = [(term, score) for term, score in zip(terms, scores.tolist()) if score == score]
 
         return sorted(term_freqs, key=itemgetter(1), reverse=True)[0:n]
+
+    def _mtermvectors(self, doc_ids, term_statistics=False):
+        """
+        Retrieves the term vectors for a list of documents in a single mtermvectors request, with global term and
+        field statistics if term_statistics is True (dfs, as in _term_vectors, otherwise the statistics are shard
+        local).
+
+        :rtype : list
+        :return: The terms dict for each document in doc_ids, or None for documents not found. Documents without the
+            field have empty terms, as in _term_vectors.
+        """
+        params = {'fields': [self.field], 'positions': False, 'offsets': False}
+
+        if term_statistics:
+            params.update(term_statistics=True, field_statistics=True, dfs=True)
+
+        resp = self.es.mtermvectors(index=self.index, doc_type=self.doc_type,
+                                    body={'ids': list(doc_ids), 'parameters': params})
+
+        return [doc.get('term_vectors', {}).get(self.field, {'terms': {}}) if doc.get('found') else None
+                for doc in resp['docs']]
+
+    def _id_chunks(self, doc_ids, chunk_size):
+        it = iter(doc_ids)
+
+        while True:
+            chunk = list(islice(it, chunk_size))
+
+            if not chunk:
+                break
+
+            yield chunk
+
+    def iter_by_doc_ids(self, doc_ids, n=5, chunk_size=MTERMVECTORS_CHUNK_SIZE, idf=False):
+        """
+        Retrieves the top terms for a stream of documents with chunked mtermvectors requests. The terms in each chunk
+        are weighted with a single provider lookup.
+
+        :param doc_ids: Iterable with document ids.
+        :param n: Number of top terms for each document.
+        :type n: int|long
+        :param chunk_size: Number of documents in each mtermvectors request.
+        :type chunk_size: int|long
+        :param idf: Use the by_doc_id_idf weighting, with the ttf_provider or stats_cache if set.
+        :type idf: bool
+        :rtype : generator
+        :return: Generator with doc id and top terms pairs, the top terms are None for documents not found and empty
+            for documents without the field.
+        """
+        for chunk in self._id_chunks(doc_ids, chunk_size):
+            if not idf:
+                top_terms = self._top_terms_chunk(self._mtermvectors(chunk), n)
+            elif self.ttf_provider:
+                top_terms = self._top_terms_idf_provider(self._mtermvectors(chunk), n)
+            elif self.stats_cache:
+                top_terms = self._top_terms_idf_cached(chunk, n)
+            else:
+                top_terms = self._top_terms_idf(self._mtermvectors(chunk, term_statistics=True), n)
+
+            for doc_id, terms in zip(chunk, top_terms):
+                yield doc_id, terms
+
+    def by_doc_ids(self, doc_ids, n=5, chunk_size=MTERMVECTORS_CHUNK_SIZE):
+        """
+        Batch version of by_doc_id.
+
+        :rtype : list
+        :return: The top terms for each document in doc_ids, None for documents not found.
+        """
+        return [terms for _, terms in self.iter_by_doc_ids(doc_ids, n=n, chunk_size=chunk_size)]
+
+    def by_doc_ids_idf(self, doc_ids, n=5, chunk_size=MTERMVECTORS_CHUNK_SIZE):
+        """
+        Batch version of by_doc_id_idf.
+
+        :rtype : list
+        :return: The top terms for each document in doc_ids, None for documents not found.
+        """
+        return [terms for _, terms in self.iter_by_doc_ids(doc_ids, n=n, chunk_size=chunk_size, idf=True)]
+
+    def _top_terms_chunk(self, term_vectors, n):
+        """
+        Weights the term frequencies of a chunk of documents with one provider lookup for the unique terms.
+        """
+        term_freqs = [[(term, val['term_freq']) for term, val in tv['terms'].items()] if tv is not None else None
+                      for tv in term_vectors]
+
+        if not self.term_weight_provider:
+            return [nlargest(n, tf, key=itemgetter(1)) if tf is not None else None for tf in term_freqs]
+
+        term_ids = {}
+
+        for tf in term_freqs:
+            for term, _ in tf or ():
+                if term not in term_ids:
+                    term_ids[term] = len(term_ids)
+
+        weights = numpy.empty(len(term_ids), dtype=numpy.float64)
+
+        if term_ids:
+            terms = sorted(term_ids, key=term_ids.get)
+            weights = self.term_weight_provider.weight_array(terms)
+
+        weights = weights.tolist()
+        result = []
+
+        for tf in term_freqs:
+            if tf is None:
+                result.append(None)
+                continue
+
+            scores = ((term, freq * weights[term_ids[term]]) for term, freq in tf)
+            # missing terms are NaN with the 'ignore' policy
+            result.append(nlargest(n, ((term, score) for term, score in scores if score == score), key=itemgetter(1)))
+
+        return result
+
+    def _top_terms_idf_provider(self, term_vectors, n):
+        """
+        by_doc_id_idf weighting of a chunk of documents with one ttf_provider lookup for the unique terms.
+        """
+        term_ids = {}
+
+        for tv in term_vectors:
+            for term in tv['terms'] if tv is not None else ():
+                if term not in term_ids:
+                    term_ids[term] = len(term_ids)
+
+        ratios = []
+
+        if term_ids:
+            ratios = self.ttf_provider.weight_array(sorted(term_ids, key=term_ids.get)).tolist()
+
+        result = []
+
+        for tv in term_vectors:
+            if tv is None:
+                result.append(None)
+                continue
+
+            total_doc_term_frequency = float(sum(val['term_freq'] for val in tv['terms'].values()))
+            scores = ((term, (val['term_freq'] / total_doc_term_frequency) / ratios[term_ids[term]])
+                      for term, val in tv['terms'].items())
+            # missing terms are NaN with the 'ignore' policy
+            result.append(nlargest(n, ((term, score) for term, score in scores if score == score), key=itemgetter(1)))
+
+        return result
+
+    def _top_terms_idf_cached(self, doc_ids, n):
+        """
+        by_doc_id_idf weighting of a chunk of documents with the stats_cache. Term vectors with uncached terms are
+        requested again with statistics in a single mtermvectors request.
+        """
+        field_stats = self.stats_cache.field_statistics(self.index, self.field)
+
+        if field_stats is None:
+            term_vectors = self._mtermvectors(doc_ids, term_statistics=True)
+
+            for tv in term_vectors:
+                if tv is not None and tv['terms']:
+                    self._cache_statistics(tv)
+
+            return self._top_terms_idf(term_vectors, n)
+
+        result = []
+        uncached = []
+
+        for i, tv in enumerate(self._mtermvectors(doc_ids)):
+            top_terms = self._cached_top_terms(tv, field_stats, n) if tv is not None else None
+
+            if tv is not None and top_terms is None:
+                uncached.append(i)
+
+            result.append(top_terms)
+
+        if uncached:
+            term_vectors = self._mtermvectors([doc_ids[i] for i in uncached], term_statistics=True)
+
+            for i, tv in zip(uncached, term_vectors):
+                if tv is not None and tv['terms']:
+                    self._cache_statistics(tv)
+
+            for i, top_terms in zip(uncached, self._top_terms_idf(term_vectors, n)):
+                result[i] = top_terms
+
+        return result
+
+    def _top_terms_idf(self, term_vectors, n):
+        result = []
+
+        for tv in term_vectors:
+            if tv is None:
+                result.append(None)
+                continue
+
+            if not tv['terms']:
+                result.append([])
+                continue
+
+            total_doc_term_frequency = sum(val['term_freq'] for val in tv['terms'].values())
+            doc_count = tv['field_statistics']['sum_ttf']
+            termstats = ((term, (val['term_freq'] / float(total_doc_term_frequency)) /
+                          float(val['ttf'] / float(doc_count)))
+                         for term, val in tv['terms'].items())
+            result.append(nlargest(n, termstats, key=itemgetter(1)))
+
+        return result
@@ -0,0 +1,150 @@
+from collections import OrderedDict
+import threading
+import time
+
+from es_text_analytics.term_weight_provider import TermWeightingProvider
+
+"""
+Client side caching of term weights for providers backed by remote services such as Elasticsearch.
+"""
+
+
+class CachingTermWeightProvider(TermWeightingProvider):
+    """
+    Wraps a term weight provider with a bounded LRU cache of the retrieved weights.
+
+    Entries expire after a configurable TTL and terms missing in the wrapped provider are cached as well
+    (negative caching). On each lookup only the terms not found in the cache are retrieved, in a single
+    call to the wrapped provider.
+
+    The weighting transforms and missing terms policy of the wrapped provider are used, so the cached provider
+    returns the same weights as the wrapped one.
+    """
+
+    def __init__(self, provider, max_size=100000, ttl=None, negative_ttl=None, clock=time.time):
+        """
+        :param provider: The provider to cache weights for.
+        :type provider: TermWeightingProvider
+        :param max_size: Maximum number of cached terms, including negative entries.
+        :type max_size: int|long
+        :param ttl: Seconds before a cached weight expires. None caches weights until they are evicted.
+        :type ttl: int|long|float|None
+        :param negative_ttl: Seconds before a cached missing term expires. Defaults to the ttl value.
+        :type negative_ttl: int|long|float|None
+        :param clock: Function returning the current time in seconds.
+        :type clock: function
+        """
+        super(CachingTermWeightProvider, self).__init__()
+
+        self.provider = provider
+        self.missing_value_policy = provider.missing_value_policy
+        self.default_value = provider.default_value
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.clock = clock
+
+        # term -> (weight or None for missing terms, expiry time or None)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _transform(self, weights):
+        # the wrapped provider may adjust the weights before the transforms, f.ex. GensimIDFProvider
+        return self.provider._transform(weights)
+
+    def _lookup(self, term, now):
+        """
+        Retrieves a cache entry, refreshing its LRU position. Expired entries are removed.
+
+        :rtype : (float|None,)|None
+        :return: Tuple with the cached weight or None if the term is not cached.
+        """
+        entry = self._cache.pop(term, None)
+
+        if entry is None:
+            return None
+
+        weight, expires = entry
+
+        if expires is not None and expires <= now:
+            self.expirations += 1
+            return None
+
+        self._cache[term] = entry
+
+        return weight,
+
+    def _store(self, term, weight, now):
+        ttl = self.negative_ttl if weight is None else self.ttl
+
+        self._cache.pop(term, None)
+        self._cache[term] = (weight, None if ttl is None else now + ttl)
+
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    def _weights_for_terms(self, terms):
+        weights = {}
+        missing = []
+
+        with self._lock:
+            now = self.clock()
+
+            for term in OrderedDict.fromkeys(terms):
+                cached = self._lookup(term, now)
+
+                if cached is None:
+                    missing.append(term)
+                else:
+                    self.hits += 1
+
+                    if cached[0] is None:
+                        self.negative_hits += 1
+                    else:
+                        weights[term] = cached[0]
+
+        if missing:
+            retrieved = self.provider._weights_for_terms(missing)
+
+            with self._lock:
+                now = self.clock()
+                self.misses += len(missing)
+
+                for term in missing:
+                    weight = retrieved.get(term)
+                    self._store(term, weight, now)
+
+                    if weight is not None:
+                        weights[term] = weight
+
+        return weights
+
+    def clear(self):
+        """
+        Removes all cached entries.
+        """
+        with self._lock:
+            self._cache.clear()
+
+    def cache_info(self):
+        """
+        Cache statistics.
+
+        :rtype : dict
+        :return: dict with hits, misses, negative_hits, evictions, expirations, hit_ratio and size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {'hits': self.hits, 'misses': self.misses, 'negative_hits': self.negative_hits,
+                    'evictions': self.evictions, 'expirations': self.expirations,
+                    'hit_ratio': self.hits / float(lookups) if lookups else .0,
+                    'size': len(self._cache)}
@@ -0,0 +1,385 @@
+import json
+import logging
+import os
+
+import numpy
+
+from es_text_analytics.term_weight_provider import ArrayTermWeightProvider
+from es_text_analytics.term_weight_store import encode_term
+
+"""
+Incrementally updated term statistics.
+
+TermStatistics keeps document and collection frequencies that can be updated with batches of added or removed
+documents, so weights can be refreshed without recounting the whole corpus. Updates can be appended to a journal
+file with the count deltas of each batch. Loading replays the journal on top of the last snapshot and compact writes
+a new snapshot and truncates the journal. Journal entries are numbered and the snapshot records the last entry it
+includes, so entries left in the journal by an interrupted compact are skipped when replaying.
+"""
+
+TERM_STATISTICS_FORMAT_VERSION = 2
+
+
+class TermStatistics(object):
+    """
+    Document frequencies, collection frequencies and corpus totals for a growing vocabulary.
+
+    The counts are stored in contiguous arrays indexed by term ids that are assigned when a term is first seen and
+    never reused, so ids stay valid across updates.
+    """
+
+    def __init__(self, journal_fn=None):
+        """
+        :param journal_fn: File the count deltas of each update are appended to. None disables the journal.
+        :type journal_fn: str|unicode|None
+        """
+        self.term_ids = {}
+        self.terms = []
+        self.dfs = numpy.zeros(1024, dtype=numpy.int64)
+        self.cfs = numpy.zeros(1024, dtype=numpy.int64)
+        self.n_doc = 0
+        self.n_tokens = 0
+        # incremented on each update, used by providers to detect stale weights
+        self.version = 0
+        # sequence number of the last journal entry included in the counts
+        self.journal_seq = 0
+
+        self.journal_fn = journal_fn
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _ids(self, terms, create=True):
+        """
+        Looks up term ids, assigning new ids to unseen terms when create is True.
+
+        :rtype : numpy.ndarray
+        """
+        ids = numpy.empty(len(terms), dtype=numpy.int64)
+
+        for i, term in enumerate(terms):
+            term_id = self.term_ids.get(term, -1)
+
+            if term_id < 0 and create:
+                term_id = self.term_ids[term] = len(self.terms)
+                self.terms.append(term)
+
+            ids[i] = term_id
+
+        if len(self.terms) > len(self.dfs):
+            size = max(len(self.terms), 2 * len(self.dfs))
+            self.dfs = numpy.concatenate([self.dfs, numpy.zeros(size - len(self.dfs), dtype=numpy.int64)])
+            self.cfs = numpy.concatenate([self.cfs, numpy.zeros(size - len(self.cfs), dtype=numpy.int64)])
+
+        return ids
+
+    @staticmethod
+    def _batch_counts(docs):
+        """
+        Counts the document and collection frequencies in a batch of documents.
+
+        :rtype : (dict, int, int)
+        :return: Map of terms to (df, cf) lists, number of documents and number of tokens.
+        """
+        counts = {}
+        n_doc = 0
+        n_tokens = 0
+
+        for tokens in docs:
+            n_doc += 1
+            n_tokens += len(tokens)
+            doc_counts = {}
+
+            for token in tokens:
+                doc_counts[token] = doc_counts.get(token, 0) + 1
+
+            for term, count in doc_counts.iteritems():
+                c = counts.get(term)
+
+                if c is None:
+                    counts[term] = [1, count]
+                else:
+                    c[0] += 1
+                    c[1] += count
+
+        return counts, n_doc, n_tokens
+
+    def _apply(self, terms, d_dfs, d_cfs, d_n_doc, d_n_tokens):
+        """
+        Adds count deltas. The deltas are checked before any counts are changed.
+
+        :raise ValueError: If the deltas would make any count negative, f.ex. when removing documents that were never
+            added.
+        """
+        ids = self._ids(terms, create=False)
+        found = ids >= 0
+        dfs = d_dfs.copy()
+        cfs = d_cfs.copy()
+        dfs[found] += self.dfs[ids[found]]
+        cfs[found] += self.cfs[ids[found]]
+
+        if self.n_doc + d_n_doc < 0 or self.n_tokens + d_n_tokens < 0 or (dfs < 0).any() or (cfs < 0).any():
+            raise ValueError('Negative term counts after update, removed documents that were never added ...')
+
+        ids = self._ids(terms)
+
+        numpy.add.at(self.dfs, ids, d_dfs)
+        numpy.add.at(self.cfs, ids, d_cfs)
+        self.n_doc += d_n_doc
+        self.n_tokens += d_n_tokens
+
+        self.version += 1
+
+    def _update(self, docs, sign):
+        counts, n_doc, n_tokens = self._batch_counts(docs)
+        terms = counts.keys()
+        d_dfs = numpy.fromiter((c[0] for c in counts.itervalues()), dtype=numpy.int64, count=len(terms)) * sign
+        d_cfs = numpy.fromiter((c[1] for c in counts.itervalues()), dtype=numpy.int64, count=len(terms)) * sign
+
+        self._apply(terms, d_dfs, d_cfs, sign * n_doc, sign * n_tokens)
+        self._journal(terms, d_dfs, d_cfs, sign * n_doc, sign * n_tokens)
+
+        return self
+
+    def _journal(self, terms, d_dfs, d_cfs, d_n_doc, d_n_tokens):
+        if not self.journal_fn:
+            return
+
+        self.journal_seq += 1
+
+        with open(self.journal_fn, 'a') as f:
+            f.write(json.dumps({'seq': self.journal_seq, 'n_doc': d_n_doc, 'n_tokens': d_n_tokens, 'terms': terms,
+                                'dfs': d_dfs.tolist(), 'cfs': d_cfs.tolist()}))
+            f.write('\n')
+
+    def add_documents(self, docs):
+        """
+        Adds a batch of documents to the statistics.
+
+        :param docs: Iterable with the tokens of each document.
+        :rtype : TermStatistics
+        """
+        return self._update(docs, 1)
+
+    def remove_documents(self, docs):
+        """
+        Removes a batch of previously added documents from the statistics. Terms are kept with zero counts.
+
+        :param docs: Iterable with the tokens of each document.
+        :rtype : TermStatistics
+        :raise ValueError: If the batch has documents that were never added. The statistics are not changed.
+        """
+        return self._update(docs, -1)
+
+    def doc_freqs(self, terms):
+        """
+        :param terms:
+        :type terms: list|tuple
+        :rtype : numpy.ndarray
+        :return: Document frequencies with 0 for unseen terms.
+        """
+        ids = self._ids(terms, create=False)
+        found = ids >= 0
+        dfs = numpy.zeros(len(ids), dtype=numpy.int64)
+        dfs[found] = self.dfs[ids[found]]
+
+        return dfs
+
+    def save(self, fn):
+        """
+        Writes a snapshot of the statistics to a numpy .npz file. The snapshot is written to a temporary file that
+        replaces fn when complete, so an interrupted save leaves the previous snapshot intact.
+
+        :param fn:
+        :type fn: str|unicode
+        """
+        encoded = [encode_term(term) for term in self.terms]
+        offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(term) for term in encoded], out=offsets[1:])
+        n = len(self.terms)
+
+        params = numpy.array([TERM_STATISTICS_FORMAT_VERSION, self.n_doc, self.n_tokens, self.journal_seq],
+                             dtype=numpy.int64)
+        tmp_fn = fn + '.tmp'
+
+        with open(tmp_fn, 'wb') as f:
+            numpy.savez_compressed(f, params=params,
+                                   terms=numpy.frombuffer(''.join(encoded), dtype=numpy.uint8), offsets=offsets,
+                                   dfs=self.dfs[:n], cfs=self.cfs[:n])
+
+        os.rename(tmp_fn, fn)
+
+        logging.info('Saved statistics for %d terms and %d documents to %s ...' % (n, self.n_doc, fn))
+
+    def compact(self, fn):
+        """
+        Writes a snapshot and truncates the journal, the journal deltas are included in the snapshot. If the journal
+        isn't truncated, f.ex. after a crash, the entries are skipped on load since the snapshot records them.
+
+        :param fn: Snapshot file name.
+        :type fn: str|unicode
+        """
+        self.save(fn)
+
+        if self.journal_fn and os.path.exists(self.journal_fn):
+            open(self.journal_fn, 'w').close()
+
+    def replay(self, journal_fn):
+        """
+        Applies the count deltas in a journal file. Entries already included in the counts are skipped.
+
+        :param journal_fn:
+        :type journal_fn: str|unicode
+        :rtype : TermStatistics
+        """
+        n = 0
+        skipped = 0
+
+        with open(journal_fn) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                delta = json.loads(line)
+
+                if delta['seq'] <= self.journal_seq:
+                    skipped += 1
+                    continue
+
+                self._apply(delta['terms'], numpy.array(delta['dfs'], dtype=numpy.int64),
+                            numpy.array(delta['cfs'], dtype=numpy.int64), delta['n_doc'], delta['n_tokens'])
+                self.journal_seq = delta['seq']
+                n += 1
+
+        logging.info('Replayed %d updates from %s, skipped %d already in the snapshot ...' % (n, journal_fn, skipped))
+
+        return self
+
+    @classmethod
+    def load(cls, fn=None, journal_fn=None):
+        """
+        Loads a snapshot and replays the journal. Further updates are appended to the journal.
+
+        :param fn: Snapshot file name. None starts from empty statistics.
+        :type fn: str|unicode|None
+        :param journal_fn: Journal file name.
+        :type journal_fn: str|unicode|None
+        :rtype : TermStatistics
+        :raise ValueError: If the snapshot has an unknown format version.
+        """
+        stats = cls()
+
+        if fn:
+            data = numpy.load(fn)
+            params = data['params'].tolist()
+
+            if params[0] != TERM_STATISTICS_FORMAT_VERSION:
+                raise ValueError('Unknown term statistics format version %d in %s ...' % (params[0], fn))
+
+            _, stats.n_doc, stats.n_tokens, stats.journal_seq = params
+
+            blob = data['terms'].tostring()
+            offsets = data['offsets'].tolist()
+            stats.terms = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in xrange(len(offsets) - 1)]
+            stats.term_ids = dict((term, i) for i, term in enumerate(stats.terms))
+            stats.dfs = data['dfs'].astype(numpy.int64)
+            stats.cfs = data['cfs'].astype(numpy.int64)
+
+        if journal_fn and os.path.exists(journal_fn):
+            stats.replay(journal_fn)
+
+        stats.journal_fn = journal_fn
+
+        return stats
+
+    @classmethod
+    def from_dictionary(cls, dictionary, journal_fn=None):
+        """
+        Initializes the statistics from a Gensim Dictionary.
+
+        Collection frequencies are taken from Dictionary.cfs. Older Gensim versions don't keep them, the collection
+        frequencies and n_tokens are then left at 0 and cf weighting needs statistics rebuilt from the documents.
+
+        With a journal the dictionary counts are written as the first journal entry, so load replays them before
+        the later updates.
+
+        :param dictionary:
+        :type dictionary: gensim.corpora.Dictionary
+        :param journal_fn: New journal file, see __init__.
+        :type journal_fn: str|unicode|None
+        :rtype : TermStatistics
+        :raise ValueError: If the journal already has entries.
+        """
+        if journal_fn and os.path.exists(journal_fn) and os.path.getsize(journal_fn) > 0:
+            raise ValueError('Journal %s already has entries, use load to continue it ...' % journal_fn)
+
+        stats = cls(journal_fn=journal_fn)
+        terms = dictionary.token2id.keys()
+        ids = [dictionary.token2id[term] for term in terms]
+        cfs = getattr(dictionary, 'cfs', None)
+
+        if cfs is None:
+            logging.warning('Dictionary without collection frequencies, cf weights need a full rebuild ...')
+            d_cfs, n_tokens = numpy.zeros(len(terms), dtype=numpy.int64), 0
+        else:
+            d_cfs, n_tokens = numpy.array([cfs.get(i, 0) for i in ids], dtype=numpy.int64), dictionary.num_pos
+
+        d_dfs = numpy.array([dictionary.dfs.get(i, 0) for i in ids], dtype=numpy.int64)
+
+        stats._apply(terms, d_dfs, d_cfs, dictionary.num_docs, n_tokens)
+        stats._journal(terms, d_dfs, d_cfs, dictionary.num_docs, n_tokens)
+
+        return stats
+
+
+class IncrementalTermWeightProvider(ArrayTermWeightProvider):
+    """
+    Term weight provider for frequency ratios from TermStatistics. Use inverse=True for IDF weights.
+
+    The weights are recomputed on the first lookup after the statistics are updated. Terms with zero counts, f.ex.
+    after their documents are removed, are missing.
+    """
+
+    def __init__(self, stats, weighting='df', **kwargs):
+        """
+        :param stats:
+        :type stats: TermStatistics
+        :param weighting: 'df' for document frequency ratios, 'cf' for collection frequency ratios (same as
+            weight_map_from_term_counts with the corpus term counts).
+        :type weighting: str|unicode
+        :raise ValueError: On unknown weighting.
+        """
+        super(IncrementalTermWeightProvider, self).__init__(**kwargs)
+
+        if weighting not in ('df', 'cf'):
+            raise ValueError('Unknown weighting %s ...' % weighting)
+
+        self.stats = stats
+        self.weighting = weighting
+        self.term_ids = stats.term_ids
+        self._version = None
+
+    def _refresh(self):
+        if self._version == self.stats.version:
+            return
+
+        n = len(self.stats)
+
+        if self.weighting == 'df':
+            counts, total = self.stats.dfs[:n], self.stats.n_doc
+        else:
+            counts, total = self.stats.cfs[:n], self.stats.n_tokens
+
+        weights = counts.astype(numpy.float64)
+        weights[counts <= 0] = numpy.nan
+
+        if total > 0:
+            weights /= total
+
+        self.weights = weights.astype(numpy.float32)
+        self._version = self.stats.version
+
+    def _gather(self, idx):
+        self._refresh()
+
+        return super(IncrementalTermWeightProvider, self)._gather(idx)
@@ -1,14 +1,27 @@
 from abc import ABCMeta, abstractmethod
+from hashlib import sha1
 import logging
-from math import log
-import re
+from multiprocessing.pool import ThreadPool
+import threading
 
+import numpy
 from elasticsearch.client import IndicesClient
 from gensim.corpora import Dictionary
-from gensim.models import TfidfModel
+from gensim.models.tfidfmodel import df2idf
+
+from es_text_analytics.bulk_indexer import BulkIndexer
 
 ES_TERM_WEIGHTING_INDEX_DEFAULT_NAME = 'es_term_weighting_index'
 
+# maximum document id length in bytes accepted by Elasticsearch
+ES_MAX_ID_LENGTH = 512
+
+# number of ids in each mget request
+ES_MGET_CHUNK_SIZE = 1000
+
+# number of terms in each terms aggregation include clause
+ES_TERMS_CHUNK_SIZE = 1000
+
 ES_TERMWEIGHTING_INDEX_SETTINGS = {"mappings": {
     "term": {"properties": {"form": {"type": "string", "index": "not_analyzed"}, "value": {"type": "float"}}}}}
 
@@ -44,21 +57,59 @@ class TermWeightingProvider:
         else:
             raise ValueError
 
-    def _handle_missing_term(self, term):
+    def _transform(self, weights):
         """
-        Implements missing terms according to configured policy
+        Applies the configured weighting transforms to an array of weights.
 
-        :param term:
-        :type term:str|unicode
-        :rtype : None|float
-        :return: :raise KeyError:
+        :param weights:
+        :type weights: numpy.ndarray
+        :rtype : numpy.ndarray
         """
-        if self.missing_value_policy == 'error':
-            raise KeyError(term)
-        elif self.missing_value_policy == 'ignore':
-            return None
-        else:
-            return self.default_value
+        if self.inverse:
+            weights = 1. / weights
+
+        if self.sublinear:
+            weights = numpy.log(weights)
+
+        return weights
+
+    def weight_array(self, terms):
+        """
+        Vectorized retrieval of the weights for a batch of terms.
+
+        Missing terms are handled according to the configured policy, except that with the 'ignore' policy
+        missing terms are returned as NaN in order to keep the result aligned with the passed terms.
+
+        :param terms: list of terms
+        :type terms: list|tuple
+        :rtype : numpy.ndarray
+        :return: Array of float64 weights with the same length and order as terms.
+        :raise KeyError: When a term is missing and the missing policy is 'error'.
+        """
+        if not isinstance(terms, (list, tuple)):
+            terms = list(terms)
+
+        return self._transform(self._handle_missing_weights(self._weight_array_for_terms(terms), terms))
+
+    def _handle_missing_weights(self, weights, keys):
+        """
+        Implements the missing terms policy for an array of weights where missing terms are NaN.
+
+        :param weights:
+        :type weights: numpy.ndarray
+        :param keys: Terms or ids corresponding to the weights, used for error reporting.
+        :rtype : numpy.ndarray
+        :raise KeyError: When a term is missing and the missing policy is 'error'.
+        """
+        missing = numpy.isnan(weights)
+
+        if missing.any():
+            if self.missing_value_policy == 'error':
+                raise KeyError(keys[numpy.flatnonzero(missing)[0]])
+            elif self.missing_value_policy == 'value':
+                weights[missing] = self.default_value
+
+        return weights
 
     def __getitem__(self, terms):
         """
@@ -75,28 +126,13 @@ class TermWeightingProvider:
         if isinstance(terms, (str, unicode)):
             terms = [terms]
             single = True
+        elif not isinstance(terms, (list, tuple)):
+            terms = list(terms)
 
-        # retrieve the term weight map implemented in the superclass
-        tw = self._weights_for_terms(terms)
-
-        w = []
-
-        for term in terms:
-            if term in tw:
-                w.append((term, tw[term]))
-            else:
-                # check missing value policy
-                val = self._handle_missing_term(term)
-
-                if val:
-                    w.append((term, val))
-
-        # do transforms
-        if self.inverse:
-            w = [(term, 1. / freq) for term, freq in w]
+        weights = self.weight_array(terms)
 
-        if self.sublinear:
-            w = [(term, log(freq)) for term, freq in w]
+        # NaN weights are missing terms with the 'ignore' policy, NaN != NaN
+        w = [(term, val) for term, val in zip(terms, weights.tolist()) if val == val]
 
         # if we're returning a single or null result we unwrap the list
         if single and (len(w) == 1):
@@ -106,6 +142,21 @@ class TermWeightingProvider:
         else:
             return w
 
+    def _weight_array_for_terms(self, terms):
+        """
+        Retrieves the untransformed weights for the terms as an array with NaN for missing terms.
+
+        The default implementation builds the array from _weights_for_terms. Array based providers can override
+        this to avoid the intermediate dict.
+
+        :param terms:
+        :type terms: list
+        :rtype : numpy.ndarray
+        """
+        tw = self._weights_for_terms(terms)
+
+        return numpy.array([tw.get(term, numpy.nan) for term in terms], dtype=numpy.float64)
+
     @abstractmethod
     def _weights_for_terms(self, terms):
         """
@@ -147,6 +198,42 @@ def weight_map_from_term_counts(term_count_iter, min_count=1):
     return weight_map
 
 
+def weight_array_from_term_counts(term_count_iter, min_count=1, dtype=numpy.float32):
+    """
+    Create a compact term weight table from a list of terms and counts. Same weights as weight_map_from_term_counts
+    but stored as a map of terms to ids and a contiguous array of frequency ratios.
+
+    :param term_count_iter: An iterator with tuples of terms and counts, ie, (term, count).
+    :param min_count: Minimum count value that will be added to the weight map:
+    :type min_count: int|long
+    :param dtype: Numpy dtype for the weight array.
+    :rtype : (dict, numpy.ndarray)
+    :return: A dict with the terms as keys and array indices as values, and the array with the frequency ratios.
+    """
+    term_ids = {}
+    counts = []
+    total = 0
+
+    for term, count in term_count_iter:
+        total += count
+
+        if count >= min_count:
+            term_id = term_ids.get(term)
+
+            if term_id is None:
+                term_ids[term] = len(counts)
+                counts.append(count)
+            else:
+                counts[term_id] += count
+
+    weights = numpy.array(counts, dtype=numpy.float64)
+
+    if total:
+        weights /= float(total)
+
+    return term_ids, weights.astype(dtype)
+
+
 def term_counts_line_parser(line, delim='\t', term_index=1, count_index=2):
     """
     Parses a line from a file with terms and counts as line items.
@@ -187,57 +274,245 @@ def term_counts_iter_from_file(f, line_parser=None):
         yield line_parser(line)
 
 
-class SimpleTermWeightProvider(TermWeightingProvider):
+def chunks(seq, size):
+    """
+    Splits a sequence into lists with at most size elements.
+
+    :type seq: list|tuple
+    :type size: int|long
+    :rtype : generator
+    """
+    for i in xrange(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+class ArrayTermWeightProvider(TermWeightingProvider):
+    """
+    Base class for providers with the weights stored in a contiguous array indexed by a term to id map.
+    Batch lookups with weight_array are done as a single array gather, and weights can be looked up directly by
+    id with weight_array_for_ids.
+
+    Subclasses set the term_ids and weights attributes. Ids without a weight should have NaN in the weights array.
+    """
+
+    def __init__(self, **kwargs):
+        super(ArrayTermWeightProvider, self).__init__(**kwargs)
+
+        self.term_ids = {}
+        self.weights = numpy.array([], dtype=numpy.float32)
+
+    def _term_indices(self, terms):
+        """
+        Maps terms to array indices with -1 for missing terms.
+
+        :rtype : numpy.ndarray
+        """
+        get = self.term_ids.get
+
+        return numpy.fromiter((get(term, -1) for term in terms), dtype=numpy.int64, count=len(terms))
+
+    def _gather(self, idx):
+        """
+        Retrieves the untransformed weights for the array indices with NaN for invalid indices.
+
+        :param idx:
+        :type idx: numpy.ndarray
+        :rtype : numpy.ndarray
+        """
+        found = (idx >= 0) & (idx < len(self.weights))
+
+        w = numpy.empty(len(idx), dtype=numpy.float64)
+        w[found] = self.weights[idx[found]]
+        w[~found] = numpy.nan
+
+        return w
+
+    def weight_array_for_ids(self, ids):
+        """
+        Vectorized retrieval of the weights for a batch of term ids. Missing ids are handled as in weight_array.
+
+        :param ids: Term ids.
+        :type ids: list|tuple|numpy.ndarray
+        :rtype : numpy.ndarray
+        :return: Array of float64 weights with the same length and order as ids.
+        :raise KeyError: When an id is missing and the missing policy is 'error'.
+        """
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+
+        return self._transform(self._handle_missing_weights(self._gather(ids), ids))
+
+    def _weight_array_for_terms(self, terms):
+        return self._gather(self._term_indices(terms))
+
+    def _weights_for_terms(self, terms):
+        return {term: w for term, w in zip(terms, self._weight_array_for_terms(terms).tolist()) if w == w}
+
+
+class SimpleTermWeightProvider(ArrayTermWeightProvider):
     """
     Simple term weight provider for term count ratios supplied by an iterator. Takes options for returning
     logged or inverse ratios.
+
+    The ratios are stored in a float32 array, see ArrayTermWeightProvider.
     """
 
     def __init__(self, term_count_iter, **kwargs):
         super(SimpleTermWeightProvider, self).__init__(**kwargs)
 
-        self.weight_map = weight_map_from_term_counts(term_count_iter)
-
-    def _weights_for_terms(self, terms):
-        # just return the whole weight dict
-        return self.weight_map
+        self.term_ids, self.weights = weight_array_from_term_counts(term_count_iter)
 
 
 class ESTermAggregationWeightProvider(TermWeightingProvider):
     """
     Term weight provider for DF/IDF values based on an Elasticsearch index using the terms aggregator.
 
+    The terms are passed as exact values to the aggregation include clause in chunks of at most chunk_size terms,
+    with the chunks sent concurrently. The index document count is retrieved with the first request and reused,
+    call refresh_doc_count to update it.
+
+    The concurrent requests use a thread pool created on the first lookup with several chunks. Call close or use
+    the provider as a context manager to stop the threads. The pool isn't pickled, so copies sent to other processes
+    create their own.
+
     Defaults to logged IDF values.
     """
 
-    def __init__(self, es, index, doc_type, field, **kwargs):
+    def __init__(self, es, index, doc_type, field, chunk_size=ES_TERMS_CHUNK_SIZE, n_threads=4, **kwargs):
+        """
+        :param chunk_size: Maximum number of terms in each aggregation request.
+        :type chunk_size: int|long
+        :param n_threads: Maximum number of concurrent aggregation requests.
+        :type n_threads: int|long
+        """
         super(ESTermAggregationWeightProvider, self).__init__(**kwargs)
 
         self.es = es
         self.index = index
         self.doc_type = doc_type
         self.field = field
+        self.chunk_size = chunk_size
+        self.n_threads = n_threads
 
-    def _weights_for_terms(self, terms):
+        self.n_doc = None
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        del state['_pool_lock']
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Waits for the pending requests and stops the threads. A later lookup starts a new pool.
+        """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+
+        if pool:
+            pool.close()
+            pool.join()
+
+    def _get_pool(self):
+        # lookups from several threads must not each create a pool
+        with self._pool_lock:
+            if not self._pool:
+                self._pool = ThreadPool(self.n_threads)
+
+            return self._pool
+
+    def refresh_doc_count(self):
+        """
+        Discards the cached index document count.
+        """
+        self.n_doc = None
+
+    def _doc_freqs_for_terms(self, terms):
         q = {"size": 0,
-             "aggs": {"df": {"terms": {"field": self.field, "size": len(terms),
-                                       "include": '|'.join([re.escape(term) for term in terms])}}}}
+             "aggs": {"df": {"terms": {"field": self.field, "size": len(terms), "include": terms}}}}
 
         resp = self.es.search(index=self.index, doc_type=self.doc_type, body=q)
 
         try:
             n_doc = resp['hits']['total']
-            tf = dict((e['key'], e['doc_count'] / float(n_doc)) for e in resp['aggregations']['df']['buckets'])
+            df = dict((e['key'], e['doc_count']) for e in resp['aggregations']['df']['buckets'])
         except KeyError:
             # malformed response
             raise RuntimeError
 
-        return dict(tf)
+        if isinstance(n_doc, dict):
+            n_doc = n_doc['value']
+
+        return n_doc, df
+
+    def _weights_for_terms(self, terms):
+        terms = list(set(terms))
+        term_chunks = list(chunks(terms, self.chunk_size))
+
+        if len(term_chunks) > 1 and self.n_threads > 1:
+            results = self._get_pool().map(self._doc_freqs_for_terms, term_chunks)
+        else:
+            results = [self._doc_freqs_for_terms(chunk) for chunk in term_chunks]
+
+        if self.n_doc is None and results:
+            self.n_doc = results[0][0]
+
+        weights = {}
+
+        for _, df in results:
+            for term, doc_count in df.items():
+                weights[term] = doc_count / float(self.n_doc)
+
+        return weights
+
+
+def idf_array_from_dictionary(dictionary, dtype=numpy.float32):
+    """
+    Computes the IDF values for all the terms in a Gensim Dictionary as a dense array indexed by the dictionary ids.
+    Uses the same default IDF formula as the Gensim TfidfModel.
+
+    :param dictionary:
+    :type dictionary: gensim.corpora.Dictionary
+    :param dtype: Numpy dtype for the IDF array.
+    :rtype : numpy.ndarray
+    :return: Array with IDF values, ids not in the dictionary have NaN values.
+    """
+    size = max(dictionary.dfs) + 1 if dictionary.dfs else 0
+    dfs = numpy.zeros(size, dtype=numpy.float64)
+
+    ids = numpy.fromiter(dictionary.dfs.iterkeys(), dtype=numpy.int64, count=len(dictionary.dfs))
+    dfs[ids] = numpy.fromiter(dictionary.dfs.itervalues(), dtype=numpy.float64, count=len(dictionary.dfs))
+
+    idfs = numpy.empty(size, dtype=numpy.float64)
+    idfs.fill(numpy.nan)
+    found = dfs > 0
+    idfs[found] = df2idf(dfs[found], dictionary.num_docs)
 
+    return idfs.astype(dtype)
 
-class GensimIDFProvider(TermWeightingProvider):
+
+class GensimIDFProvider(ArrayTermWeightProvider):
     """
-    IDF TermWeightingProvider based on a Gensim Dictionary using the Gensim TfIdf model.
+    IDF TermWeightingProvider based on a Gensim Dictionary using the Gensim TfIdf IDF formula.
+
+    The IDF values are computed once for the whole dictionary so lookups are array gathers. Weights can be retrieved
+    by term with weight_array or by dictionary id with weight_array_for_ids.
+
+    Terms occurring in every document have 0 IDF. With inverse or sublinear the IDF values are clipped to the
+    IDF of a term missing from half a document, which is less than the IDF of any other term, so the inverse and
+    log weights stay finite.
     """
     def __init__(self, dictionary, **kwargs):
         super(GensimIDFProvider, self).__init__(**kwargs)
@@ -249,28 +524,57 @@ class GensimIDFProvider(TermWeightingProvider):
         if isinstance(dictionary, (str, unicode)):
             dictionary = Dictionary.load(dictionary)
         self.dictionary = dictionary
-        self.tfidf = TfidfModel(dictionary=dictionary, normalize=False)
+        self.term_ids = dictionary.token2id
+        self.weights = idf_array_from_dictionary(dictionary)
+        self.min_idf = df2idf(dictionary.num_docs - .5, dictionary.num_docs) if dictionary.num_docs else 1.
 
-    def _weights_for_terms(self, terms):
-        return {self.dictionary[bow_id]: val for bow_id, val in self.tfidf[self.dictionary.doc2bow(terms)]}
+    def _transform(self, weights):
+        if self.inverse or self.sublinear:
+            # NaN for missing terms is kept
+            weights = numpy.maximum(weights, self.min_idf)
+
+        return super(GensimIDFProvider, self)._transform(weights)
+
+
+def term_doc_id(term):
+    """
+    Document id for a term in the term weight index. The term itself is used as id unless it is too long for
+    an Elasticsearch id in which case a SHA1 hash of the term is used.
+
+    :param term:
+    :type term: str|unicode
+    :rtype : str|unicode
+    """
+    encoded = term.encode('utf-8') if isinstance(term, unicode) else term
+
+    if len(encoded) > ES_MAX_ID_LENGTH:
+        return 'sha1-%s' % sha1(encoded).hexdigest()
+
+    return term
 
 
 class ESTermIndexWeightingProvider(TermWeightingProvider):
     """
     Class implementing storage of term weights in an Elasticsearch index.
+
+    Terms are stored with the term (see term_doc_id) as document id and looked up with chunked mget requests.
+    Indexes created with earlier versions used generated ids and need to be rebuilt.
     """
-    def __init__(self, es, index=None, initial_weights=None, **kwargs):
+    def __init__(self, es, index=None, initial_weights=None, mget_chunk_size=ES_MGET_CHUNK_SIZE, **kwargs):
         """
         :param es: Elasticsearch instance from py-elasticsearch API.
         :type es:elasticsearch.Elasticsearch
         :param index: Name of the index where term weights are stored. If it doesn't exist it is created.
         :type index:str|unicode
         :param initial_weights: Iterator with term/weight pairs that will be added to the index during initialization.
+        :param mget_chunk_size: Maximum number of terms in each mget request.
+        :type mget_chunk_size: int|long
         """
         super(ESTermIndexWeightingProvider, self).__init__(**kwargs)
 
         self.es = es
         self.index = index
+        self.mget_chunk_size = mget_chunk_size
 
         if not self.index:
             self.index = ES_TERM_WEIGHTING_INDEX_DEFAULT_NAME
@@ -298,7 +602,7 @@ class ESTermIndexWeightingProvider(TermWeightingProvider):
             ic.create(index=index, body=ES_TERMWEIGHTING_INDEX_SETTINGS)
 
     @staticmethod
-    def _add_terms_iter(es, index, iter, bulk_size=1000):
+    def _add_terms_iter(es, index, iter, bulk_size=1000, **kwargs):
         """
         Adds term documents to the index from the term weight pairs in the iterator.
 
@@ -307,34 +611,26 @@ class ESTermIndexWeightingProvider(TermWeightingProvider):
         :param index:
         :type index:str|unicode
         :param iter:
+        :param bulk_size: Maximum number of terms in each bulk request.
+        :type bulk_size: int|long
+        :param kwargs: Other options passed to BulkIndexer.
+        :rtype : dict
+        :return: BulkIndexer statistics.
         """
-        bulk_actions = []
-        count = 0
+        actions = (({'index': {'_index': index, '_type': 'term', '_id': term_doc_id(term)}},
+                    {'form': term, 'value': weight})
+                   for term, weight in iter)
 
-        for term, weight in iter:
-            count = 1
-
-            bulk_actions += [{'index': {'_index': index, '_type': 'term'}},
-                             {'form': term, 'value': weight}]
-
-            if len(bulk_actions) % (2 * bulk_size) == 0:
-                es.bulk(index=index, doc_type='term', body=bulk_actions)
-                logging.info('Added %d documents ...' % count)
-                bulk_actions = []
-
-        if bulk_actions:
-            es.bulk(index=index, doc_type='term', body=bulk_actions)
-            logging.info('Added %d documents ...' % count)
+        return BulkIndexer(es, index, chunk_size=bulk_size, **kwargs).index(actions)
 
     def _weights_for_terms(self, terms):
-        should_clauses = [{'match': {'form': term}} for term in terms]
+        weights = {}
+
+        for chunk in chunks(list(set(terms)), self.mget_chunk_size):
+            resp = self.es.mget(index=self.index, doc_type='term', body={'ids': [term_doc_id(term) for term in chunk]})
 
-        resp = self.es.search(index=self.index, doc_type='term',
-                       body={'query': {
-                           'bool': {
-                               'should': should_clauses
-                           }
-                       },
-                       'fields': ['form', 'value']})
+            for doc in resp['docs']:
+                if doc.get('found'):
+                    weights[doc['_source']['form']] = float(doc['_source']['value'])
 
-        return {hit['fields']['form'][0]: float(hit['fields']['value'][0]) for hit in resp['hits']['hits']}
+        return weights
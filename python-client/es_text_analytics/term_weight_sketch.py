@@ -0,0 +1,324 @@
+import logging
+
+import numpy
+
+from es_text_analytics.term_weight_provider import TermWeightingProvider
+from es_text_analytics.term_weight_store import encode_term, term_hashes
+
+"""
+Approximate document frequencies in bounded memory for streaming corpora.
+
+Document frequencies are counted in a count-min sketch with conservative updates, so estimates never undercount and
+the memory use is fixed regardless of the vocabulary size. The most frequent terms are additionally tracked in a
+bounded heavy hitters table. Sketches with the same dimensions and seed can be merged, f.ex. when counting shards of
+a corpus in separate workers.
+"""
+
+SKETCH_FILE_FORMAT_VERSION = 1
+
+
+class CountMinSketch(object):
+    """
+    Count-min sketch of document frequencies with a heavy hitters table.
+
+    Each term is hashed to one counter in each row of a depth x width counter table and the document frequency
+    estimate is the minimum of these counters. With conservative updates only the counters below the new estimate
+    are increased, which reduces the overestimation considerably for skewed term distributions.
+
+    The estimation error is at most 2 * n / width with probability 1 - 0.5 ** depth where n is the total number of
+    counted (document, term) pairs.
+    """
+
+    def __init__(self, width=2 ** 20, depth=4, seed=0, heavy_hitters=10000, conservative=True, dtype=numpy.uint32):
+        """
+        :param width: Number of counters in each row.
+        :type width: int|long
+        :param depth: Number of rows, ie. independent hash functions.
+        :type depth: int|long
+        :param seed: Hash seed. Sketches must have the same dimensions and seed to be merged.
+        :type seed: int|long
+        :param heavy_hitters: Number of the most frequent terms tracked exactly by term. 0 disables the table.
+        :type heavy_hitters: int|long
+        :param conservative: Use conservative updates.
+        :type conservative: bool
+        :param dtype: Numpy dtype for the counters.
+        """
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        self.heavy_hitters = heavy_hitters
+        self.conservative = conservative
+
+        self.table = numpy.zeros((depth, width), dtype=dtype)
+        self.n_doc = 0
+        # term -> document frequency estimate for the most frequent terms seen
+        self.top = {}
+
+    def _cells(self, terms):
+        """
+        Computes the counter column for each term in each row with double hashing on the 64 bit store hashes.
+
+        :rtype : numpy.ndarray
+        :return: depth x len(terms) array of column indices.
+        """
+        hashes = term_hashes([encode_term(term) for term in terms])
+        h1 = hashes & numpy.uint64(0xffffffff)
+        h2 = (hashes >> numpy.uint64(32)) | numpy.uint64(1)
+        rows = numpy.arange(self.depth, dtype=numpy.uint64).reshape(-1, 1) + numpy.uint64(self.seed * self.depth)
+
+        return ((h1 + rows * h2) % numpy.uint64(self.width)).astype(numpy.int64)
+
+    def _estimate_cells(self, cells):
+        return self.table[numpy.arange(self.depth).reshape(-1, 1), cells].min(axis=0)
+
+    def add(self, counts):
+        """
+        Adds term counts to the sketch.
+
+        :param counts: Map of terms to counts.
+        :type counts: dict
+        """
+        if not counts:
+            return
+
+        terms = counts.keys()
+        c = numpy.fromiter(counts.itervalues(), dtype=numpy.int64, count=len(terms))
+        cells = self._cells(terms)
+        rows = numpy.repeat(numpy.arange(self.depth), len(terms))
+
+        if self.conservative:
+            target = (self._estimate_cells(cells) + c).astype(self.table.dtype)
+            # raises each counter to the largest new estimate of the terms hashed to it
+            numpy.maximum.at(self.table, (rows, cells.ravel()), numpy.tile(target, self.depth))
+        else:
+            numpy.add.at(self.table, (rows, cells.ravel()), numpy.tile(c.astype(self.table.dtype), self.depth))
+
+        if self.heavy_hitters:
+            estimates = self._estimate_cells(cells)
+            self.top.update(zip(terms, estimates.tolist()))
+
+            if len(self.top) > 2 * self.heavy_hitters:
+                self._trim_top()
+
+    def add_documents(self, docs):
+        """
+        Counts the document frequencies of a batch of documents. Each term is counted once per document.
+
+        :param docs: Iterable with the terms of each document.
+        :rtype : CountMinSketch
+        """
+        counts = {}
+        n_doc = 0
+
+        for terms in docs:
+            n_doc += 1
+
+            for term in set(terms):
+                counts[term] = counts.get(term, 0) + 1
+
+        self.add(counts)
+        self.n_doc += n_doc
+
+        return self
+
+    def update(self, docs, batch_size=10000):
+        """
+        Counts the document frequencies from a stream of documents in batches.
+
+        :param docs: Iterable with the terms of each document, f.ex. from dataset_terms_iter.
+        :param batch_size: Number of documents added in each batch.
+        :type batch_size: int|long
+        :rtype : CountMinSketch
+        """
+        batch = []
+
+        for terms in docs:
+            batch.append(terms)
+
+            if len(batch) >= batch_size:
+                self.add_documents(batch)
+                batch = []
+                logging.info('Counted %d documents ...' % self.n_doc)
+
+        if batch:
+            self.add_documents(batch)
+
+        return self
+
+    def _trim_top(self):
+        top = sorted(self.top.iteritems(), key=lambda e: e[1], reverse=True)[:self.heavy_hitters]
+        self.top = dict(top)
+
+    def estimate(self, terms):
+        """
+        Estimates the document frequencies of terms.
+
+        :param terms:
+        :type terms: list|tuple
+        :rtype : numpy.ndarray
+        """
+        if not terms:
+            return numpy.array([], dtype=numpy.int64)
+
+        return self._estimate_cells(self._cells(terms)).astype(numpy.int64)
+
+    def most_common(self, n=None):
+        """
+        The most frequent terms in the heavy hitters table with their estimated document frequencies.
+
+        :param n: Number of terms to return. Default returns all tracked terms.
+        :type n: int|long|None
+        :rtype : list
+        """
+        if len(self.top) > self.heavy_hitters:
+            self._trim_top()
+
+        top = sorted(self.top.iteritems(), key=lambda e: (-e[1], e[0]))
+
+        return top[:n] if n else top
+
+    def compatible(self, other):
+        return (self.width == other.width and self.depth == other.depth and self.seed == other.seed and
+                self.table.dtype == other.table.dtype)
+
+    def merge(self, other):
+        """
+        Adds the counts from another sketch, f.ex. from a worker counting another shard of the corpus.
+
+        :param other:
+        :type other: CountMinSketch
+        :rtype : CountMinSketch
+        :raise ValueError: If the sketches have different dimensions, seeds or counter types.
+        """
+        if not self.compatible(other):
+            raise ValueError('Cannot merge sketches with different dimensions or seeds ...')
+
+        self.table += other.table
+        self.n_doc += other.n_doc
+
+        if self.heavy_hitters:
+            terms = list(set(self.top) | set(other.top))
+            self.top = dict(zip(terms, self.estimate(terms).tolist()))
+            self._trim_top()
+
+        return self
+
+    def save(self, fn):
+        """
+        Saves the sketch to a numpy .npz file.
+
+        :param fn:
+        :type fn: str|unicode
+        """
+        top = self.most_common()
+        encoded = [encode_term(term) for term, _ in top]
+        offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(term) for term in encoded], out=offsets[1:])
+
+        params = numpy.array([SKETCH_FILE_FORMAT_VERSION, self.width, self.depth, self.seed, self.heavy_hitters,
+                              int(self.conservative), self.n_doc], dtype=numpy.int64)
+
+        with open(fn, 'wb') as f:
+            numpy.savez_compressed(f, params=params, table=self.table,
+                                   top_terms=numpy.frombuffer(''.join(encoded), dtype=numpy.uint8),
+                                   top_offsets=offsets,
+                                   top_counts=numpy.array([count for _, count in top], dtype=numpy.int64))
+
+    @classmethod
+    def load(cls, fn):
+        """
+        Loads a sketch saved with save.
+
+        :param fn:
+        :type fn: str|unicode
+        :rtype : CountMinSketch
+        :raise ValueError: If the file has an unknown format version.
+        """
+        data = numpy.load(fn)
+        version, width, depth, seed, heavy_hitters, conservative, n_doc = data['params'].tolist()
+
+        if version != SKETCH_FILE_FORMAT_VERSION:
+            raise ValueError('Unknown sketch format version %d in %s ...' % (version, fn))
+
+        sketch = cls(width=width, depth=depth, seed=seed, heavy_hitters=heavy_hitters, conservative=bool(conservative),
+                     dtype=data['table'].dtype)
+        sketch.table = data['table']
+        sketch.n_doc = n_doc
+
+        blob = data['top_terms'].tostring()
+        offsets = data['top_offsets'].tolist()
+        sketch.top = dict((blob[offsets[i]:offsets[i + 1]].decode('utf-8'), count)
+                          for i, count in enumerate(data['top_counts'].tolist()))
+
+        return sketch
+
+
+def dataset_terms_iter(dataset, field, tokenizer=None):
+    """
+    Extracts the terms of a field from each document in a dataset.
+
+    :param dataset: Dataset or other iterable of document dicts.
+    :param field: Document field with the text.
+    :type field: str|unicode
+    :param tokenizer: Function splitting the field text into terms. Default lowercases and splits on whitespace.
+    :type tokenizer: (str|unicode) -> list[str|unicode]
+    :rtype : generator
+    """
+    if not tokenizer:
+        tokenizer = lambda text: text.lower().split()
+
+    for doc in dataset:
+        text = doc.get(field)
+
+        yield tokenizer(text) if text else []
+
+
+class SketchDFProvider(TermWeightingProvider):
+    """
+    Term weight provider with document frequency ratios estimated by a count-min sketch. Use inverse=True for IDF
+    weights. Terms never counted are missing, other terms may be slightly overestimated.
+
+    The sketch can be updated while the provider is in use.
+    """
+
+    def __init__(self, sketch=None, **kwargs):
+        """
+        :param sketch: Sketch, sketch file name or None to create an empty default sized sketch.
+        :type sketch: CountMinSketch|str|unicode|None
+        """
+        super(SketchDFProvider, self).__init__(**kwargs)
+
+        if sketch is None:
+            sketch = CountMinSketch()
+        elif isinstance(sketch, (str, unicode)):
+            sketch = CountMinSketch.load(sketch)
+
+        self.sketch = sketch
+
+    def update(self, dataset, field, tokenizer=None, batch_size=10000):
+        """
+        Counts the documents in a dataset.
+
+        :param dataset: Dataset or other iterable of document dicts.
+        :param field: Document field with the text.
+        :type field: str|unicode
+        :param tokenizer: See dataset_terms_iter.
+        :rtype : SketchDFProvider
+        """
+        self.sketch.update(dataset_terms_iter(dataset, field, tokenizer=tokenizer), batch_size=batch_size)
+
+        return self
+
+    def _weight_array_for_terms(self, terms):
+        w = self.sketch.estimate(terms).astype(numpy.float64)
+        w[w == 0] = numpy.nan
+
+        if self.sketch.n_doc:
+            w /= self.sketch.n_doc
+
+        return w
+
+    def _weights_for_terms(self, terms):
+        w = self._weight_array_for_terms(terms)
+
+        return dict((term, val) for term, val in zip(terms, w.tolist()) if val == val)
@@ -0,0 +1,399 @@
+import logging
+from math import ceil
+import os
+import struct
+from hashlib import md5
+from itertools import chain
+
+import numpy
+
+from es_text_analytics.term_weight_provider import ArrayTermWeightProvider, weight_array_from_term_counts, \
+    term_counts_iter_from_file
+
+"""
+Compiled on-disk term weight store.
+
+The store is a single binary file that is memory mapped when opened, so any number of processes can share one copy
+of the term table and opening it does not depend on the vocabulary size.
+
+File layout (little endian):
+
+- header: 8 byte magic, number of terms, size of the term bytes blob and a reserved field (uint64)
+- term hashes: uint64[n_terms], sorted
+- term offsets: uint64[n_terms + 1], byte offsets into the term blob
+- weights: float32[n_terms]
+- term blob: UTF-8 encoded terms concatenated in hash order
+
+Terms are located by a binary search on the 64 bit term hashes and verified against the stored term bytes.
+"""
+
+WEIGHT_STORE_MAGIC = 'TWSTORE1'
+
+# maximum number of times a full term partition is split in two
+MAX_PARTITION_SPLITS = 16
+
+WEIGHT_STORE_HEADER = struct.Struct('<8sQQQ')
+
+
+def encode_term(term):
+    """
+    Encodes a term to the byte representation used in the store.
+
+    :param term:
+    :type term: str|unicode
+    :rtype : str
+    """
+    if isinstance(term, unicode):
+        return term.encode('utf-8')
+
+    return term
+
+
+def term_hashes(encoded_terms):
+    """
+    Computes the 64 bit store hashes for a list of encoded terms.
+
+    :param encoded_terms:
+    :type encoded_terms: list[str]
+    :rtype : numpy.ndarray
+    """
+    if not encoded_terms:
+        return numpy.array([], dtype='<u8')
+
+    return numpy.frombuffer(''.join(md5(term).digest()[:8] for term in encoded_terms), dtype='<u8').copy()
+
+
+def write_weight_store(fn, term_ids, weights):
+    """
+    Writes terms and weights to a weight store file.
+
+    :param fn: Weight store file name.
+    :type fn: str|unicode
+    :param term_ids: Map of terms to indices in the weights array.
+    :type term_ids: dict
+    :param weights: Weight array.
+    :type weights: numpy.ndarray
+    """
+    terms = [encode_term(term) for term in term_ids.iterkeys()]
+    term_weights = numpy.fromiter((weights[i] for i in term_ids.itervalues()), dtype=numpy.float32,
+                                  count=len(term_ids))
+    hashes = term_hashes(terms)
+
+    order = numpy.argsort(hashes, kind='mergesort')
+    terms = [terms[i] for i in order]
+    hashes = hashes[order]
+    term_weights = term_weights[order]
+
+    offsets = numpy.zeros(len(terms) + 1, dtype='<u8')
+    numpy.cumsum([len(term) for term in terms], out=offsets[1:])
+
+    with open(fn, 'wb') as f:
+        f.write(WEIGHT_STORE_HEADER.pack(WEIGHT_STORE_MAGIC, len(terms), int(offsets[-1]), 0))
+        f.write(hashes.astype('<u8').tostring())
+        f.write(offsets.tostring())
+        f.write(term_weights.astype('<f4').tostring())
+        f.write(''.join(terms))
+
+    logging.info('Wrote %d terms to weight store %s ...' % (len(terms), fn))
+
+
+def weight_store_from_term_counts(fn, term_count_iter, min_count=1):
+    """
+    Compiles a weight store with the frequency ratios of the terms and counts in the iterator.
+    Same weights as weight_map_from_term_counts.
+
+    :param fn: Weight store file name.
+    :type fn: str|unicode
+    :param term_count_iter: An iterator with tuples of terms and counts, ie, (term, count).
+    :param min_count: Minimum count value that will be added to the store.
+    :type min_count: int|long
+    """
+    term_ids, weights = weight_array_from_term_counts(term_count_iter, min_count=min_count)
+
+    write_weight_store(fn, term_ids, weights)
+
+
+def weight_store_from_gensim_text(text_fn, fn, min_count=1):
+    """
+    Converts a Gensim Dictionary in text format (Dictionary.save_as_text) to a weight store with document
+    frequency ratios.
+
+    :param text_fn: Gensim Dictionary text file.
+    :type text_fn: str|unicode
+    :param fn: Weight store file name.
+    :type fn: str|unicode
+    :param min_count: Minimum count value that will be added to the store.
+    :type min_count: int|long
+    """
+    with open(text_fn) as f:
+        # newer Gensim versions write the number of documents on the first line
+        lines = (line for line in f if '\t' in line)
+
+        weight_store_from_term_counts(fn, term_counts_iter_from_file(lines), min_count=min_count)
+
+
+def _es_doc_freqs_partitioned(es, index, doc_type, field, partition_size, num_partitions=None):
+    """
+    Pages through the field terms dictionary with partitioned terms aggregations (Elasticsearch 5.2+).
+
+    :rtype : (int, generator)
+    :return: The index document count and a generator with term and document count pairs.
+    """
+    resp = es.search(index=index, doc_type=doc_type,
+                     body={'size': 0, 'aggs': {'n_terms': {'cardinality': {'field': field}}}})
+    n_doc = resp['hits']['total']
+
+    if not num_partitions:
+        # the cardinality is an estimate so leave some headroom in each partition
+        num_partitions = max(1, int(ceil(resp['aggregations']['n_terms']['value'] * 1.2 / partition_size)))
+
+    def partition_doc_freqs(partition, n_partitions, splits=0):
+        # one term more than the partition size tells a full partition from a truncated one
+        q = {'size': 0,
+             'aggs': {'df': {'terms': {'field': field, 'size': partition_size + 1,
+                                       'include': {'partition': partition, 'num_partitions': n_partitions}}}}}
+        buckets = es.search(index=index, doc_type=doc_type, body=q)['aggregations']['df']['buckets']
+
+        if len(buckets) > partition_size:
+            if splits >= MAX_PARTITION_SPLITS:
+                raise ValueError('Partition %d of %d still has more than %d terms after %d splits, increase the '
+                                 'partition size ...' % (partition, n_partitions, partition_size, splits))
+
+            # terms are assigned to partitions by hash modulo the number of partitions, so partition p of n is
+            # partitions p and p + n of 2n
+            logging.info('Partition %d of %d is truncated, splitting it ...' % (partition, n_partitions))
+
+            return chain(partition_doc_freqs(partition, 2 * n_partitions, splits + 1),
+                         partition_doc_freqs(partition + n_partitions, 2 * n_partitions, splits + 1))
+
+        return ((e['key'], e['doc_count']) for e in buckets)
+
+    def doc_freqs():
+        for partition in xrange(num_partitions):
+            for term, doc_count in partition_doc_freqs(partition, num_partitions):
+                yield term, doc_count
+
+            logging.info('Read partition %d of %d ...' % (partition + 1, num_partitions))
+
+    return n_doc, doc_freqs()
+
+
+def _es_doc_freqs_composite(es, index, doc_type, field, partition_size):
+    """
+    Pages through the field terms dictionary with a composite aggregation (Elasticsearch 6.1+).
+
+    :rtype : (int, generator)
+    :return: The index document count and a generator with term and document count pairs.
+    """
+    def query(after=None):
+        composite = {'size': partition_size, 'sources': [{'term': {'terms': {'field': field}}}]}
+
+        if after:
+            composite['after'] = after
+
+        return es.search(index=index, doc_type=doc_type, body={'size': 0, 'aggs': {'df': {'composite': composite}}})
+
+    resp = query()
+
+    def doc_freqs(resp):
+        count = 0
+
+        while True:
+            buckets = resp['aggregations']['df']['buckets']
+
+            for e in buckets:
+                yield e['key']['term'], e['doc_count']
+
+            count += len(buckets)
+            logging.info('Read %d terms ...' % count)
+
+            after = resp['aggregations']['df'].get('after_key')
+
+            if not buckets or not after:
+                break
+
+            resp = query(after)
+
+    return resp['hits']['total'], doc_freqs(resp)
+
+
+def weight_store_from_es(es, index, doc_type, field, fn, method='partition', partition_size=10000,
+                         num_partitions=None):
+    """
+    Exports the document frequency ratios for all the terms in an Elasticsearch index field to a weight store.
+    A WeightStoreProvider with this store returns the same weights as ESTermAggregationWeightProvider with the
+    same options, without querying Elasticsearch.
+
+    :param es: Elasticsearch client instance.
+    :type es: elasticsearch.Elasticsearch
+    :param fn: Weight store file name.
+    :type fn: str|unicode
+    :param method: 'partition' for partitioned terms aggregations or 'composite' for a composite aggregation.
+    :type method: str|unicode
+    :param partition_size: Number of terms retrieved in each request.
+    :type partition_size: int|long
+    :param num_partitions: Number of partitions for the partition method. Default estimates the number of
+        partitions from the field cardinality. Partitions with more than partition_size terms are split in two
+        until they fit, at most MAX_PARTITION_SPLITS times.
+    :type num_partitions: int|long|None
+    :raise ValueError: On unknown method, or if a partition can't be split to fit partition_size.
+    """
+    if method == 'partition':
+        n_doc, doc_freqs = _es_doc_freqs_partitioned(es, index, doc_type, field, partition_size,
+                                                     num_partitions=num_partitions)
+    elif method == 'composite':
+        n_doc, doc_freqs = _es_doc_freqs_composite(es, index, doc_type, field, partition_size)
+    else:
+        raise ValueError('Unknown method %s ...' % method)
+
+    if isinstance(n_doc, dict):
+        n_doc = n_doc['value']
+
+    term_ids = {}
+    counts = []
+
+    for term, doc_count in doc_freqs:
+        term_ids[term] = len(counts)
+        counts.append(doc_count)
+
+    weights = numpy.array(counts, dtype=numpy.float64) / float(n_doc) if n_doc else numpy.array(counts)
+
+    write_weight_store(fn, term_ids, weights)
+
+
+class WeightStore(object):
+    """
+    Read only memory mapped view of a weight store file.
+    """
+
+    def __init__(self, fn):
+        """
+        :param fn: Weight store file name.
+        :type fn: str|unicode
+        :raise ValueError: If the file is not a weight store.
+        """
+        self.fn = fn
+
+        with open(fn, 'rb') as f:
+            magic, n_terms, blob_size, _ = WEIGHT_STORE_HEADER.unpack(f.read(WEIGHT_STORE_HEADER.size))
+
+        if magic != WEIGHT_STORE_MAGIC:
+            raise ValueError('%s is not a term weight store ...' % fn)
+
+        self.n_terms = n_terms
+
+        offset = WEIGHT_STORE_HEADER.size
+        self.hashes = self._map(dtype='<u8', offset=offset, count=n_terms)
+        offset += 8 * n_terms
+        self.offsets = self._map(dtype='<u8', offset=offset, count=n_terms + 1)
+        offset += 8 * (n_terms + 1)
+        self.weights = self._map(dtype='<f4', offset=offset, count=n_terms)
+        offset += 4 * n_terms
+        self.blob = self._map(dtype=numpy.uint8, offset=offset, count=blob_size)
+
+    def _map(self, dtype, offset, count):
+        if count == 0:
+            return numpy.array([], dtype=dtype)
+
+        return numpy.memmap(self.fn, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+    def __len__(self):
+        return self.n_terms
+
+    def term(self, idx):
+        """
+        Returns the encoded term at the store index.
+
+        :rtype : str
+        """
+        return self.blob[self.offsets[idx]:self.offsets[idx + 1]].tostring()
+
+    def indices(self, terms):
+        """
+        Locates terms in the store.
+
+        :param terms:
+        :type terms: list|tuple
+        :rtype : numpy.ndarray
+        :return: Store indices for the terms with -1 for terms not in the store.
+        """
+        encoded = [encode_term(term) for term in terms]
+        hashes = term_hashes(encoded)
+        result = numpy.empty(len(encoded), dtype=numpy.int64)
+        result.fill(-1)
+
+        if self.n_terms == 0 or not encoded:
+            return result
+
+        idx = numpy.searchsorted(self.hashes, hashes)
+        candidates = numpy.flatnonzero(idx < self.n_terms)
+        candidates = candidates[self.hashes[idx[candidates]] == hashes[candidates]]
+
+        # runs of identical hashes are collisions and rare, leave them to the scan below
+        last = self.n_terms - 1
+        collided = self.hashes[numpy.minimum(idx[candidates] + 1, last)] == hashes[candidates]
+        collided &= idx[candidates] < last
+        unique = candidates[~collided]
+
+        # verify the term bytes with numpy, first the lengths and then the bytes of the length matches
+        starts = self.offsets[idx[unique]].astype(numpy.int64)
+        lengths = self.offsets[idx[unique] + 1].astype(numpy.int64) - starts
+        query_lengths = numpy.fromiter((len(encoded[i]) for i in unique.tolist()), dtype=numpy.int64,
+                                       count=len(unique))
+        matching = lengths == query_lengths
+        unique, starts, lengths = unique[matching], starts[matching], lengths[matching]
+
+        query = numpy.frombuffer(''.join(encoded[i] for i in unique.tolist()), dtype=numpy.uint8)
+        query_starts = numpy.cumsum(lengths) - lengths
+        segments = numpy.repeat(numpy.arange(len(unique)), lengths)
+        stored = self.blob[numpy.repeat(starts - query_starts, lengths) + numpy.arange(len(query))]
+        mismatches = numpy.bincount(segments, weights=stored != query, minlength=len(unique))
+        verified = unique[mismatches == 0]
+        result[verified] = idx[verified]
+
+        for i in candidates[collided].tolist():
+            j = int(idx[i])
+
+            while j < self.n_terms and self.hashes[j] == hashes[i]:
+                if self.term(j) == encoded[i]:
+                    result[i] = j
+                    break
+
+                j += 1
+
+        return result
+
+    def iteritems(self):
+        """
+        Iterates over all the terms and weights in the store.
+
+        :rtype : generator
+        """
+        for i in xrange(self.n_terms):
+            yield self.term(i).decode('utf-8'), float(self.weights[i])
+
+
+class WeightStoreProvider(ArrayTermWeightProvider):
+    """
+    Term weight provider serving weights from a memory mapped weight store file. Takes the same options as
+    SimpleTermWeightProvider. Ids for weight_array_for_ids are store indices.
+    """
+
+    def __init__(self, store, **kwargs):
+        """
+        :param store: Weight store or weight store file name.
+        :type store: WeightStore|str|unicode
+        """
+        super(WeightStoreProvider, self).__init__(**kwargs)
+
+        if isinstance(store, (str, unicode)):
+            if not os.path.exists(store):
+                raise ValueError('No weight store at %s ...' % store)
+
+            store = WeightStore(store)
+
+        self.store = store
+        self.weights = store.weights
+
+    def _term_indices(self, terms):
+        return self.store.indices(terms)
@@ -0,0 +1,279 @@
+from itertools import count
+import json
+from zlib import crc32
+
+"""
+Minimal in-memory stand in for the Elasticsearch client, for unit testing code that doesn't depend on
+Elasticsearch analysis or scoring.
+"""
+
+
+class MockTransport(object):
+    """
+    Handles the index level requests issued through IndicesClient.
+    """
+    def __init__(self, es):
+        self.es = es
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        parts = url.strip('/').split('/')
+        index = parts[0]
+        endpoint = parts[1] if len(parts) > 1 else None
+
+        if endpoint == '_settings':
+            settings = self.es.settings.setdefault(index, {})
+
+            if method == 'PUT':
+                settings.update(('index.%s' % key, val) for key, val in body['index'].items())
+                self.es.settings_history.append((index, dict(body['index'])))
+                return {'acknowledged': True}
+
+            return {index: {'settings': dict(settings)}}
+        if endpoint == '_refresh':
+            self.es.refreshed.append(index)
+            return {}
+        if method == 'HEAD':
+            return index in self.es.indices
+        if method == 'PUT':
+            self.es.indices.setdefault(index, {})
+            return {'acknowledged': True}
+        if method == 'DELETE':
+            self.es.indices.pop(index, None)
+            return {'acknowledged': True}
+
+        return {}
+
+
+class MockElasticsearch(object):
+    """
+    Stores documents by index and id and records the requests made.
+
+    Set reject_bulk to make the next bulk requests reject all documents with status 429.
+    """
+    def __init__(self):
+        self.indices = {}
+        self.settings = {}
+        self.settings_history = []
+        self.refreshed = []
+        self.requests = []
+        self.reject_bulk = 0
+        self.scrolls = {}
+        # unique scroll ids for concurrent scrolls from several threads
+        self._scroll_ids = count()
+        self.transport = MockTransport(self)
+
+    def bulk(self, body, index=None, doc_type=None, **kwargs):
+        if isinstance(body, basestring):
+            body = [json.loads(line) for line in body.splitlines() if line.strip()]
+
+        self.requests.append(('bulk', len(body) / 2))
+
+        items = []
+
+        for action, source in zip(body[::2], body[1::2]):
+            op_type, meta = action.items()[0]
+
+            if self.reject_bulk:
+                items.append({op_type: {'status': 429, 'error': 'rejected'}})
+                continue
+
+            docs = self.indices.setdefault(meta.get('_index', index), {})
+            doc_id = meta.get('_id', str(len(docs)))
+
+            if op_type == 'update':
+                if doc_id not in docs:
+                    items.append({op_type: {'_id': doc_id, 'status': 404, 'error': 'document_missing_exception'}})
+                    continue
+
+                docs[doc_id] = dict(docs[doc_id], **source['doc'])
+                items.append({op_type: {'_id': doc_id, 'status': 200}})
+            else:
+                docs[doc_id] = source
+                items.append({op_type: {'_id': doc_id, 'status': 201}})
+
+        if self.reject_bulk:
+            self.reject_bulk -= 1
+
+        return {'errors': False, 'items': items}
+
+    def _field_terms(self, index, field):
+        """
+        Simple whitespace analysis of the field in each document.
+        """
+        for doc in self.indices.get(index, {}).values():
+            yield set(unicode(doc.get(field, '')).lower().split())
+
+    def _doc_freqs(self, index, field):
+        df = {}
+
+        for doc_terms in self._field_terms(index, field):
+            for term in doc_terms:
+                df[term] = df.get(term, 0) + 1
+
+        return df
+
+    def _scroll_page(self, scroll_id):
+        hits, size = self.scrolls[scroll_id]
+        self.scrolls[scroll_id] = (hits[size:], size)
+
+        return {'_scroll_id': scroll_id, '_shards': {'total': 1, 'successful': 1},
+                'hits': {'total': len(hits), 'hits': hits[:size]}}
+
+    def _scroll_search(self, index, body, size):
+        """
+        Scrolled search over the documents ordered by id. Supports slices (by id hash), _source: False or a list
+        of fields and bool must_not exists queries.
+        """
+        body = body or {}
+        slice_ = body.get('slice')
+        must_not = body.get('query', {}).get('bool', {}).get('must_not', {}).get('exists', {}).get('field')
+        hits = []
+
+        for doc_id, doc in sorted(self.indices.get(index, {}).items()):
+            if slice_ and crc32(doc_id) % slice_['max'] != slice_['id']:
+                continue
+
+            if must_not and must_not in doc:
+                continue
+
+            hit = {'_index': index, '_id': doc_id}
+
+            source = body.get('_source', True)
+
+            if isinstance(source, list):
+                hit['_source'] = dict((field, doc[field]) for field in source if field in doc)
+            elif source is not False:
+                hit['_source'] = doc
+
+            hits.append(hit)
+
+        scroll_id = 'scroll_%d' % next(self._scroll_ids)
+        self.requests.append(('scroll', slice_['id'] if slice_ else None))
+        self.scrolls[scroll_id] = (hits, size or 10)
+
+        return self._scroll_page(scroll_id)
+
+    def scroll(self, scroll_id=None, body=None, **kwargs):
+        return self._scroll_page(scroll_id or body['scroll_id'])
+
+    def clear_scroll(self, scroll_id=None, body=None, **kwargs):
+        for scroll_id in ([scroll_id] if scroll_id else body['scroll_id']):
+            self.scrolls.pop(scroll_id, None)
+
+        return {}
+
+    def search(self, index=None, doc_type=None, body=None, scroll=None, size=None, **kwargs):
+        """
+        Supports terms aggregations with exact value or partition includes, composite aggregations over a single
+        terms source and cardinality aggregations, and scrolling, see _scroll_search.
+        """
+        if scroll:
+            return self._scroll_search(index, body, size)
+
+        aggs = (body or {}).get('aggs', {})
+        self.requests.append(('search', aggs))
+
+        resp = {'hits': {'total': len(self.indices.get(index, {})), 'hits': []}, 'aggregations': {}}
+
+        for name, agg in aggs.items():
+            if 'cardinality' in agg:
+                resp['aggregations'][name] = {'value': len(self._doc_freqs(index, agg['cardinality']['field']))}
+            elif 'composite' in agg:
+                composite = agg['composite']
+                field = composite['sources'][0].values()[0]['terms']['field']
+                after = composite.get('after', {}).values()
+                df = sorted(self._doc_freqs(index, field).items())
+
+                if after:
+                    df = [e for e in df if e[0] > after[0]]
+
+                df = df[:composite.get('size', 10)]
+                key_name = composite['sources'][0].keys()[0]
+                resp['aggregations'][name] = {'buckets': [{'key': {key_name: term}, 'doc_count': count}
+                                                          for term, count in df]}
+
+                if df:
+                    resp['aggregations'][name]['after_key'] = {key_name: df[-1][0]}
+            else:
+                terms_agg = agg['terms']
+                include = terms_agg.get('include')
+                df = self._doc_freqs(index, terms_agg['field'])
+
+                if isinstance(include, dict):
+                    df = dict(e for e in df.items()
+                              if crc32(e[0].encode('utf-8')) % include['num_partitions'] == include['partition'])
+                elif include is not None:
+                    df = dict(e for e in df.items() if e[0] in include)
+
+                buckets = sorted(df.items(), key=lambda e: (-e[1], e[0]))[:terms_agg.get('size', 10)]
+                resp['aggregations'][name] = {'buckets': [{'key': term, 'doc_count': count}
+                                                          for term, count in buckets]}
+
+        return resp
+
+    def termvectors(self, index=None, doc_type=None, id=None, fields=None, term_statistics=False,
+                    field_statistics=True, **kwargs):
+        """
+        Term vectors with whitespace analysis, see _field_terms. Term and field statistics are computed over the
+        whole index.
+        """
+        self.requests.append(('termvectors', id))
+
+        docs = self.indices.get(index, {})
+
+        if id not in docs:
+            return {'_id': id, 'found': False}
+
+        term_vectors = {}
+
+        for field in fields:
+            # Elasticsearch leaves out fields the document doesn't have
+            if field not in docs[id]:
+                continue
+
+            tokens = unicode(docs[id].get(field, '')).lower().split()
+            terms = {}
+
+            for token in tokens:
+                terms.setdefault(token, {'term_freq': 0})['term_freq'] += 1
+
+            if term_statistics:
+                df = self._doc_freqs(index, field)
+                ttf = {}
+
+                for doc in docs.values():
+                    for token in unicode(doc.get(field, '')).lower().split():
+                        ttf[token] = ttf.get(token, 0) + 1
+
+                for term, val in terms.items():
+                    val['doc_freq'] = df[term]
+                    val['ttf'] = ttf[term]
+
+            term_vectors[field] = {'terms': terms}
+
+            if field_statistics:
+                field_docs = [unicode(doc.get(field, '')).lower().split() for doc in docs.values()]
+                term_vectors[field]['field_statistics'] = {
+                    'doc_count': sum(1 for tokens in field_docs if tokens),
+                    'sum_doc_freq': sum(len(set(tokens)) for tokens in field_docs),
+                    'sum_ttf': sum(len(tokens) for tokens in field_docs)}
+
+        return {'_id': id, 'found': True, 'term_vectors': term_vectors}
+
+    def mtermvectors(self, index=None, doc_type=None, body=None, **kwargs):
+        params = body.get('parameters', {})
+        self.requests.append(('mtermvectors', len(body['ids'])))
+
+        return {'docs': [self.termvectors(index=index, doc_type=doc_type, id=doc_id, fields=params.get('fields'),
+                                          term_statistics=params.get('term_statistics', False),
+                                          field_statistics=params.get('field_statistics', True))
+                         for doc_id in body['ids']]}
+
+    def mget(self, body, index=None, doc_type=None, **kwargs):
+        self.requests.append(('mget', len(body['ids'])))
+
+        docs = self.indices.get(index, {})
+
+        return {'docs': [{'_id': doc_id, 'found': True, '_source': docs[doc_id]} if doc_id in docs
+                         else {'_id': doc_id, 'found': False}
+                         for doc_id in body['ids']]}
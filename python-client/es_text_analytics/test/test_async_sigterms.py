@@ -0,0 +1,73 @@
+from threading import Event
+from unittest import TestCase
+
+from es_text_analytics.async_sigterms import AsyncSingleDocSigTerms, AsyncTermWeightProvider
+from es_text_analytics.single_doc_sigterms import SingleDocSigTerms
+from es_text_analytics.term_weight_provider import SimpleTermWeightProvider, ESTermAggregationWeightProvider
+from es_text_analytics.test.mock_es import MockElasticsearch
+
+
+class TestAsyncSingleDocSigTerms(TestCase):
+    def setUp(self):
+        super(TestAsyncSingleDocSigTerms, self).setUp()
+
+        self.es = MockElasticsearch()
+        self.es.indices['test'] = {'doc_%d' % i: {'text': text} for i, text in
+                                   enumerate(['foo ba knark foo knirk knark foo', 'ba ba foo', 'knirk knark',
+                                              'foo notfound'])}
+        self.provider = SimpleTermWeightProvider([('foo', 6), ('knark', 1), ('ba', 4), ('knirk', 1)],
+                                                 inverse=True, missing='ignore')
+        self.sigterms = SingleDocSigTerms(self.es, 'test', 'doc', 'text', self.provider)
+        self.doc_ids = sorted(self.es.indices['test'])
+
+    def test_by_doc_id_async(self):
+        async_sigterms = AsyncSingleDocSigTerms(self.sigterms, n_threads=4)
+        done = Event()
+        results = []
+
+        def callback(result):
+            results.append(result)
+            done.set()
+
+        result = async_sigterms.by_doc_id_async('doc_0', n=2, callback=callback)
+        self.assertEqual(self.sigterms.by_doc_id('doc_0', n=2), result.get(5))
+        self.assertTrue(result.ready())
+        done.wait(5)
+        self.assertEqual([self.sigterms.by_doc_id('doc_0', n=2)], results)
+
+        self.assertEqual(self.sigterms.by_doc_id_idf('doc_0', n=3),
+                         async_sigterms.by_doc_id_idf_async('doc_0', n=3).get(5))
+
+        async_sigterms.close()
+
+    def test_imap_by_doc_id(self):
+        async_sigterms = AsyncSingleDocSigTerms(self.sigterms, n_threads=2, n_weight_threads=1)
+
+        self.assertEqual([self.sigterms.by_doc_id(doc_id, n=2) for doc_id in self.doc_ids * 5],
+                         list(async_sigterms.imap_by_doc_id(self.doc_ids * 5, n=2, window=3)))
+        self.assertEqual([self.sigterms.by_doc_id_idf(doc_id) for doc_id in self.doc_ids],
+                         list(async_sigterms.imap_by_doc_id(self.doc_ids, idf=True)))
+
+        async_sigterms.close()
+
+    def test_errors(self):
+        self.sigterms.term_weight_provider = SimpleTermWeightProvider([('foo', 6)])
+        async_sigterms = AsyncSingleDocSigTerms(self.sigterms, n_threads=2)
+
+        self.assertRaises(KeyError, async_sigterms.by_doc_id_async('doc_0').get, 5)
+
+        async_sigterms.close()
+
+
+class TestAsyncTermWeightProvider(TestCase):
+    def test_weight_array_async(self):
+        es = MockElasticsearch()
+        es.indices['test'] = {'1': {'text': 'foo ba'}, '2': {'text': 'ba'}}
+        provider = ESTermAggregationWeightProvider(es, 'test', 'doc', 'text', inverse=True, missing='ignore')
+        async_provider = AsyncTermWeightProvider(provider, n_threads=4)
+
+        results = [async_provider.getitem_async(['ba', 'foo', 'notfound']) for _ in range(10)]
+        self.assertEqual([[('ba', 1.), ('foo', 2.)]] * 10, [result.get(5) for result in results])
+        self.assertEqual([1., 2.], async_provider.weight_array_async(['ba', 'foo']).get(5).tolist())
+
+        async_provider.close()
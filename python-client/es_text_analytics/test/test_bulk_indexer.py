@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+from es_text_analytics.bulk_indexer import BulkIndexer
+from es_text_analytics.test.mock_es import MockElasticsearch
+
+
+class TestBulkIndexer(TestCase):
+    def actions(self, n):
+        return (({'index': {'_index': 'test', '_type': 'doc', '_id': str(i)}}, {'text': u'doc %d' % i})
+                for i in xrange(n))
+
+    def test_index(self):
+        es = MockElasticsearch()
+        stats = BulkIndexer(es, 'test', chunk_size=10, n_threads=3).index(self.actions(95))
+
+        self.assertEqual(95, stats['docs'])
+        self.assertEqual(0, stats['failed'])
+        self.assertEqual(10, stats['requests'])
+        self.assertEqual(95, len(es.indices['test']))
+        self.assertEqual({'text': u'doc 42'}, es.indices['test']['42'])
+
+    def test_max_chunk_bytes(self):
+        es = MockElasticsearch()
+        BulkIndexer(es, 'test', chunk_size=100, max_chunk_bytes=200).index(self.actions(10))
+
+        self.assertTrue(all(n <= 2 for _, n in es.requests))
+        self.assertEqual(10, sum(n for _, n in es.requests))
+
+    def test_retry(self):
+        es = MockElasticsearch()
+        es.reject_bulk = 2
+        stats = BulkIndexer(es, 'test', chunk_size=10, n_threads=1, initial_backoff=0).index(self.actions(10))
+
+        self.assertEqual(10, stats['docs'])
+        self.assertEqual(20, stats['retries'])
+        self.assertEqual(10, len(es.indices['test']))
+
+        es = MockElasticsearch()
+        es.reject_bulk = 5
+        stats = BulkIndexer(es, 'test', chunk_size=10, n_threads=1, initial_backoff=0,
+                            max_retries=2).index(self.actions(10))
+
+        self.assertEqual(0, stats['docs'])
+        self.assertEqual(10, stats['failed'])
+
+    def test_settings(self):
+        es = MockElasticsearch()
+        es.settings['test'] = {'index.refresh_interval': '5s', 'index.number_of_replicas': '2'}
+        BulkIndexer(es, 'test').index(self.actions(1))
+
+        self.assertEqual([('test', {'refresh_interval': '-1', 'number_of_replicas': 0}),
+                          ('test', {'refresh_interval': '5s', 'number_of_replicas': '2'})],
+                         es.settings_history)
+        self.assertEqual(['test'], es.refreshed)
@@ -0,0 +1,174 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from es_text_analytics.sigterms_job import SigTermsJob
+from es_text_analytics.single_doc_sigterms import SingleDocSigTerms
+from es_text_analytics.term_weight_provider import SimpleTermWeightProvider
+from es_text_analytics.test.mock_es import MockElasticsearch
+
+
+def simple_provider():
+    return SimpleTermWeightProvider([('foo', 6), ('knark', 1), ('ba', 4), ('knirk', 1)],
+                                    inverse=True, missing='ignore')
+
+
+def ttf_provider():
+    return SimpleTermWeightProvider([('foo', 4), ('knark', 3), ('ba', 3), ('knirk', 2), ('notfound', 1)],
+                                    missing='ignore')
+
+
+class FailingElasticsearch(MockElasticsearch):
+    """
+    Fails the mtermvectors requests after the first fail_after requests.
+    """
+    def __init__(self, fail_after):
+        super(FailingElasticsearch, self).__init__()
+
+        self.fail_after = fail_after
+
+    def mtermvectors(self, **kwargs):
+        if self.fail_after <= 0:
+            raise RuntimeError('mtermvectors failed')
+
+        self.fail_after -= 1
+
+        return super(FailingElasticsearch, self).mtermvectors(**kwargs)
+
+
+class FailingBulkElasticsearch(MockElasticsearch):
+    """
+    Fails the next fail_bulk bulk requests.
+    """
+    def __init__(self, fail_bulk):
+        super(FailingBulkElasticsearch, self).__init__()
+
+        self.fail_bulk = fail_bulk
+
+    def bulk(self, body, index=None, doc_type=None, **kwargs):
+        if self.fail_bulk > 0:
+            self.fail_bulk -= 1
+            raise RuntimeError('bulk failed')
+
+        return super(FailingBulkElasticsearch, self).bulk(body, index=index, doc_type=doc_type, **kwargs)
+
+
+class TestSigTermsJob(TestCase):
+    def setUp(self):
+        super(TestSigTermsJob, self).setUp()
+
+        self.texts = ['foo ba knark foo knirk knark foo', 'ba ba foo', 'knirk knark', 'foo notfound']
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestSigTermsJob, self).tearDown()
+
+        shutil.rmtree(self.tmp_dir)
+
+    def index(self, es):
+        es.indices['test'] = {'doc_%d' % i: {'text': text} for i, text in enumerate(self.texts * 10)}
+
+        return es
+
+    def expected(self, es, provider=None):
+        sigterms = SingleDocSigTerms(es, 'test', 'doc', 'text', provider)
+        by_doc_id = sigterms.by_doc_id if provider else sigterms.by_doc_id_idf
+
+        return {doc_id: [{'term': term, 'score': score} for term, score in by_doc_id(doc_id, n=2)]
+                for doc_id in es.indices['test']}
+
+    def test_run(self):
+        es = self.index(MockElasticsearch())
+        expected = self.expected(es, simple_provider())
+        job = SigTermsJob(None, 'test', 'doc', 'text', n=2, provider_factory=simple_provider, n_workers=1, n_slices=3,
+                          scroll_size=4, chunk_size=3, es_factory=lambda: es)
+
+        stats = job.run()
+        self.assertEqual(40, stats['docs'])
+        self.assertEqual(3, stats['slices'])
+        self.assertEqual(0, stats['failed'])
+        self.assertEqual(expected, {doc_id: doc['sig_terms'] for doc_id, doc in es.indices['test'].items()})
+        self.assertEqual([0, 1, 2], sorted(req[1] for req in es.requests if req[0] == 'scroll'))
+
+        idf_expected = self.expected(es)
+        SigTermsJob(None, 'test', 'doc', 'text', n=2, target_field='idf_terms', n_workers=1, n_slices=1,
+                    es_factory=lambda: es).run()
+        self.assertEqual(idf_expected, {doc_id: doc['idf_terms'] for doc_id, doc in es.indices['test'].items()})
+
+        SigTermsJob(None, 'test', 'doc', 'text', n=2, target_field='cached_terms', n_workers=1, n_slices=1,
+                    stats_cache_size=100, es_factory=lambda: es).run()
+        self.assertEqual(idf_expected, {doc_id: doc['cached_terms'] for doc_id, doc in es.indices['test'].items()})
+
+        sigterms = SingleDocSigTerms(es, 'test', 'doc', 'text', None, ttf_provider=ttf_provider())
+        ttf_expected = {doc_id: [{'term': term, 'score': score} for term, score in sigterms.by_doc_id_idf(doc_id, n=2)]
+                        for doc_id in es.indices['test']}
+        SigTermsJob(None, 'test', 'doc', 'text', n=2, target_field='ttf_terms', n_workers=1, n_slices=1,
+                    ttf_provider_factory=ttf_provider, es_factory=lambda: es).run()
+        self.assertEqual(ttf_expected, {doc_id: doc['ttf_terms'] for doc_id, doc in es.indices['test'].items()})
+
+    def test_resume(self):
+        checkpoint_fn = os.path.join(self.tmp_dir, 'job.ckpt')
+        es = self.index(FailingElasticsearch(fail_after=1))
+        job = SigTermsJob(None, 'test', 'doc', 'text', n=2, provider_factory=simple_provider, n_workers=1, n_slices=4,
+                          chunk_size=20, checkpoint_fn=checkpoint_fn, es_factory=lambda: es)
+
+        self.assertRaises(RuntimeError, job.run)
+        self.assertTrue(os.path.exists(checkpoint_fn))
+        annotated = sum(1 for doc in es.indices['test'].values() if 'sig_terms' in doc)
+        self.assertGreater(annotated, 0)
+        self.assertLess(annotated, 40)
+
+        es.fail_after = 100
+        stats = job.run()
+        self.assertEqual(3, stats['slices'])
+        self.assertEqual(40, annotated + stats['docs'])
+        self.assertTrue(all('sig_terms' in doc for doc in es.indices['test'].values()))
+
+        self.assertRaises(ValueError, SigTermsJob(None, 'test', 'doc', 'text', provider_factory=simple_provider,
+                                                  n_slices=2, checkpoint_fn=checkpoint_fn).run)
+
+    def test_failed_slices(self):
+        checkpoint_fn = os.path.join(self.tmp_dir, 'job.ckpt')
+        es = self.index(FailingBulkElasticsearch(fail_bulk=1))
+        job = SigTermsJob(None, 'test', 'doc', 'text', n=2, provider_factory=simple_provider, n_workers=1, n_slices=2,
+                          bulk_size=100, checkpoint_fn=checkpoint_fn, es_factory=lambda: es)
+
+        # the slice with the failed bulk request is rerun
+        stats = job.run()
+        self.assertEqual(40, stats['docs'])
+        self.assertEqual(0, stats['failed'])
+        self.assertEqual(2, stats['slices'])
+        self.assertEqual(2, sum(1 for req in es.requests if req[0] == 'bulk'))
+        self.assertEqual(0, es.fail_bulk)
+
+        # slices still failing are not completed and are rerun by the next run
+        os.remove(checkpoint_fn)
+        es.fail_bulk = 3
+        stats = job.run()
+        self.assertEqual(1, stats['failed_slices'])
+        self.assertEqual(2, stats['slices'])
+        self.assertGreater(stats['failed'], 0)
+
+        stats = job.run()
+        self.assertEqual(1, stats['slices'])
+        self.assertEqual(0, stats['failed_slices'])
+        self.assertEqual(0, stats['failed'])
+
+    def test_slices_with_dfs(self):
+        self.assertEqual(1, SigTermsJob(None, 'test', 'doc', 'text').n_slices)
+        self.assertRaises(ValueError, lambda: SigTermsJob(None, 'test', 'doc', 'text', n_slices=2))
+        self.assertRaises(ValueError, lambda: SigTermsJob(None, 'test', 'doc', 'text', n_slices=2,
+                                                          stats_cache_size=100))
+        self.assertEqual(2, SigTermsJob(None, 'test', 'doc', 'text', n_slices=2, idf=False).n_slices)
+        self.assertEqual(2, SigTermsJob(None, 'test', 'doc', 'text', n_slices=2,
+                                        ttf_provider_factory=ttf_provider).n_slices)
+
+    def test_skip_annotated(self):
+        es = self.index(MockElasticsearch())
+        es.indices['test']['doc_0']['sig_terms'] = []
+        job = SigTermsJob(None, 'test', 'doc', 'text', n_workers=1, n_slices=1, skip_annotated=True,
+                          es_factory=lambda: es)
+
+        self.assertEqual(39, job.run()['docs'])
+        self.assertEqual([], es.indices['test']['doc_0']['sig_terms'])
@@ -2,9 +2,12 @@ from unittest import TestCase
 
 from elasticsearch import Elasticsearch
 from elasticsearch.client import IndicesClient
+from scipy.sparse import csr_matrix
 
-from es_text_analytics.single_doc_sigterms import SingleDocSigTerms
+from es_text_analytics.single_doc_sigterms import SingleDocSigTerms, TermStatisticsCache, top_terms_by_row
+from es_text_analytics.term_weight_provider import SimpleTermWeightProvider
 from es_text_analytics.test import es_runner
+from es_text_analytics.test.mock_es import MockElasticsearch
 
 
 class TestSingleDocSigTerms(TestCase):
@@ -32,3 +35,247 @@ class TestSingleDocSigTerms(TestCase):
         self.assertEquals(2, resp['knark'])
         self.assertEquals(1, resp['ba'])
         self.assertEquals(1, resp['knirk'])
+
+
+class StaticTermVectorsClient(object):
+    """
+    Stand in for the Elasticsearch client returning fixed term vectors.
+    """
+    def __init__(self, field, term_freqs):
+        self.field = field
+        self.term_freqs = term_freqs
+
+    def termvectors(self, **kwargs):
+        return {'found': True,
+                'term_vectors': {self.field: {'terms': {term: {'term_freq': freq}
+                                                        for term, freq in self.term_freqs.items()}}}}
+
+
+class TestSingleDocSigTermsWeighting(TestCase):
+    def test_by_doc_id(self):
+        es = StaticTermVectorsClient('text', {'foo': 3, 'knark': 2, 'ba': 1, 'knirk': 1, 'notfound': 5})
+        provider = SimpleTermWeightProvider([('foo', 6), ('knark', 1), ('ba', 4), ('knirk', 1)],
+                                            inverse=True, missing='ignore')
+        sigterms = SingleDocSigTerms(es, 'index', 'doc', 'text', provider)
+
+        resp = sigterms.by_doc_id('doc_1', n=2)
+        self.assertEqual(['knark', 'knirk'], [term for term, _ in resp])
+        self.assertAlmostEqual(24., resp[0][1], places=4)
+        self.assertAlmostEqual(12., resp[1][1], places=4)
+
+
+class TestBatchSigTerms(TestCase):
+    def setUp(self):
+        super(TestBatchSigTerms, self).setUp()
+
+        self.es = MockElasticsearch()
+        self.es.indices['test'] = {'doc_%d' % i: {'text': text} for i, text in
+                                   enumerate(['foo ba knark foo knirk knark foo', 'ba ba foo', 'knirk knark',
+                                              'foo notfound', ''])}
+        self.provider = SimpleTermWeightProvider([('foo', 6), ('knark', 1), ('ba', 4), ('knirk', 1)],
+                                                 inverse=True, missing='ignore')
+        self.doc_ids = sorted(self.es.indices['test'])
+
+    def test_by_doc_ids(self):
+        sigterms = SingleDocSigTerms(self.es, 'test', 'doc', 'text', self.provider)
+
+        expected = [sigterms.by_doc_id(doc_id, n=2) for doc_id in self.doc_ids] + [None]
+        del self.es.requests[:]
+
+        self.assertEqual(expected, sigterms.by_doc_ids(self.doc_ids + ['missing'], n=2, chunk_size=4))
+        self.assertEqual([('mtermvectors', 4), ('mtermvectors', 2)],
+                         [req for req in self.es.requests if req[0] == 'mtermvectors'])
+
+        sigterms.term_weight_provider = None
+        self.assertEqual([sigterms.by_doc_id(doc_id, n=2) for doc_id in self.doc_ids],
+                         sigterms.by_doc_ids(self.doc_ids, n=2))
+
+    def test_missing_field(self):
+        self.es.indices['test']['no_text'] = {'title': 'foo'}
+        doc_ids = ['doc_0', 'no_text', 'missing']
+        sigterms = SingleDocSigTerms(self.es, 'test', 'doc', 'text', self.provider)
+
+        self.assertEqual([], sigterms.by_doc_id('no_text'))
+        self.assertEqual([], sigterms.by_doc_id_idf('no_text'))
+        self.assertEqual([sigterms.by_doc_id('doc_0'), [], None], sigterms.by_doc_ids(doc_ids))
+        self.assertEqual([sigterms.by_doc_id_idf('doc_0'), [], None], sigterms.by_doc_ids_idf(doc_ids))
+
+        sigterms.term_weight_provider = None
+        self.assertEqual([sigterms.by_doc_id('doc_0'), [], None], sigterms.by_doc_ids(doc_ids))
+
+        sigterms.stats_cache = TermStatisticsCache()
+        self.assertEqual([], sigterms.by_doc_id_idf('no_text'))
+        self.assertEqual([sigterms.by_doc_id_idf('doc_0'), [], None], sigterms.by_doc_ids_idf(doc_ids))
+
+    def test_by_doc_ids_idf(self):
+        sigterms = SingleDocSigTerms(self.es, 'test', 'doc', 'text', None)
+
+        self.assertEqual([sigterms.by_doc_id_idf(doc_id, n=3) for doc_id in self.doc_ids[:4]] + [None],
+                         sigterms.by_doc_ids_idf(self.doc_ids[:4] + ['missing'], n=3, chunk_size=2))
+        self.assertEqual([('doc_0', sigterms.by_doc_id_idf('doc_0', n=1))],
+                         list(sigterms.iter_by_doc_ids(['doc_0'], n=1, idf=True)))
+
+        # the statistics are requested for the whole index and not per shard
+        mtermvectors = self.es.mtermvectors
+        params = []
+        self.es.mtermvectors = lambda **kwargs: params.append(kwargs['body']['parameters']) or mtermvectors(**kwargs)
+        sigterms.by_doc_ids_idf(self.doc_ids[:1])
+        self.assertTrue(params[0]['dfs'])
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCachedTermStatistics(TestCase):
+    def setUp(self):
+        super(TestCachedTermStatistics, self).setUp()
+
+        self.es = MockElasticsearch()
+        self.es.indices['test'] = {'doc_%d' % i: {'text': text} for i, text in
+                                   enumerate(['foo ba knark foo knirk knark foo', 'ba ba foo', 'knirk knark',
+                                              'foo notfound'])}
+        self.doc_ids = sorted(self.es.indices['test'])
+        self.expected = [SingleDocSigTerms(self.es, 'test', 'doc', 'text', None).by_doc_id_idf(doc_id)
+                         for doc_id in self.doc_ids]
+
+    def stats_requests(self):
+        return [req for req in self.es.requests if req[0] == 'termvectors']
+
+    def record_mtermvectors(self):
+        """
+        Records the number of documents and whether term statistics are requested for each mtermvectors request.
+        """
+        mtermvectors = self.es.mtermvectors
+        requests = []
+
+        def record(**kwargs):
+            requests.append((len(kwargs['body']['ids']), kwargs['body']['parameters'].get('term_statistics', False)))
+            return mtermvectors(**kwargs)
+
+        self.es.mtermvectors = record
+
+        return requests
+
+    def test_stats_cache(self):
+        clock = Clock()
+        cache = TermStatisticsCache(ttl=10, clock=clock)
+        sigterms = SingleDocSigTerms(self.es, 'test', 'doc', 'text', None, stats_cache=cache)
+        del self.es.requests[:]
+
+        self.assertEqual(self.expected, [sigterms.by_doc_id_idf(doc_id) for doc_id in self.doc_ids])
+        # the statistics are requested right away for doc_0 as nothing is cached, doc_1 and doc_2 only have terms
+        # from doc_0 so their statistics are cached, and doc_3 has an uncached term
+        self.assertEqual(5, len(self.stats_requests()))
+        self.assertEqual(self.expected[0], sigterms.by_doc_id_idf('doc_0'))
+        self.assertEqual(6, len(self.stats_requests()))
+        self.assertIsNone(sigterms.by_doc_id_idf('missing'))
+
+        clock.now = 10
+        self.assertIsNone(cache.field_statistics('test', 'text'))
+        self.assertEqual({}, cache.ttfs('test', 'text', ['foo']))
+        del self.es.requests[:]
+        self.assertEqual(self.expected[0], sigterms.by_doc_id_idf('doc_0'))
+        self.assertEqual(1, len(self.stats_requests()))
+
+    def test_batch_stats_cache(self):
+        sigterms = SingleDocSigTerms(self.es, 'test', 'doc', 'text', None, stats_cache=TermStatisticsCache())
+        requests = self.record_mtermvectors()
+
+        self.assertEqual(self.expected[:3] + [None], sigterms.by_doc_ids_idf(self.doc_ids[:3] + ['missing']))
+        self.assertEqual([(4, True)], requests)
+
+        # only doc_3 has an uncached term and is requested again with statistics
+        del requests[:]
+        self.assertEqual(self.expected, sigterms.by_doc_ids_idf(self.doc_ids))
+        self.assertEqual([(4, False), (1, True)], requests)
+
+    def test_stats_cache_eviction(self):
+        cache = TermStatisticsCache(max_terms=2)
+        cache.update('test', 'text', {'sum_ttf': 10}, {'foo': 1, 'ba': 2})
+        cache.update('test', 'text', {'sum_ttf': 10}, {'knark': 3})
+
+        self.assertEqual({'knark': 3}, cache.ttfs('test', 'text', ['foo', 'knark']))
+        self.assertEqual({'sum_ttf': 10}, cache.field_statistics('test', 'text'))
+        self.assertEqual({}, cache.ttfs('other', 'text', ['knark']))
+
+    def test_ttf_provider(self):
+        term_counts = [('foo', 5), ('ba', 3), ('knark', 3), ('knirk', 2), ('notfound', 1)]
+        sigterms = SingleDocSigTerms(self.es, 'test', 'doc', 'text', None,
+                                     ttf_provider=SimpleTermWeightProvider(term_counts))
+
+        for expected, result in zip(self.expected, [sigterms.by_doc_id_idf(doc_id) for doc_id in self.doc_ids]):
+            self.assertEqual([term for term, _ in expected], [term for term, _ in result])
+
+            for (_, expected_score), (_, score) in zip(expected, result):
+                self.assertAlmostEqual(expected_score, score, places=5)
+
+        requests = self.record_mtermvectors()
+        self.assertEqual([sigterms.by_doc_id_idf(doc_id) for doc_id in self.doc_ids] + [None],
+                         sigterms.by_doc_ids_idf(self.doc_ids + ['missing'], chunk_size=3))
+        self.assertEqual([(3, False), (2, False)], requests)
+
+
+class TestTopTermsByRow(TestCase):
+    def setUp(self):
+        super(TestTopTermsByRow, self).setUp()
+
+        self.texts = ['foo ba knark foo knirk knark foo', 'ba ba foo', '', 'knirk knark', 'foo notfound']
+        self.vocabulary = ['ba', 'foo', 'knark', 'knirk', 'notfound']
+        self.X = csr_matrix([[text.split().count(term) for term in self.vocabulary] for text in self.texts])
+
+    def assertTopTerms(self, expected, ids, scores):
+        for expected_terms, row_ids, row_scores in zip(expected, ids, scores):
+            self.assertEqual(len(expected_terms), sum(row_ids >= 0))
+            row_scores = [score for score in row_scores.tolist() if score == score]
+
+            for expected_score, score in zip(sorted(score for _, score in expected_terms)[::-1], row_scores):
+                self.assertAlmostEqual(expected_score, score)
+
+            for term_id, score in zip(row_ids, row_scores):
+                if term_id >= 0:
+                    self.assertAlmostEqual(dict(expected_terms)[self.vocabulary[term_id]], score)
+
+    def test_idf_ratio(self):
+        es = MockElasticsearch()
+        es.indices['test'] = {'doc_%d' % i: {'text': text} for i, text in enumerate(self.texts)}
+        sigterms = SingleDocSigTerms(es, 'test', 'doc', 'text', None)
+        expected = [sigterms.by_doc_id_idf('doc_%d' % i, n=2) for i in range(len(self.texts))]
+
+        ids, scores = top_terms_by_row(self.X, n=2, chunk_size=2)
+        self.assertEqual((5, 2), ids.shape)
+        self.assertEqual([-1, -1], ids[2].tolist())
+        self.assertTopTerms(expected, ids, scores)
+
+        ids, scores = top_terms_by_row(self.X.toarray(), n=10)
+        self.assertEqual((5, 10), ids.shape)
+        self.assertTopTerms([sigterms.by_doc_id_idf('doc_%d' % i, n=10) for i in range(len(self.texts))],
+                            ids, scores)
+
+    def test_provider_weights(self):
+        provider = SimpleTermWeightProvider([('foo', 6), ('knark', 1), ('ba', 4), ('knirk', 1)],
+                                            inverse=True, missing='ignore')
+        sigterms = SingleDocSigTerms(None, 'test', 'doc', 'text', provider)
+        expected = []
+
+        for text in self.texts:
+            tokens = text.split()
+            expected.append(sigterms.top_terms([(term, tokens.count(term) / float(len(tokens)))
+                                                for term in set(tokens)], n=3))
+
+        ids, scores = top_terms_by_row(self.X, weights=provider.weight_array(self.vocabulary), n=3, chunk_size=3)
+        self.assertTopTerms(expected, ids, scores)
+
+    def test_uneven_rows(self):
+        # one long row among short ones
+        X = csr_matrix([[1, 2, 3, 4, 5, 6, 7, 8], [0, 0, 2, 0, 0, 0, 0, 1], [0] * 8, [0, 3, 0, 0, 0, 0, 0, 0]])
+        weights = [1., 1., 1., 1., 1., 1., 1., float('nan')]
+
+        ids, scores = top_terms_by_row(X, weights=weights, n=3, chunk_size=3)
+        self.assertEqual([[6, 5, 4], [2, -1, -1], [-1, -1, -1], [1, -1, -1]], ids.tolist())
+        self.assertAlmostEqual(7 / 36., scores[0, 0])
+        self.assertAlmostEqual(1., scores[3, 0])
@@ -0,0 +1,107 @@
+from unittest import TestCase
+
+from gensim.corpora import Dictionary
+
+from es_text_analytics.term_weight_cache import CachingTermWeightProvider
+from es_text_analytics.term_weight_provider import SimpleTermWeightProvider, GensimIDFProvider
+
+
+class CountingTermWeightProvider(SimpleTermWeightProvider):
+    """
+    Records the term batches requested from the provider.
+    """
+    def __init__(self, *args, **kwargs):
+        super(CountingTermWeightProvider, self).__init__(*args, **kwargs)
+
+        self.requests = []
+
+    def _weights_for_terms(self, terms):
+        self.requests.append(list(terms))
+
+        return super(CountingTermWeightProvider, self)._weights_for_terms(terms)
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCachingTermWeightProvider(TestCase):
+    def setUp(self):
+        super(TestCachingTermWeightProvider, self).setUp()
+
+        self.term_counts = [('ba', 4), ('foo', 1), ('knark', 2), ('knirk', 1)]
+
+    def test_getitem(self):
+        provider = CountingTermWeightProvider(self.term_counts, inverse=True, missing='ignore')
+        cached = CachingTermWeightProvider(provider)
+
+        self.assertEqual(provider['ba', 'knark', 'notfound'], cached['ba', 'knark', 'notfound'])
+        self.assertEqual([['ba', 'knark', 'notfound']], provider.requests)
+
+        # only the uncached term is requested
+        self.assertEqual([('ba', 2.), ('foo', 8.), ('ba', 2.)], cached['ba', 'foo', 'notfound', 'ba'])
+        self.assertEqual([['ba', 'knark', 'notfound'], ['foo']], provider.requests)
+
+        info = cached.cache_info()
+        self.assertEqual(4, info['misses'])
+        self.assertEqual(2, info['hits'])
+        self.assertEqual(1, info['negative_hits'])
+        self.assertEqual(4, info['size'])
+
+    def test_provider_transforms(self):
+        # 'a' occurs in every document and has 0 IDF, which GensimIDFProvider clips for the transforms
+        dictionary = Dictionary([['a', 'b'], ['a', 'c'], ['a']])
+
+        for kwargs in ({'inverse': True}, {'sublinear': True}):
+            provider = GensimIDFProvider(dictionary, **kwargs)
+            cache = CachingTermWeightProvider(provider)
+
+            self.assertEqual(provider.weight_array(['a', 'b']).tolist(), cache.weight_array(['a', 'b']).tolist())
+            # and again from the cache
+            self.assertEqual(provider.weight_array(['a', 'b']).tolist(), cache.weight_array(['a', 'b']).tolist())
+
+    def test_missing_policy(self):
+        cached = CachingTermWeightProvider(CountingTermWeightProvider(self.term_counts))
+
+        self.assertRaises(KeyError, lambda: cached['notfound'])
+        self.assertRaises(KeyError, lambda: cached['notfound'])
+        self.assertEqual(1, cached.cache_info()['negative_hits'])
+
+    def test_lru(self):
+        provider = CountingTermWeightProvider(self.term_counts)
+        cached = CachingTermWeightProvider(provider, max_size=2)
+
+        cached['ba', 'foo']
+        cached['ba']
+        cached['knark']
+        self.assertEqual(1, cached.cache_info()['evictions'])
+
+        # foo was least recently used and evicted
+        cached['ba', 'foo']
+        self.assertEqual(['foo'], provider.requests[-1])
+
+    def test_ttl(self):
+        clock = Clock()
+        provider = CountingTermWeightProvider(self.term_counts, missing='ignore')
+        cached = CachingTermWeightProvider(provider, ttl=10, negative_ttl=100, clock=clock)
+
+        cached['ba', 'notfound']
+        clock.now = 5
+        cached['ba', 'notfound']
+        self.assertEqual(1, len(provider.requests))
+
+        clock.now = 20
+        cached['ba', 'notfound']
+        self.assertEqual(['ba'], provider.requests[-1])
+        self.assertEqual(1, cached.cache_info()['expirations'])
+
+        clock.now = 200
+        cached['ba', 'notfound']
+        self.assertEqual(['ba', 'notfound'], provider.requests[-1])
+
+        cached.clear()
+        self.assertEqual(0, cached.cache_info()['size'])
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from gensim.corpora import Dictionary
+
+from es_text_analytics.term_weight_incremental import TermStatistics, IncrementalTermWeightProvider
+from es_text_analytics.term_weight_provider import SimpleTermWeightProvider
+
+
+class TestTermStatistics(TestCase):
+    def setUp(self):
+        super(TestTermStatistics, self).setUp()
+
+        self.docs = [['ba', 'foo', 'ba'], ['ba', 'knark'], ['knark', u'b\xe6']]
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestTermStatistics, self).tearDown()
+
+        shutil.rmtree(self.tmp_dir)
+
+    def test_add_remove(self):
+        stats = TermStatistics().add_documents(self.docs[:2])
+        stats.add_documents(self.docs[2:])
+
+        self.assertEqual(3, stats.n_doc)
+        self.assertEqual(7, stats.n_tokens)
+        self.assertEqual([2, 1, 2, 1, 0], stats.doc_freqs(['ba', 'foo', 'knark', u'b\xe6', 'notfound']).tolist())
+
+        stats.remove_documents(self.docs[:1])
+
+        self.assertEqual(2, stats.n_doc)
+        self.assertEqual(4, stats.n_tokens)
+        self.assertEqual([1, 0, 2, 1], stats.doc_freqs(['ba', 'foo', 'knark', u'b\xe6']).tolist())
+
+    def test_growth(self):
+        stats = TermStatistics().add_documents([['t%d' % i for i in range(3000)]])
+
+        self.assertEqual(3000, len(stats))
+        self.assertEqual([1, 1], stats.doc_freqs(['t0', 't2999']).tolist())
+
+    def test_journal(self):
+        fn = os.path.join(self.tmp_dir, 'stats.npz')
+        journal_fn = os.path.join(self.tmp_dir, 'stats.journal')
+        terms = ['ba', 'foo', 'knark', u'b\xe6']
+
+        stats = TermStatistics.load(journal_fn=journal_fn).add_documents(self.docs[:2])
+        stats.compact(fn)
+        stats.add_documents(self.docs[2:])
+        stats.remove_documents(self.docs[:1])
+
+        loaded = TermStatistics.load(fn, journal_fn)
+        self.assertEqual(stats.n_doc, loaded.n_doc)
+        self.assertEqual(stats.n_tokens, loaded.n_tokens)
+        self.assertEqual(stats.doc_freqs(terms).tolist(), loaded.doc_freqs(terms).tolist())
+
+        loaded.add_documents(self.docs[:1])
+        reloaded = TermStatistics.load(fn, journal_fn)
+        self.assertEqual([2, 1, 2, 1], reloaded.doc_freqs(terms).tolist())
+
+        # the snapshot only has the first two documents
+        self.assertEqual([2, 1, 1, 0], TermStatistics.load(fn).doc_freqs(terms).tolist())
+
+    def test_remove_not_added(self):
+        fn = os.path.join(self.tmp_dir, 'stats.journal')
+        stats = TermStatistics(journal_fn=fn).add_documents(self.docs[:1])
+
+        self.assertRaises(ValueError, lambda: stats.remove_documents(self.docs[1:2]))
+        self.assertRaises(ValueError, lambda: stats.remove_documents(self.docs[:1] * 2))
+        self.assertEqual(1, stats.n_doc)
+        self.assertEqual(3, stats.n_tokens)
+        self.assertEqual([2, 1], [stats.cfs[stats.term_ids[term]] for term in ['ba', 'foo']])
+        self.assertEqual([1, 1, 0], stats.doc_freqs(['ba', 'foo', 'knark']).tolist())
+        self.assertEqual(1, TermStatistics.load(journal_fn=fn).n_doc)
+
+    def test_compact_crash(self):
+        fn = os.path.join(self.tmp_dir, 'stats.npz')
+        journal_fn = os.path.join(self.tmp_dir, 'stats.journal')
+        terms = ['ba', 'foo', 'knark', u'b\xe6']
+
+        stats = TermStatistics.load(journal_fn=journal_fn).add_documents(self.docs[:2])
+        # crash after the snapshot is written but before the journal is truncated
+        stats.save(fn)
+        stats.add_documents(self.docs[2:])
+
+        loaded = TermStatistics.load(fn, journal_fn)
+        self.assertEqual(3, loaded.n_doc)
+        self.assertEqual(7, loaded.n_tokens)
+        self.assertEqual([2, 1, 2, 1], loaded.doc_freqs(terms).tolist())
+
+        loaded.compact(fn)
+        loaded.add_documents(self.docs[:1])
+        self.assertEqual([3, 2, 2, 1], TermStatistics.load(fn, journal_fn).doc_freqs(terms).tolist())
+
+    def test_from_dictionary(self):
+        stats = TermStatistics.from_dictionary(Dictionary(self.docs))
+
+        self.assertEqual(3, stats.n_doc)
+        self.assertEqual([2, 1, 2, 1], stats.doc_freqs(['ba', 'foo', 'knark', u'b\xe6']).tolist())
+        self.assertEqual(7, stats.n_tokens)
+        self.assertEqual([3, 1, 2], [stats.cfs[stats.term_ids[term]] for term in ['ba', 'foo', 'knark']])
+
+        dictionary = Dictionary(self.docs)
+        del dictionary.cfs
+        stats = TermStatistics.from_dictionary(dictionary)
+        self.assertEqual(0, stats.n_tokens)
+        self.assertEqual(0, stats.cfs.sum())
+
+    def test_from_dictionary_journal(self):
+        journal_fn = os.path.join(self.tmp_dir, 'stats.journal')
+        terms = ['ba', 'foo', 'knark', u'b\xe6']
+
+        stats = TermStatistics.from_dictionary(Dictionary(self.docs), journal_fn=journal_fn)
+        stats.remove_documents(self.docs[:1])
+
+        loaded = TermStatistics.load(journal_fn=journal_fn)
+        self.assertEqual(2, loaded.n_doc)
+        self.assertEqual(4, loaded.n_tokens)
+        self.assertEqual([1, 0, 2, 1], loaded.doc_freqs(terms).tolist())
+
+        self.assertRaises(ValueError, lambda: TermStatistics.from_dictionary(Dictionary(self.docs),
+                                                                             journal_fn=journal_fn))
+
+
+class TestIncrementalTermWeightProvider(TestCase):
+    def test_weights(self):
+        docs = [['ba', 'foo', 'ba'], ['ba', 'knark'], ['knark', u'b\xe6']]
+        stats = TermStatistics().add_documents(docs)
+        provider = IncrementalTermWeightProvider(stats, inverse=True, missing='ignore')
+
+        self.assertAlmostEqual(1.5, provider['ba'][1], places=5)
+        self.assertEqual(['ba', 'knark'], [term for term, _ in provider['ba', 'notfound', 'knark']])
+
+        stats.add_documents([['ba']])
+        self.assertAlmostEqual(4 / 3., provider['ba'][1], places=5)
+
+        stats.remove_documents(docs[:1])
+        self.assertIsNone(provider['foo'])
+        self.assertAlmostEqual(3 / 2., provider['ba'][1], places=5)
+
+    def test_cf_weights(self):
+        term_counts = [('ba', 3), ('foo', 1), ('knark', 2), (u'b\xe6', 1)]
+        stats = TermStatistics().add_documents([['ba', 'foo', 'ba'], ['ba', 'knark'], ['knark', u'b\xe6']])
+        provider = IncrementalTermWeightProvider(stats, weighting='cf', sublinear=True)
+        expected = SimpleTermWeightProvider(term_counts, sublinear=True)
+
+        terms = [term for term, _ in term_counts]
+
+        for (term, w), (_, expected_w) in zip(provider[terms], expected[terms]):
+            self.assertAlmostEqual(expected_w, w, places=5)
+
+        self.assertRaises(ValueError, lambda: IncrementalTermWeightProvider(stats, weighting='foo'))
@@ -1,13 +1,17 @@
+import cPickle
 from StringIO import StringIO
 from unittest import TestCase
 
+import numpy
 from elasticsearch.client import Elasticsearch, IndicesClient
 from gensim.corpora.dictionary import Dictionary
+from gensim.models import TfidfModel
 
 from es_text_analytics.term_weight_provider import SimpleTermWeightProvider, ESTermAggregationWeightProvider, \
     weight_map_from_term_counts, term_counts_line_parser, term_counts_iter_from_file, GensimIDFProvider, \
-    ESTermIndexWeightingProvider
+    ESTermIndexWeightingProvider, weight_array_from_term_counts, idf_array_from_dictionary, term_doc_id
 from es_text_analytics.test import es_runner
+from es_text_analytics.test.mock_es import MockElasticsearch
 
 
 class TestTermWeightProviderHelpers(TestCase):
@@ -18,6 +22,18 @@ class TestTermWeightProviderHelpers(TestCase):
         wm = sorted(weight_map_from_term_counts([('foo', 2), ('ba', 1), ('knark', 4), ('knirk', 1)], min_count=4).items())
         self.assertEqual(wm, [('knark', .5)])
 
+    def test_weight_array_from_term_counts(self):
+        term_ids, weights = weight_array_from_term_counts([('foo', 2), ('ba', 1), ('knark', 4), ('knirk', 1)])
+        self.assertEqual(numpy.float32, weights.dtype)
+        self.assertEqual(['ba', 'foo', 'knark', 'knirk'], sorted(term_ids.keys()))
+        self.assertEqual([('ba', 0.125), ('foo', 0.25), ('knark', 0.5), ('knirk', 0.125)],
+                         sorted((term, weights[i]) for term, i in term_ids.items()))
+
+        term_ids, weights = weight_array_from_term_counts([('foo', 2), ('ba', 1), ('knark', 4), ('knirk', 1)],
+                                                          min_count=4)
+        self.assertEqual({'knark': 0}, term_ids)
+        self.assertEqual([.5], list(weights))
+
     def test_term_counts_line_parser(self):
         self.assertEqual(('absolutely', 342), term_counts_line_parser('5949\tabsolutely\t342\n'))
         self.assertEqual(('finished', 136), term_counts_line_parser('497\tfinished\t136'))
@@ -129,6 +145,25 @@ class TestSimpleTermWeightProvider(TestCase):
         self.assertEqual([('ba', .5)], list(provider['ba', 'notfound']))
         self.assertIsNone(provider['notfound'])
 
+    def test_weight_array(self):
+        provider = SimpleTermWeightProvider([('ba', 2), ('foo', 1), ('ba', 1), ('knark', 1),
+                                             ('knirk', 1), ('ba', 1), ('knark', 1)])
+
+        numpy.testing.assert_array_almost_equal([.5, .125, .25], provider.weight_array(['ba', 'foo', 'knark']))
+        self.assertRaises(KeyError, lambda: provider.weight_array(['ba', 'notfound']))
+
+        provider = SimpleTermWeightProvider([('ba', 2), ('foo', 1), ('ba', 1), ('knark', 1),
+                                             ('knirk', 1), ('ba', 1), ('knark', 1)],
+                                            inverse=True, sublinear=True, missing='ignore')
+        w = provider.weight_array(iter(['ba', 'notfound', 'knirk']))
+        self.assertAlmostEqual(0.693147, w[0], places=4)
+        self.assertTrue(numpy.isnan(w[1]))
+        self.assertAlmostEqual(2.079442, w[2], places=4)
+
+        provider = SimpleTermWeightProvider([('ba', 2), ('foo', 1), ('ba', 1), ('knark', 1),
+                                             ('knirk', 1), ('ba', 1), ('knark', 1)], missing=1)
+        numpy.testing.assert_array_almost_equal([.5, 1.], provider.weight_array(['ba', 'notfound']))
+
 
 class TestESTermAggregationWeightProvider(TestCase):
 
@@ -256,6 +291,56 @@ class TestESTermAggregationWeightProvider(TestCase):
         self.assertIsNone(provider['notfound'])
         self.assertEqual([('ba', .5)], list(provider['ba', 'notfound']))
 
+
+class TestESTermAggregationWeightProviderChunks(TestCase):
+    def test_chunks(self):
+        es = MockElasticsearch()
+        es.indices['test'] = dict((str(i), {'text': text}) for i, text in
+                                  enumerate(['foo', 'knark', 'ba', 'knirk', 'ba', 'ba', 'knark', 'ba knark+']))
+
+        provider = ESTermAggregationWeightProvider(es, 'test', 'doc', 'text', chunk_size=2, n_threads=2,
+                                                   missing='ignore')
+
+        weights = dict(provider['ba', 'foo', 'knark', 'knirk', 'knark+', 'notfound'])
+        self.assertEqual(['ba', 'foo', 'knark', 'knark+', 'knirk'], sorted(weights.keys()))
+        self.assertAlmostEqual(weights['ba'], .5)
+        self.assertAlmostEqual(weights['knark'], .25)
+        self.assertAlmostEqual(weights['knark+'], .125)
+        self.assertEqual(3, len(es.requests))
+        self.assertTrue(all(len(aggs['df']['terms']['include']) <= 2 for _, aggs in es.requests))
+
+        # the cached document count is used until refreshed
+        es.indices['test']['8'] = {'text': 'foo'}
+        self.assertAlmostEqual(.25, provider['foo'][1])
+        provider.refresh_doc_count()
+        self.assertAlmostEqual(2 / 9., provider['foo'][1])
+
+    def test_pool(self):
+        es = MockElasticsearch()
+        es.indices['test'] = dict((str(i), {'text': text}) for i, text in enumerate(['foo', 'knark', 'ba', 'ba']))
+
+        with ESTermAggregationWeightProvider(es, 'test', 'doc', 'text', chunk_size=1, n_threads=2) as provider:
+            self.assertEqual([('ba', .5), ('foo', .25)], provider['ba', 'foo'])
+            pool = provider._pool
+            self.assertIsNotNone(pool)
+
+        self.assertIsNone(provider._pool)
+        self.assertFalse(any(thread.is_alive() for thread in pool._pool))
+        # a new pool is started after close
+        self.assertEqual([('ba', .5), ('knark', .25)], provider['ba', 'knark'])
+        provider.close()
+
+        # the pool and lock are not pickled
+        provider.es = None
+        provider._get_pool()
+        copy = cPickle.loads(cPickle.dumps(provider))
+        self.assertIsNone(copy._pool)
+        self.assertEqual('text', copy.field)
+        copy._get_pool()
+        copy.close()
+        provider.close()
+
+
 class TestGensimIDFProvider(TestCase):
     def setUp(self):
         super(TestGensimIDFProvider, self).setUp()
@@ -306,6 +391,42 @@ class TestGensimIDFProvider(TestCase):
         self.assertIsNone(provider['notfound'])
         self.assertEqual([('ba', 1)], list(provider['ba', 'notfound']))
 
+    def test_idf_array_from_dictionary(self):
+        dictionary = Dictionary([['foo', 'ba'], ['knark', 'ba'], ['ba', 'knirk'], ['ba', 'knark']])
+        tfidf = TfidfModel(dictionary=dictionary, normalize=False)
+        idfs = idf_array_from_dictionary(dictionary)
+
+        self.assertEqual(len(dictionary), len(idfs))
+
+        for term_id, idf in tfidf.idfs.items():
+            self.assertAlmostEqual(idf, idfs[term_id], places=5)
+
+        # terms occurring in all documents get 0 weight instead of being dropped by the TfidfModel
+        self.assertEqual(0, idfs[dictionary.token2id['ba']])
+
+        # the zero IDF is clipped for the inverse and log weights
+        for kwargs in ({'sublinear': True}, {'inverse': True}, {'inverse': True, 'sublinear': True}):
+            provider = GensimIDFProvider(dictionary, missing='ignore', **kwargs)
+            weights = provider.weight_array(['ba', 'knark', 'notfound'])
+            self.assertTrue(numpy.isfinite(weights[:2]).all())
+            self.assertTrue(numpy.isnan(weights[2]))
+
+        weights = GensimIDFProvider(dictionary, sublinear=True).weight_array(['ba', 'knark', 'foo'])
+        self.assertTrue(weights[0] < weights[1] < weights[2])
+
+    def test_weight_array_for_ids(self):
+        provider = GensimIDFProvider(self.dictionary)
+        ids = [self.dictionary.token2id[term] for term in ['ba', 'knark', 'foo']]
+
+        numpy.testing.assert_array_almost_equal([1, 2, 3], provider.weight_array_for_ids(ids))
+        numpy.testing.assert_array_almost_equal([1, 2, 3], provider.weight_array(['ba', 'knark', 'foo']))
+        self.assertRaises(KeyError, lambda: provider.weight_array_for_ids([ids[0], 1000]))
+
+        provider = GensimIDFProvider(self.dictionary, missing='ignore', sublinear=True)
+        w = provider.weight_array_for_ids(numpy.array([ids[1], -1]))
+        self.assertAlmostEqual(0.693147, w[0], places=4)
+        self.assertTrue(numpy.isnan(w[1]))
+
 
 class TestESTermIndexWeightingProvider(TestCase):
     def setUp(self):
@@ -372,4 +493,23 @@ class TestESTermIndexWeightingProvider(TestCase):
         IndicesClient(self.es).refresh(self.index)
 
         self.assertIsNone(provider['notfound'])
-        self.assertEqual([('ba', 1)], list(provider['ba', 'notfound']))
\ No newline at end of file
+        self.assertEqual([('ba', 1)], list(provider['ba', 'notfound']))
+
+
+class TestESTermIndexWeightingProviderLookup(TestCase):
+    def test_term_doc_id(self):
+        self.assertEqual('ba', term_doc_id('ba'))
+        self.assertEqual(u'b\xe6', term_doc_id(u'b\xe6'))
+        self.assertTrue(term_doc_id('x' * 1000).startswith('sha1-'))
+        self.assertNotEqual(term_doc_id('x' * 1000), term_doc_id('x' * 1001))
+
+    def test_mget_chunks(self):
+        es = MockElasticsearch()
+        terms = ['term%d' % i for i in range(25)] + ['x' * 1000]
+        provider = ESTermIndexWeightingProvider(es, 'weights', initial_weights=[(term, 2) for term in terms],
+                                                mget_chunk_size=10, missing='ignore')
+        es.requests = []
+
+        weights = dict(provider[terms + ['notfound']])
+        self.assertEqual(sorted(terms), sorted(weights.keys()))
+        self.assertEqual([('mget', 10), ('mget', 10), ('mget', 7)], es.requests)
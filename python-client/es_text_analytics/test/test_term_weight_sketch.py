@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from es_text_analytics.term_weight_sketch import CountMinSketch, SketchDFProvider
+
+
+class TestCountMinSketch(TestCase):
+    def setUp(self):
+        super(TestCountMinSketch, self).setUp()
+
+        self.docs = [['ba', 'foo', 'ba'], ['ba', 'knark'], ['knark', u'b\xe6'], ['ba']]
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestCountMinSketch, self).tearDown()
+
+        shutil.rmtree(self.tmp_dir)
+
+    def test_estimate(self):
+        sketch = CountMinSketch(width=1024, depth=3).add_documents(self.docs)
+
+        self.assertEqual(4, sketch.n_doc)
+        self.assertEqual([3, 1, 2, 1, 0], sketch.estimate(['ba', 'foo', 'knark', u'b\xe6', 'notfound']).tolist())
+        self.assertEqual([('ba', 3), ('knark', 2)], sketch.most_common(2))
+
+    def test_never_underestimates(self):
+        docs = [['t%d' % (i % 50), 't%d' % (i % 7)] for i in range(500)]
+        terms = ['t%d' % i for i in range(50)]
+        expected = [sum(1 for doc in docs if term in doc) for term in terms]
+
+        for conservative in (True, False):
+            sketch = CountMinSketch(width=16, depth=2, conservative=conservative).update(docs, batch_size=30)
+            estimates = sketch.estimate(terms).tolist()
+
+            for term, count, estimate in zip(terms, expected, estimates):
+                self.assertGreaterEqual(estimate, count, term)
+
+        conservative = CountMinSketch(width=16, depth=2).update(docs, batch_size=1)
+        plain = CountMinSketch(width=16, depth=2, conservative=False).update(docs, batch_size=1)
+        self.assertLessEqual(sum(conservative.estimate(terms)), sum(plain.estimate(terms)))
+
+    def test_heavy_hitters(self):
+        docs = [['t%d' % j for j in range(i)] for i in range(20)]
+        sketch = CountMinSketch(width=1024, depth=3, heavy_hitters=3).update(docs, batch_size=2)
+
+        self.assertEqual([('t0', 19), ('t1', 18), ('t2', 17)], sketch.most_common())
+
+    def test_merge(self):
+        full = CountMinSketch(width=64, depth=3).add_documents(self.docs)
+        merged = CountMinSketch(width=64, depth=3).add_documents(self.docs[:2])
+        merged.merge(CountMinSketch(width=64, depth=3).add_documents(self.docs[2:]))
+
+        terms = ['ba', 'foo', 'knark', u'b\xe6']
+        self.assertEqual(full.n_doc, merged.n_doc)
+        self.assertEqual(full.estimate(terms).tolist(), merged.estimate(terms).tolist())
+        self.assertEqual(full.most_common(), merged.most_common())
+
+        self.assertRaises(ValueError, lambda: merged.merge(CountMinSketch(width=32, depth=3)))
+        self.assertRaises(ValueError, lambda: merged.merge(CountMinSketch(width=64, depth=3, seed=1)))
+
+    def test_save_load(self):
+        fn = os.path.join(self.tmp_dir, 'sketch.npz')
+        sketch = CountMinSketch(width=64, depth=3, seed=2).add_documents(self.docs)
+        sketch.save(fn)
+
+        loaded = CountMinSketch.load(fn)
+        terms = ['ba', 'foo', 'knark', u'b\xe6']
+        self.assertTrue(sketch.compatible(loaded))
+        self.assertEqual(4, loaded.n_doc)
+        self.assertEqual(sketch.estimate(terms).tolist(), loaded.estimate(terms).tolist())
+        self.assertEqual(sketch.most_common(), loaded.most_common())
+
+
+class TestSketchDFProvider(TestCase):
+    def test_weights(self):
+        docs = [{'text': 'Ba foo'}, {'text': 'ba knark'}, {'text': u'knark b\xe6'}, {'text': 'ba'}, {}]
+        provider = SketchDFProvider(CountMinSketch(width=1024, depth=3), inverse=True, missing='ignore')
+        provider.update(docs, 'text', batch_size=2)
+
+        self.assertEqual(5, provider.sketch.n_doc)
+        self.assertAlmostEqual(5 / 3., provider['ba'][1])
+        self.assertEqual(['ba', 'knark'], [term for term, _ in provider['ba', 'notfound', 'knark']])
+        self.assertAlmostEqual(5 / 2., provider['knark'][1])
+
+        self.assertRaises(KeyError, lambda: SketchDFProvider(provider.sketch)['notfound'])
@@ -0,0 +1,153 @@
+# coding=utf-8
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+
+from es_text_analytics import term_weight_store
+from es_text_analytics.term_weight_provider import ESTermAggregationWeightProvider
+from es_text_analytics.term_weight_store import weight_store_from_term_counts, weight_store_from_gensim_text, \
+    WeightStore, WeightStoreProvider, write_weight_store, weight_store_from_es
+from es_text_analytics.test.mock_es import MockElasticsearch
+
+
+class TestWeightStore(TestCase):
+    def setUp(self):
+        super(TestWeightStore, self).setUp()
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp_dir, 'weights.tws')
+
+    def tearDown(self):
+        super(TestWeightStore, self).tearDown()
+
+        shutil.rmtree(self.tmp_dir)
+
+    def test_weight_store(self):
+        weight_store_from_term_counts(self.fn, [('ba', 2), ('foo', 1), ('ba', 1), ('knark', 1),
+                                                ('knirk', 1), ('ba', 1), (u'bæ', 1)])
+        store = WeightStore(self.fn)
+
+        self.assertEqual(5, len(store))
+        self.assertEqual([(u'ba', .5), (u'bæ', .125), (u'foo', .125), (u'knark', .125), (u'knirk', .125)],
+                         sorted(store.iteritems()))
+
+        idx = store.indices(['knark', 'notfound', u'bæ'])
+        self.assertEqual(-1, idx[1])
+        self.assertEqual('knark', store.term(idx[0]))
+        self.assertEqual(u'bæ'.encode('utf-8'), store.term(idx[2]))
+
+    def test_hash_collisions(self):
+        term_hashes = term_weight_store.term_hashes
+
+        try:
+            # terms of the same length share a hash
+            term_weight_store.term_hashes = lambda terms: numpy.array([len(term) for term in terms], dtype='<u8')
+            weight_store_from_term_counts(self.fn, [('ba', 1), ('fo', 1), ('knark', 1), ('knirk', 1), ('x', 1),
+                                                    ('', 1)])
+            store = WeightStore(self.fn)
+
+            terms = ['knirk', 'ba', 'fo', 'x', 'knark', 'y', 'bar', 'knork', '']
+            self.assertEqual(terms[:5] + [None, None, None, ''],
+                             [store.term(i) if i >= 0 else None for i in store.indices(terms)])
+        finally:
+            term_weight_store.term_hashes = term_hashes
+
+    def test_empty_store(self):
+        write_weight_store(self.fn, {}, numpy.array([]))
+        store = WeightStore(self.fn)
+
+        self.assertEqual(0, len(store))
+        self.assertEqual([-1], list(store.indices(['ba'])))
+
+    def test_not_a_store(self):
+        with open(self.fn, 'wb') as f:
+            f.write('0\tba\t1\n' * 10)
+
+        self.assertRaises(ValueError, lambda: WeightStore(self.fn))
+
+    def test_weight_store_from_gensim_text(self):
+        text_fn = os.path.join(self.tmp_dir, 'dictionary.txt')
+
+        with open(text_fn, 'w') as f:
+            f.write('8\n0\tba\t4\n1\tfoo\t1\n2\tknark\t2\n3\tknirk\t1\n')
+
+        weight_store_from_gensim_text(text_fn, self.fn)
+
+        self.assertEqual([(u'ba', .5), (u'foo', .125), (u'knark', .25), (u'knirk', .125)],
+                         sorted(WeightStore(self.fn).iteritems()))
+
+    def test_provider(self):
+        weight_store_from_term_counts(self.fn, [('ba', 4), ('foo', 1), ('knark', 2), ('knirk', 1)])
+
+        provider = WeightStoreProvider(self.fn)
+        term, w = provider['ba']
+        self.assertEqual('ba', term)
+        self.assertAlmostEqual(.5, w)
+        self.assertEqual([('knark', .25), ('foo', .125)], provider[u'knark', 'foo'])
+        self.assertRaises(KeyError, lambda: provider['notfound'])
+
+        provider = WeightStoreProvider(self.fn, inverse=True, missing='ignore')
+        numpy.testing.assert_array_almost_equal([2., 8.], provider.weight_array(['ba', 'knirk']))
+        self.assertEqual([('ba', 2.)], provider['ba', 'notfound'])
+
+        self.assertRaises(ValueError, lambda: WeightStoreProvider(os.path.join(self.tmp_dir, 'notfound')))
+
+    def test_weight_store_from_es(self):
+        es = MockElasticsearch()
+        es.indices['test'] = dict((str(i), {'text': text}) for i, text in
+                                  enumerate(['foo', 'knark', 'ba', 'knirk', 'ba', 'ba', 'knark ba', u'b\xe6']))
+        terms = ['ba', 'foo', 'knark', 'knirk', u'b\xe6']
+        expected = ESTermAggregationWeightProvider(es, 'test', 'doc', 'text', inverse=True, sublinear=True)[terms]
+
+        weight_store_from_es(es, 'test', 'doc', 'text', self.fn, partition_size=5, num_partitions=3)
+        provider = WeightStoreProvider(self.fn, inverse=True, sublinear=True)
+        self.assertEqual(5, len(provider.store))
+
+        for (term, w), (expected_term, expected_w) in zip(provider[terms], expected):
+            self.assertEqual(expected_term, term)
+            self.assertAlmostEqual(expected_w, w, places=5)
+
+        # full partitions are split
+        del es.requests[:]
+        weight_store_from_es(es, 'test', 'doc', 'text', self.fn, partition_size=2, num_partitions=1)
+        provider = WeightStoreProvider(self.fn, inverse=True, sublinear=True)
+        self.assertEqual(5, len(provider.store))
+        self.assertEqual(terms, [term for term, _ in provider[terms]])
+        self.assertGreater(len(es.requests), 4)
+
+        weight_store_from_es(es, 'test', 'doc', 'text', self.fn, method='composite', partition_size=2)
+        provider = WeightStoreProvider(self.fn, inverse=True, sublinear=True)
+        self.assertEqual(5, len(provider.store))
+
+        for (term, w), (expected_term, expected_w) in zip(provider[terms], expected):
+            self.assertEqual(expected_term, term)
+            self.assertAlmostEqual(expected_w, w, places=5)
+
+        self.assertRaises(ValueError, lambda: weight_store_from_es(es, 'test', 'doc', 'text', self.fn, method='foo'))
+
+    def test_weight_store_from_es_partition_size(self):
+        es = MockElasticsearch()
+        es.indices['test'] = dict((str(i), {'text': text}) for i, text in
+                                  enumerate(['foo', 'knark', 'ba', 'knirk', 'ba', 'ba', 'knark ba', u'b\xe6']))
+
+        # single term partitions
+        weight_store_from_es(es, 'test', 'doc', 'text', self.fn, partition_size=1)
+        self.assertEqual(5, len(WeightStoreProvider(self.fn).store))
+
+        # a partition with exactly partition_size terms is complete
+        del es.requests[:]
+        weight_store_from_es(es, 'test', 'doc', 'text', self.fn, partition_size=5, num_partitions=1)
+        self.assertEqual(5, len(WeightStoreProvider(self.fn).store))
+        self.assertEqual(2, len(es.requests))
+
+        max_splits = term_weight_store.MAX_PARTITION_SPLITS
+
+        try:
+            term_weight_store.MAX_PARTITION_SPLITS = 1
+            self.assertRaises(ValueError, weight_store_from_es, es, 'test', 'doc', 'text', self.fn, partition_size=1,
+                              num_partitions=1)
+        finally:
+            term_weight_store.MAX_PARTITION_SPLITS = max_splits
@@ -1,14 +1,48 @@
 import numpy
 from numpy import array
+from scipy.sparse import issparse
 
-from sklext.term_estimators import joint_estimator_point, marginal_estimator
+from sklext.term_estimators import joint_estimator_point, marginal_estimator, joint_estimator_point_block, \
+    joint_counts_total, blocked_max
 
 
-def conditional_probabilities(X, y, ratio=False):
-    p_t_c = joint_estimator_point(X, y, smoothing=True)
+def _cp_block(block, X, y, p_t, p_c, total):
+    start, stop = block
+    m = joint_estimator_point_block(X, y, block, total, smoothing=True) / p_t
+
+    if p_c is not None:
+        m = m / p_c[start:stop]
+
+    return m
+
+
+def conditional_probabilities(X, y, ratio=False, block_size=None, n_jobs=1, backend='thread'):
+    """
+    Maximum conditional class probability over the classes for each term.
+
+    :param block_size: Compute the term/class matrix this many classes at a time keeping only a running maximum.
+        The default None computes the full matrix at once.
+    :type block_size: int|long|None
+    :param n_jobs: Number of class blocks computed concurrently when block_size is specified.
+    :type n_jobs: int|long
+    :param backend: 'thread' or 'process' pool for n_jobs > 1.
+    :type backend: str|unicode
+    :rtype : numpy.ndarray
+    """
     p_t = marginal_estimator(X, smoothing=True)
 
-    p_t.shape = 2,1
+    p_t.shape = -1, 1
+
+    if block_size:
+        p_c = marginal_estimator(y, smoothing=True) if ratio else None
+
+        if issparse(y):
+            y = y.tocsc()
+
+        return blocked_max(_cp_block, (X, y, p_t, p_c, joint_counts_total(X, y)),
+                           y.shape[1], block_size, n_jobs=n_jobs, backend=backend)
+
+    p_t_c = joint_estimator_point(X, y, smoothing=True)
 
     m = p_t_c / p_t
 
@@ -17,4 +51,4 @@ def conditional_probabilities(X, y, ratio=False):
 
         m = m / p_c
 
-    return array(numpy.max(m, axis=1)).flatten()
\ No newline at end of file
+    return array(numpy.max(m, axis=1)).flatten()
@@ -3,7 +3,10 @@ from math import log, e
 import numpy
 from numpy import array, zeros
 
-from sklext.term_estimators import marginal_estimator, joint_estimator_point, joint_estimator_full
+from scipy.sparse import issparse
+
+from sklext.term_estimators import marginal_estimator, joint_estimator_point, joint_estimator_full, \
+    joint_estimator_point_block, joint_counts_total, blocked_max
 
 
 def mutual_information(X, y):
@@ -27,15 +30,7 @@ def mutual_information(X, y):
     return ig
 
 
-def pointwise_mutual_information(X, y, normalize=False, k_weight=None, positive=None):
-    p_c = marginal_estimator(y, smoothing=True)
-    p_t = marginal_estimator(X, smoothing=True)
-
-    p_t.shape = 2, 1
-    p_c.shape = 1, 2
-
-    p_t_c = joint_estimator_point(X, y, smoothing=True)
-
+def _pmi(p_t_c, p_t, p_c, normalize=False, k_weight=None, positive=None):
     if k_weight:
         p_t_c = p_t_c**k_weight
 
@@ -50,4 +45,45 @@ def pointwise_mutual_information(X, y, normalize=False, k_weight=None, positive=
     if positive is 'exp':
         m = e**m
 
+    return m
+
+
+def _pmi_block(block, X, y, p_t, p_c, total, normalize, k_weight, positive):
+    start, stop = block
+    p_t_c = joint_estimator_point_block(X, y, block, total, smoothing=True)
+
+    return _pmi(p_t_c, p_t, p_c[:, start:stop], normalize=normalize, k_weight=k_weight, positive=positive)
+
+
+def pointwise_mutual_information(X, y, normalize=False, k_weight=None, positive=None,
+                                 block_size=None, n_jobs=1, backend='thread'):
+    """
+    Maximum pointwise mutual information over the classes for each term.
+
+    :param block_size: Compute the term/class matrix this many classes at a time keeping only a running maximum.
+        The default None computes the full matrix at once.
+    :type block_size: int|long|None
+    :param n_jobs: Number of class blocks computed concurrently when block_size is specified.
+    :type n_jobs: int|long
+    :param backend: 'thread' or 'process' pool for n_jobs > 1.
+    :type backend: str|unicode
+    :rtype : numpy.ndarray
+    """
+    p_c = marginal_estimator(y, smoothing=True)
+    p_t = marginal_estimator(X, smoothing=True)
+
+    p_t.shape = -1, 1
+    p_c.shape = 1, -1
+
+    if block_size:
+        if issparse(y):
+            y = y.tocsc()
+
+        return blocked_max(_pmi_block, (X, y, p_t, p_c, joint_counts_total(X, y), normalize, k_weight, positive),
+                           y.shape[1], block_size, n_jobs=n_jobs, backend=backend)
+
+    p_t_c = joint_estimator_point(X, y, smoothing=True)
+
+    m = _pmi(p_t_c, p_t, p_c, normalize=normalize, k_weight=k_weight, positive=positive)
+
     return array(numpy.max(m, axis=1)).flatten()
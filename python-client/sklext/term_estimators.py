@@ -1,9 +1,14 @@
 from itertools import izip
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
 import numpy
 from numpy import array, sum, zeros
 from scipy.sparse import issparse
 
+# per process state for class block workers, set by the pool initializer
+_block_worker_state = {}
+
 
 def add_smoothing(m, amount=10 ** -12):
     m = m.astype(numpy.float)
@@ -40,6 +45,128 @@ def joint_estimator_point(X, y, smoothing=False):
     return counts / numpy.sum(counts, dtype=numpy.float)
 
 
+def joint_counts_total(X, y):
+    """
+    Sum of all the joint term/class counts without materializing the term x class count matrix.
+
+    :rtype : float
+    """
+    if issparse(X):
+        t_counts = array(X.sum(axis=1)).flatten()
+    else:
+        t_counts = numpy.sum(X, axis=1)
+
+    if issparse(y):
+        c_counts = array(y.sum(axis=1)).flatten()
+    else:
+        c_counts = numpy.sum(y, axis=1)
+
+    return float(numpy.dot(t_counts, c_counts))
+
+
+def joint_estimator_point_block(X, y, block, total, smoothing=False):
+    """
+    Point estimates of the joint term/class probabilities for a block of classes.
+
+    Equivalent to the columns start:stop of joint_estimator_point, except that the normalizing total is passed
+    in (see joint_counts_total) and does not include the smoothing mass.
+
+    :param block: Tuple with start and stop class indices.
+    :type block: (int, int)
+    :param total: Total joint count used for normalizing.
+    :type total: float
+    :rtype : numpy.ndarray
+    :return: Dense terms x block size array.
+    """
+    start, stop = block
+    counts = X.T.dot(y[:, start:stop])
+
+    if issparse(counts):
+        counts = array(counts.todense())
+    else:
+        counts = array(counts)
+
+    if smoothing:
+        counts = add_smoothing(counts)
+
+    return counts / total
+
+
+def class_blocks(num_classes, block_size):
+    """
+    Split the class indices into contiguous blocks.
+
+    :rtype : list[(int, int)]
+    :return: List of start and stop indices.
+    """
+    return [(start, min(start + block_size, num_classes)) for start in xrange(0, num_classes, block_size)]
+
+
+def _block_max(func, block, args):
+    return array(numpy.max(func(block, *args), axis=1)).flatten()
+
+
+def _init_block_worker(func, args):
+    _block_worker_state['func'] = func
+    _block_worker_state['args'] = args
+
+
+def _run_block_worker(block):
+    return _block_max(_block_worker_state['func'], block, _block_worker_state['args'])
+
+
+def blocked_max(func, args, num_classes, block_size, n_jobs=1, backend='thread'):
+    """
+    Computes the maximum value for each term over all classes one class block at a time, keeping only the running
+    maximum in memory. Peak memory is bounded by the block size (times the number of jobs) instead of the
+    number of classes.
+
+    :param func: Module level function taking a (start, stop) block followed by args and returning a
+        terms x block size array.
+    :type func: function
+    :param args: Extra arguments for func.
+    :type args: tuple
+    :param num_classes: Total number of classes.
+    :type num_classes: int|long
+    :param block_size: Number of classes in each block.
+    :type block_size: int|long
+    :param n_jobs: Number of blocks computed concurrently.
+    :type n_jobs: int|long
+    :param backend: 'thread' or 'process' pool when n_jobs > 1.
+    :type backend: str|unicode
+    :rtype : numpy.ndarray
+    :raise ValueError: On unknown backend.
+    """
+    blocks = class_blocks(num_classes, block_size)
+    pool = None
+
+    if n_jobs == 1:
+        results = (_block_max(func, block, args) for block in blocks)
+    elif backend == 'thread':
+        pool = ThreadPool(n_jobs)
+        results = pool.imap_unordered(lambda block: _block_max(func, block, args), blocks)
+    elif backend == 'process':
+        pool = Pool(n_jobs, initializer=_init_block_worker, initargs=(func, args))
+        results = pool.imap_unordered(_run_block_worker, blocks)
+    else:
+        raise ValueError('Unknown backend %s ...' % backend)
+
+    m = None
+
+    try:
+        for block_max in results:
+            if m is None:
+                m = block_max
+            else:
+                numpy.maximum(m, block_max, out=m)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    return m
+
+
 def joint_estimator_full_sparse(X, y, smoothing=False):
     _, t = X.shape
     _, c = y.shape
@@ -1,40 +1,168 @@
-from scipy.sparse import spdiags
+from math import ceil
+
+import numpy
+from scipy.sparse import csr_matrix, spdiags
 from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils.validation import check_is_fitted
 
 from sklext.cond_prob import conditional_probabilities
 from sklext.mutual_information import mutual_information, pointwise_mutual_information
 
 
+def top_k_indices(weights, k):
+    """
+    Find the indices of the k largest weights using partial selection (O(n) instead of a full sort).
+
+    :param weights: Term weight vector.
+    :type weights: numpy.ndarray
+    :param k: Number of indices to keep.
+    :type k: int|long
+    :rtype : numpy.ndarray
+    :return: The selected indices in ascending order, ie. the column order of the original matrix is kept.
+    """
+    weights = numpy.asarray(weights).ravel()
+    n = weights.shape[0]
+
+    if k >= n:
+        return numpy.arange(n)
+    if k <= 0:
+        return numpy.array([], dtype=numpy.intp)
+
+    idx = numpy.argpartition(-weights, k - 1)[:k]
+    idx.sort()
+
+    return idx
+
+
+def selection_size(n, k=None, percentile=None):
+    """
+    Number of terms to keep out of n given either an absolute number or a percentage.
+
+    :param n: Total number of terms.
+    :type n: int|long
+    :param k: Number of terms to keep.
+    :type k: int|long|None
+    :param percentile: Percentage of terms to keep. Ignored if k is specified.
+    :type percentile: int|long|float|None
+    :rtype : int|long
+    :raise ValueError: When neither k nor percentile is specified.
+    """
+    if k is not None:
+        return min(k, n)
+
+    if percentile is None:
+        raise ValueError('Either k or percentile must be specified ...')
+
+    return int(ceil(n * percentile / 100.))
+
+
+def select_terms(X, weights, k=None, percentile=None):
+    """
+    Reduce a document term matrix to the best weighted term columns.
+
+    :param X: Document term matrix.
+    :type X: numpy.ndarray|scipy.sparse.spmatrix
+    :param weights: Term weight vector with one value for each column in X.
+    :type weights: numpy.ndarray
+    :param k: Number of terms to keep.
+    :type k: int|long|None
+    :param percentile: Percentage of terms to keep. Ignored if k is specified.
+    :type percentile: int|long|float|None
+    :rtype : (scipy.sparse.csr_matrix, numpy.ndarray)
+    :return: The column reduced matrix in CSR format and the indices of the kept columns.
+    :raise ValueError: When neither k nor percentile is specified.
+    """
+    idx = top_k_indices(weights, selection_size(len(weights), k=k, percentile=percentile))
+
+    return csr_matrix(X)[:, idx], idx
+
+
 class TermWeightTransformer(BaseEstimator, TransformerMixin):
-    def __init__(self, method='mi', pmi_k=2):
+    def __init__(self, method='mi', pmi_k=2, k=None, percentile=None, block_size=None, n_jobs=1):
+        """
+        :param method: Term weighting method (mi, pmi, npmi, ppmi_exp, pmi_k, ppmi, cp_raw, cp_ratio).
+        :type method: str|unicode
+        :param pmi_k: Exponent for the pmi_k method.
+        :type pmi_k: int|long|float
+        :param k: Keep only the k best weighted terms when transforming.
+        :type k: int|long|None
+        :param percentile: Keep only this percentage of the best weighted terms when transforming. Ignored if k
+            is specified.
+        :type percentile: int|long|float|None
+        :param block_size: Number of classes processed at a time by the pmi and cp methods. None processes all classes
+            at once.
+        :type block_size: int|long|None
+        :param n_jobs: Number of class blocks processed concurrently.
+        :type n_jobs: int|long
+        """
         self.method = method
         self.pmi_k = pmi_k
-
-        self._weights = None
+        self.k = k
+        self.percentile = percentile
+        self.block_size = block_size
+        self.n_jobs = n_jobs
 
     def fit(self, X, y):
+        blocking = dict(block_size=self.block_size, n_jobs=self.n_jobs)
+
         if self.method is 'mi':
             self._weights = mutual_information(X, y)
         elif self.method is 'pmi':
-            self._weights = pointwise_mutual_information(X, y, normalize=False)
+            self._weights = pointwise_mutual_information(X, y, normalize=False, **blocking)
         elif self.method is 'npmi':
-            self._weights = pointwise_mutual_information(X, y, normalize=True)
+            self._weights = pointwise_mutual_information(X, y, normalize=True, **blocking)
         elif self.method is 'ppmi_exp':
-            self._weights = pointwise_mutual_information(X, y, normalize=True, positive='exp')
+            self._weights = pointwise_mutual_information(X, y, normalize=True, positive='exp', **blocking)
         elif self.method is 'pmi_k':
-            self._weights = pointwise_mutual_information(X, y, normalize=True, k_weight=self.pmi_k)
+            self._weights = pointwise_mutual_information(X, y, normalize=True, k_weight=self.pmi_k, **blocking)
         elif self.method is 'ppmi':
-            self._weights = pointwise_mutual_information(X, y, normalize=False, positive='cutoff')
+            self._weights = pointwise_mutual_information(X, y, normalize=False, positive='cutoff', **blocking)
         elif self.method is 'cp_raw':
-            self._weights = conditional_probabilities(X, y, ratio=False)
+            self._weights = conditional_probabilities(X, y, ratio=False, **blocking)
         elif self.method is 'cp_ratio':
-            self._weights = conditional_probabilities(X, y, ratio=True)
+            self._weights = conditional_probabilities(X, y, ratio=True, **blocking)
         else:
             raise ValueError
 
+        self._support = None
+
+        if self.k is not None or self.percentile is not None:
+            n = selection_size(len(self._weights), k=self.k, percentile=self.percentile)
+            self._support = top_k_indices(self._weights, n)
+
         return self
 
+    def get_support(self, indices=False):
+        """
+        Returns the terms kept by the transformer when k or percentile is specified.
+
+        :param indices: Return the column indices instead of a boolean mask.
+        :type indices: bool
+        :rtype : numpy.ndarray
+        :raise sklearn.exceptions.NotFittedError: If called before fit.
+        """
+        check_is_fitted(self, '_weights')
+
+        p = len(self._weights)
+        support = self._support if self._support is not None else numpy.arange(p)
+
+        if indices:
+            return support
+
+        mask = numpy.zeros(p, dtype=bool)
+        mask[support] = True
+
+        return mask
+
     def transform(self, X, y=None):
+        check_is_fitted(self, '_weights')
+
+        if self._support is not None:
+            w = self._weights[self._support]
+            p = len(w)
+
+            return csr_matrix(X)[:, self._support] * spdiags(w, 0, p, p)
+
         p = len(self._weights)
         w_diag = spdiags(self._weights, 0, p, p)
 
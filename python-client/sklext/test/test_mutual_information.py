@@ -1,9 +1,11 @@
 from unittest import TestCase
 
 from numpy import array
+from numpy.random import RandomState
 from numpy.ma.testutils import assert_array_approx_equal
 from scipy.sparse.csr import csr_matrix
 
+from sklext.cond_prob import conditional_probabilities
 from sklext.mutual_information import mutual_information, pointwise_mutual_information
 
 
@@ -30,3 +32,35 @@ class TestMutualInformation(TestCase):
         assert_array_approx_equal(pointwise_mutual_information(X, y), [0.1178, 0.1178], decimal=3)
         assert_array_approx_equal(pointwise_mutual_information(csr_matrix(X), csr_matrix(y)),
                                   [0.1178, 0.1178], decimal=3)
+
+    def test_pointwise_mutual_information_blocked(self):
+        rs = RandomState(42)
+        X = (rs.rand(40, 7) > .6).astype(int)
+        y = (rs.rand(40, 9) > .8).astype(int)
+
+        for kwargs in [{}, {'normalize': True}, {'positive': 'cutoff'}, {'normalize': True, 'k_weight': 2}]:
+            expected = pointwise_mutual_information(X, y, **kwargs)
+
+            assert_array_approx_equal(pointwise_mutual_information(X, y, block_size=2, **kwargs), expected, decimal=5)
+            assert_array_approx_equal(pointwise_mutual_information(csr_matrix(X), csr_matrix(y), block_size=4,
+                                                                   **kwargs),
+                                      expected, decimal=5)
+            assert_array_approx_equal(pointwise_mutual_information(X, y, block_size=3, n_jobs=2, **kwargs),
+                                      expected, decimal=5)
+
+        assert_array_approx_equal(pointwise_mutual_information(csr_matrix(X), csr_matrix(y), block_size=3, n_jobs=2,
+                                                               backend='process'),
+                                  pointwise_mutual_information(X, y), decimal=5)
+
+    def test_conditional_probabilities_blocked(self):
+        rs = RandomState(42)
+        X = (rs.rand(40, 7) > .6).astype(int)
+        y = (rs.rand(40, 9) > .8).astype(int)
+
+        for ratio in [False, True]:
+            expected = conditional_probabilities(X, y, ratio=ratio)
+
+            assert_array_approx_equal(conditional_probabilities(X, y, ratio=ratio, block_size=2), expected, decimal=5)
+            assert_array_approx_equal(conditional_probabilities(csr_matrix(X), csr_matrix(y), ratio=ratio,
+                                                                block_size=4, n_jobs=2),
+                                      expected, decimal=5)
@@ -4,7 +4,8 @@ from numpy import array
 from numpy.ma.testutils import assert_array_approx_equal
 from scipy.sparse import csr_matrix
 
-from sklext.term_estimators import joint_estimator_point, joint_estimator_full
+from sklext.term_estimators import joint_estimator_point, joint_estimator_full, class_blocks, joint_counts_total, \
+    joint_estimator_point_block
 
 
 class TestTermEstimators(TestCase):
@@ -38,4 +39,24 @@ class TestTermEstimators(TestCase):
                                    [[.0 , .1667], [.0833, .0833]],
                                    [[.0 , .0833], [.0833, .0]],
                                    [[.0833, .0], [.0, .0833]]],
-                                  decimal=3)
\ No newline at end of file
+                                  decimal=3)
+
+    def test_joint_estimator_point_block(self):
+        X = array([[0, 1],
+                   [1, 0],
+                   [1, 1]])
+        y = array([[0, 1, 1],
+                   [1, 0, 0],
+                   [1, 0, 1]])
+
+        total = joint_counts_total(X, y)
+        self.assertEqual(total, joint_counts_total(csr_matrix(X), csr_matrix(y)))
+        self.assertEqual(total, X.T.dot(y).sum())
+
+        assert_array_approx_equal(joint_estimator_point_block(X, y, (1, 3), total), joint_estimator_point(X, y)[:, 1:3])
+        assert_array_approx_equal(joint_estimator_point_block(csr_matrix(X), csr_matrix(y).tocsc(), (0, 1), total),
+                                  joint_estimator_point(X, y)[:, 0:1])
+
+    def test_class_blocks(self):
+        self.assertEqual([(0, 2), (2, 4), (4, 5)], class_blocks(5, 2))
+        self.assertEqual([(0, 5)], class_blocks(5, 10))
@@ -5,8 +5,9 @@ from numpy import array
 from numpy.ma.testutils import assert_array_approx_equal
 from scipy.sparse import issparse
 from scipy.sparse.csgraph._min_spanning_tree import csr_matrix
+from sklearn.exceptions import NotFittedError
 
-from sklext.term_weighting import TermWeightTransformer
+from sklext.term_weighting import TermWeightTransformer, top_k_indices, select_terms
 
 
 class TestTermWeightTransformer(TestCase):
@@ -99,3 +100,53 @@ class TestTermWeightTransformer(TestCase):
                                                          [0.1700, 0.],
                                                          [0.1700, 0.0850]]),
                                   decimal=3)
+
+    def test_select_k(self):
+        X = array([[0, 1, 1],
+                   [1, 0, 0],
+                   [1, 1, 0]])
+        y = array([[0, 1],
+                   [1, 0],
+                   [1, 0]])
+
+        transformer = TermWeightTransformer(method='mi', k=2)
+        self.assertRaises(NotFittedError, transformer.get_support)
+        self.assertRaises(NotFittedError, transformer.transform, X)
+        transformer.fit(X, y)
+        newX = transformer.transform(X)
+
+        self.assertEqual([0, 2], list(transformer.get_support(indices=True)))
+        self.assertEqual([True, False, True], list(transformer.get_support()))
+        assert_true(issparse(newX))
+        self.assertEqual((3, 2), newX.shape)
+        assert_array_approx_equal(newX.todense(), array(X[:, [0, 2]] * transformer._weights[[0, 2]]), decimal=3)
+
+        transformer = TermWeightTransformer(method='mi', percentile=34)
+        transformer.fit(csr_matrix(X), csr_matrix(y))
+
+        self.assertEqual([0, 2], list(transformer.get_support(indices=True)))
+
+
+class TestTermSelection(TestCase):
+    def test_top_k_indices(self):
+        weights = array([.1, .5, .3, .9, .2])
+
+        self.assertEqual([1, 3], list(top_k_indices(weights, 2)))
+        self.assertEqual([3], list(top_k_indices(weights, 1)))
+        self.assertEqual([0, 1, 2, 3, 4], list(top_k_indices(weights, 10)))
+        self.assertEqual([], list(top_k_indices(weights, 0)))
+
+    def test_select_terms(self):
+        X = array([[1, 2, 3, 4],
+                   [5, 6, 7, 8]])
+        weights = array([.4, .1, .3, .2])
+
+        newX, idx = select_terms(X, weights, k=2)
+        assert_true(issparse(newX))
+        self.assertEqual([0, 2], list(idx))
+        assert_array_approx_equal(newX.todense(), array([[1, 3], [5, 7]]))
+
+        newX, idx = select_terms(csr_matrix(X), weights, percentile=75)
+        self.assertEqual([0, 2, 3], list(idx))
+
+        self.assertRaises(ValueError, lambda: select_terms(X, weights))